@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2022 Hanson Robotics.
+#
+# This file is part of Hanson AI.
+# See https://www.hansonrobotics.com/hanson-ai for further info.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import scservo_sdk as sdk
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the SDK hot paths on an in-memory bus", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=2000, help='Cycles per benchmark')
+    parser.add_argument("--alloc_cycles", type=int, default=100, help='Cycles traced with tracemalloc for the allocation numbers')
+    parser.add_argument("--servos", type=int, default=12, help='Number of simulated servos for the group and ping benchmarks')
+    parser.add_argument("--baud", type=int, default=1000000, help='Baudrate of the simulated bus')
+    parser.add_argument("--protocol", type=int, default=0, help='SCS Protocol')
+    parser.add_argument("--only", type=str, default=None, help='Comma separated list of benchmarks to run')
+    parser.add_argument("--output", type=str, default=None, help='Write the JSON results to this file instead of stdout')
+    parser.add_argument("--compare", type=str, default=None, help='JSON results of an earlier run, prints the change of us per cycle')
+    args = parser.parse_args()
+    return vars(args)
+# Global dictionary for args
+args = argument_parser()
+
+
+class LoopbackPort(sdk.PortHandler):
+    # Port without a wire: writes are dropped, reads return the canned reply bytes for the id written to
+    def __init__(self):
+        super(LoopbackPort, self).__init__('loopback')
+        self.is_open = True
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        self.reply = b''
+        self.replies = {}  # id: reply, ids not in it get reply
+        self.rx = b''
+
+    def clearPort(self):
+        pass
+
+    def writePort(self, packet):
+        self.rx = self.replies.get(packet[sdk.PKT_ID], self.reply)
+        return len(packet)
+
+    def readPort(self, length):
+        data = self.rx[:length]
+        self.rx = self.rx[length:]
+        return data
+
+    def getBytesAvailable(self):
+        return len(self.rx)
+
+    def waitPort(self):
+        return bool(self.rx)
+
+
+def status_packet(scs_id, params=()):
+    packet = [0xFF, 0xFF, scs_id, len(params) + 2, 0] + list(params)
+    return bytes(packet + [~sum(packet[2:]) & 0xFF])
+
+
+def loopback_port():
+    port = LoopbackPort()
+    port.tx_time_per_byte = (1000.0 / args['baud']) * 10.0
+    return port
+
+
+# Every benchmark returns (cycle function, packets per cycle)
+
+def bench_tx_packet(ph):
+    # checksum and write of a prepared WRITE packet
+    port = LoopbackPort()
+    txpacket = bytearray(9)
+    txpacket[sdk.PKT_ID] = 1
+    txpacket[sdk.PKT_LENGTH] = 5
+    txpacket[sdk.PKT_INSTRUCTION] = sdk.INST_WRITE
+    txpacket[sdk.PKT_PARAMETER0:sdk.PKT_PARAMETER0 + 3] = bytes([42, 0x00, 0x08])
+
+    def cycle():
+        ph.txPacket(port, txpacket)
+        port.is_using = False
+    return cycle, 1
+
+
+def bench_encode_write(ph):
+    # encoder plus tx of a 2 byte write without status packet
+    port = LoopbackPort()
+
+    def cycle():
+        ph.write2ByteTxOnly(port, 1, 42, 2048)
+    return cycle, 1
+
+
+def bench_rx_packet(ph):
+    # parsing of one status packet carrying 2 bytes
+    port = LoopbackPort()
+    reply = status_packet(1, [0x00, 0x08])
+
+    def cycle():
+        port.rx = reply
+        port.setPacketTimeout(8)
+        ph.rxPacket(port)
+    return cycle, 1
+
+
+def bench_read_txrx(ph):
+    # full READ transaction without wire time
+    port = LoopbackPort()
+    port.reply = status_packet(1, [0x00, 0x08])
+
+    def cycle():
+        ph.read2ByteTxRx(port, 1, 56)
+    return cycle, 2
+
+
+def bench_sync_read(ph):
+    # GroupSyncRead of present_position and present_speed from every servo, replies canned
+    port = loopback_port()
+    port.replies[sdk.BROADCAST_ID] = b''.join(status_packet(scs_id, [0x00, 0x08, 0x00, 0x00])
+                                              for scs_id in range(1, args['servos'] + 1))
+    group = sdk.GroupSyncRead(port, ph, 56, 4)
+    for scs_id in range(1, args['servos'] + 1):
+        group.addParam(scs_id)
+
+    def cycle():
+        group.txRxPacket()
+    return cycle, args['servos'] + 1
+
+
+def bench_sync_write(ph):
+    # new goal_position for every servo and one SYNC_WRITE
+    port = loopback_port()
+    group = sdk.GroupSyncWrite(port, ph, 42, 2)
+    ids = range(1, args['servos'] + 1)
+    for scs_id in ids:
+        group.addParam(scs_id, [0, 8])
+    step = [0]
+
+    def cycle():
+        step[0] = (step[0] + 1) & 0xFF
+        for scs_id in ids:
+            group.changeParam(scs_id, [step[0], 8])
+        group.txPacket()
+    return cycle, 1
+
+
+def bench_ping_scan(ph):
+    # ping of the servos and as many missing ids, model number not read. Missing ids
+    # time out at once, so only the handler overhead of a miss is measured
+    port = loopback_port()
+    for scs_id in range(1, args['servos'] + 1):
+        port.replies[scs_id] = status_packet(scs_id)
+    ids = range(1, 2 * args['servos'] + 1)
+
+    def cycle():
+        for scs_id in ids:
+            ph.ping(port, scs_id, 0, read_model=False)
+    return cycle, len(ids)
+
+
+BENCHMARKS = {
+    'tx_packet': bench_tx_packet,
+    'encode_write': bench_encode_write,
+    'rx_packet': bench_rx_packet,
+    'read_txrx': bench_read_txrx,
+    'sync_read': bench_sync_read,
+    'sync_write': bench_sync_write,
+    'ping_scan': bench_ping_scan,
+}
+
+
+def run(name, ph):
+    cycle, packets = BENCHMARKS[name](ph)
+    # a ping scan is a whole sweep of ids, far slower than one packet
+    cycles = args['cycles'] if name != 'ping_scan' else max(1, args['cycles'] // 100)
+
+    for _ in range(min(cycles, 100)):  # warm up caches and encoders
+        cycle()
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(cycles):
+        cycle()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    # clear_traces resets the peak, so the peak is what one cycle allocates at most
+    alloc_cycles = min(cycles, args['alloc_cycles'])
+    peak = 0
+    tracemalloc.start()
+    for _ in range(alloc_cycles):
+        tracemalloc.clear_traces()
+        cycle()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    # blocks and bytes still held after alloc_cycles more cycles, in the same tracing session.
+    # The snapshots leave out what tracemalloc allocates itself
+    tracemalloc.clear_traces()
+    exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = tracemalloc.take_snapshot().filter_traces(exclude)
+    for _ in range(alloc_cycles):
+        cycle()
+    after = tracemalloc.take_snapshot().filter_traces(exclude)
+    tracemalloc.stop()
+    diff = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in diff)
+    retained = sum(stat.size_diff for stat in diff)
+
+    return {
+        'cycles': cycles,
+        'packets_per_cycle': packets,
+        'us_per_cycle': wall / cycles * 1000000.0,
+        'cpu_us_per_cycle': cpu / cycles * 1000000.0,
+        'packets_per_sec': packets * cycles / wall if wall else 0.0,
+        'alloc_peak_bytes_per_cycle': peak,
+        'alloc_blocks_per_cycle': blocks / float(alloc_cycles) if alloc_cycles else 0.0,
+        'retained_bytes_per_cycle': retained / float(alloc_cycles) if alloc_cycles else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    for name, result in sorted(results.items()):
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        change = (result['us_per_cycle'] / before['us_per_cycle'] - 1.0) * 100.0
+        print("%-14s %10.2f us -> %10.2f us  %+6.1f%%" % (name, before['us_per_cycle'], result['us_per_cycle'], change), file=sys.stderr)
+
+
+def main():
+    sdk.SCS_SETEND(args['protocol'])
+    ph = sdk.PacketHandler(args['protocol'])
+    names = args['only'].split(',') if args['only'] else list(BENCHMARKS)
+
+    results = {}
+    for name in names:
+        results[name] = run(name, ph)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.time(),
+        'settings': dict((key, args[key]) for key in ('cycles', 'servos', 'baud', 'protocol')),
+        'results': results,
+    }
+
+    if args['compare']:
+        with open(args['compare']) as f:
+            compare(results, json.load(f))
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=4, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2022 Hanson Robotics.
+#
+# This file is part of Hanson AI.
+# See https://www.hansonrobotics.com/hanson-ai for further info.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from sys import exit
+import argparse
+import asyncio
+from serial.tools.list_ports import grep as grep_serial_ports
+import scservo_sdk as sdk
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Serve all feetech servo boards to many clients over a Unix socket", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    # By default we search for all CH430 ports with
+    parser.add_argument("--hardware_regex", type=str, default='1A86:7523', help='Serial port filter for detecting multiple boards')
+    parser.add_argument("--ports", type=str, default=None, help='Comma separated list of serial ports, overrides --hardware_regex')
+    parser.add_argument("--baud", type=int, default=1000000, help='Baudrate')
+    parser.add_argument("--protocol", '-p', type=int, default=0, help='SCS Protocol')
+    parser.add_argument("--socket", type=str, default=sdk.BUS_SERVER_PATH, help='Unix socket path the clients connect to')
+    parser.add_argument("--window", type=float, default=sdk.BUS_BATCH_WINDOW_MS, help='Time in ms requests are collected before a batch is sent to the bus')
+    args = parser.parse_args()
+    return vars(args)
+# Global dictionary for args
+args = argument_parser()
+
+def open_ports():
+    if args['ports']:
+        names = args['ports'].split(',')
+    else:
+        names = [p.device for p in grep_serial_ports(args['hardware_regex'])]
+    ports = []
+    for name in names:
+        port = sdk.AsyncPortHandler(name)
+        try:
+            if port.openPort() and port.setBaudRate(args['baud']):
+                ports.append(port)
+                continue
+        except Exception as e:
+            print(e)
+        print(f"Cant open port {name}")
+    return ports
+
+def main():
+    ports = open_ports()
+    if not ports:
+        print("No port to serve")
+        exit(1)
+    handler = sdk.AsyncPacketHandler(args['protocol'])
+    server = sdk.BusServer(ports, handler, args['socket'], args['window'])
+    print(f"Serving {', '.join(port.getPortName() for port in ports)} on {args['socket']}")
+    failed = False
+    try:
+        asyncio.run(server.serveForever())
+    except KeyboardInterrupt:
+        pass
+    except (RuntimeError, OSError) as e:
+        # another server owns the socket, or it cannot be created
+        print(e)
+        failed = True
+    for port in ports:
+        port.closePort()
+    if failed:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
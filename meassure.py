@@ -24,12 +24,13 @@ import time
 import scservo_sdk as sdk
 import matplotlib.pyplot as plt
 
-# Control table address
-ADDR_SCS_TORQUE_ENABLE     = 40
-ADDR_SCS_GOAL_ACC          = 41
-ADDR_SCS_GOAL_POSITION     = 42
-ADDR_SCS_GOAL_SPEED        = 46
-ADDR_SCS_PRESENT_POSITION  = 56
+# Control table address, same for SCS and STS servos
+CONTROL_TABLE = sdk.STS_CONTROL_TABLE
+ADDR_SCS_TORQUE_ENABLE     = CONTROL_TABLE['torque_enable'].address
+ADDR_SCS_GOAL_ACC          = CONTROL_TABLE['goal_acc'].address
+ADDR_SCS_GOAL_POSITION     = CONTROL_TABLE['goal_position'].address
+ADDR_SCS_GOAL_SPEED        = CONTROL_TABLE['goal_speed'].address
+ADDR_SCS_PRESENT_POSITION  = CONTROL_TABLE['present_position'].address
 MOVING_THRESHOLD = 5
 STEPS_IN_DEG = {
     0: 11.38,
@@ -47,6 +48,7 @@ def argument_parser():
     parser.add_argument("--goback", type=bool, default=False, help='Meassures time to get back to initial position as well')
     parser.add_argument("--title", type=str, default="Servo Position", help='Title for graph')
     parser.add_argument("--percieved", type=int, default=0, help='Remove first n percent of movement, to show percieved stats')
+    parser.add_argument("--retries", type=int, default=0, help='Times a goal write or position read is sent again when its status packet is lost or corrupt')
 
     args = parser.parse_args()
     return vars(args)
@@ -62,8 +64,7 @@ def plot(x, y, xlabel='Time (s)', ylabel='Degrees', title='Servo Position'):
 
 
 def move_to(group_sync_write, id, position):
-    param_goal_position = [sdk.SCS_LOBYTE(position), sdk.SCS_HIBYTE(position)]
-    group_sync_write.addParam(id, param_goal_position)
+    group_sync_write.setParamArray([id], [position])
     group_sync_write.txPacket()
     group_sync_write.clearParam()
 
@@ -94,6 +95,7 @@ def main():
     print(args['protocol'])
 
     packets = sdk.PacketHandler(args['protocol'])
+    packets.setRetryPolicy(sdk.RetryPolicy(max_attempts=args['retries'] + 1))
     if not port.openPort() and port.setBaudRate(args['baud']):
         print(f"Cant Open port {args['port']}")
         return
@@ -19,7 +19,9 @@
 #
 from sys import exit
 import argparse
+import asyncio
 import json
+import time
 from pprint import pprint as pp
 from serial.tools.list_ports import grep as grep_serial_ports
 import scservo_sdk as sdk
@@ -30,8 +32,14 @@ def argument_parser():
     # By default we search for all CH430 ports with
     parser.add_argument("--hardware_regex", type=str, default='1A86:7523', help='Serial port filter for detecting multiple boards or specify single board')
     parser.add_argument("--baud", type=int, default=1000000, help='Baudrate')
+    parser.add_argument("--bauds", type=str, default=None, help='Comma separated list of baudrates to sweep on every port, overrides --baud')
     parser.add_argument("--from_id", type=int, default=0, help='From ID')
     parser.add_argument("--to_id", type=int, default=110, help='To ID')
+    parser.add_argument("--timeout", type=float, default=3.0, help='Time in ms to wait for a missing servo on top of the wire time. Raised automatically if found servos answer slower')
+    parser.add_argument("--calibrate", type=int, default=0, help='Pings sent to every found servo to calibrate the packet timeouts of its port, saved to --timeouts')
+    parser.add_argument("--timeouts", type=str, default=sdk.TIMEOUT_CALIBRATION_PATH, help='File of the calibrated packet timeouts used by rw.py --timeouts')
+    parser.add_argument("--topology", type=str, default=sdk.TOPOLOGY_PATH, help='Cache of the found servos used by rw.py, the scanned ids are refreshed. Empty to leave it alone')
+    parser.add_argument("--skip_model", type=bool, default=False, help='Do not read model numbers, reports model 0 for every servo')
     parser.add_argument("--json", type=bool, default=False, help="Output as JSON")
     parser.add_argument("--find_any", type=bool, default=False, help="If True, will print motor ID and return immediatly after found, if none servo found it will fail with exit code 1")
     args = parser.parse_args()
@@ -39,31 +47,108 @@ def argument_parser():
 # Global dictionary for args
 args = argument_parser()
 
-def pingservos(port, baud, from_id, to_id):
-    port = sdk.PortHandler(port)
-    # Ping does not depend on the protocol version so can use 0 by default
-    handler = sdk.PacketHandler(0)
+def baudrates():
+    if args['bauds']:
+        return [int(b) for b in args['bauds'].split(',')]
+    return [args['baud']]
+
+async def pingservos(port, handler, from_id, to_id, found):
+    # Servos answering a ping on this port at its current baudrate.
+    # The timeout for missing ids is the wire time of the ping and its reply plus
+    # args['timeout'], at least twice the slowest answer seen so far
+    wire_time = port.tx_time_per_byte * 12  # PING + status packet
+    timeout = wire_time + args['timeout']
     servos = []
+    for id in range(from_id, to_id+1):
+        if found.is_set():
+            break
+        start = time.perf_counter()
+        # Model number is read later, only for servos that answered
+        _, result, error = await handler.ping(port, id, timeout_ms=timeout, read_model=False)
+        if result == sdk.COMM_SUCCESS:
+            timeout = max(timeout, (time.perf_counter() - start) * 2000.0)
+            servos.append((id, 0))
+            if args['find_any']:
+                found.set()
+                break
+    if not args['skip_model']:
+        for i, (id, _) in enumerate(servos):
+            data, result, error = await handler.readTxRx(port, id, 3, 2)  # Address 3 : Model Number
+            if result == sdk.COMM_SUCCESS:
+                servos[i] = (id, sdk.SCS_MAKEWORD(data[0], data[1]))
+    return servos
+
+async def calibrate(port, info, handler, servos):
+    # round trips of the found servos at the current baudrate, timeouts saved for rw.py --timeouts
+    calibration = sdk.TimeoutCalibration(port, port_info=info)
+    for id, _ in servos:
+        for _ in range(args['calibrate']):
+            _, result, _ = await handler.ping(port, id, read_model=False)
+            calibration.record(id, result, 6)
+    calibration.update()
+    calibration.save(args['timeouts'])
+
+async def scan_port(info, handler, found):
+    # {baud: [(id, model)]} for every baudrate servos answered at
+    port = sdk.AsyncPortHandler(info.device)
+    # Ping does not depend on the protocol version so can use 0 by default
+    bauds = {}
     try:
         port.openPort()
-        port.setBaudRate(baud)
-        for id in range(from_id, to_id+1):
-            # Ping the servo
-            model_number, result, error = handler.ping(port, id)
-            if result == sdk.COMM_SUCCESS:
-                servos.append((id, model_number))
-                if args['find_any']:
-                    servo_found(id)
-        return servos
+        for baud in baudrates():
+            if found.is_set():
+                break
+            port.setBaudRate(baud)
+            servos = await pingservos(port, handler, args['from_id'], args['to_id'], found)
+            if servos:
+                bauds[baud] = servos
+                if args['calibrate']:
+                    await calibrate(port, info, handler, servos)
+        port.closePort()
+        return bauds
     except Exception as e:
         print(e)
         return None
 
+async def scan_all_ports():
+    # [(port info, {baud: [(id, model)]})]
+    ports = list(grep_serial_ports(args['hardware_regex']))
+    handler = sdk.AsyncPacketHandler(0)
+    found = asyncio.Event()
+    results = await asyncio.gather(*[scan_port(p, handler, found) for p in ports])
+    return list(zip(ports, results))
+
+def update_topology(scans):
+    # the scanned ids of every scanned port and baudrate are replaced, a stopped --find_any scan only adds
+    topology = sdk.BusTopology(args['topology'])
+    topology.load()
+    scs_ids = None if args['find_any'] else range(args['from_id'], args['to_id']+1)
+    for p, bauds in scans:
+        if bauds is None:
+            continue
+        for baud in baudrates():
+            topology.setServos(p, baud, bauds.get(baud, []), scs_ids)
+    topology.save()
+
 def find_all_servos():
-    ports = [p.device for p in grep_serial_ports(args['hardware_regex'])]
+    # Ports are scanned in parallel, result keeps {port: [(id, model)]} shape
+    scans = asyncio.run(scan_all_ports())
+    if args['topology']:
+        update_topology(scans)
     devices = {}
-    for p in ports:
-        devices[p] = pingservos(p, args['baud'], args['from_id'], args['to_id'])
+    for info, bauds in scans:
+        p = info.device
+        if bauds is None:
+            devices[p] = None
+            continue
+        # a servo is reported once, at the first baudrate it answered
+        servos = {}
+        for baud_servos in bauds.values():
+            for id, model in baud_servos:
+                servos.setdefault(id, model)
+        devices[p] = sorted(servos.items())
+        if args['find_any'] and devices[p]:
+            servo_found(devices[p][0][0])
     return devices
 
 def servo_found(id):
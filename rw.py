@@ -18,54 +18,85 @@
 # limitations under the License.
 #
 import os
+import sys
 from sys import exit
 import argparse
+import collections
+import itertools
 from pprint import pprint as pp
 from serial.tools.list_ports import grep as grep_serial_ports
 import scservo_sdk as sdk
 from scservo_sdk import port_handler
-from time import sleep
+from time import sleep, monotonic_ns
 os.environ['COLUMNS'] = "180"
 
 ACTIONS = {
     'reset_neutral':
         {
-            'addr':     40,
-            'length':   1,
+            'register': 'torque_enable',
             'write':    128
         },
     'id':
         {
-            'addr':     5,
-            'length':   1,
+            'register': 'id',
         },
     'load':{
-        'addr': 60,
-        'length': 2,
-        'negative_bit': 10,
+        'register': 'present_load',
     },
 }
+BATCH_HELP = """Operations, one per line, # starts a comment:
+  read IDS REGISTER
+  write IDS REGISTER VALUE
+  action IDS ACTION
+  ping IDS
+IDS is a comma separated list of ids and ranges such as 1,3,5-8. REGISTER is a
+register name or ADDR:LENGTH[:NEGATIVE_BIT]. ACTION is one of the --action choices."""
+
+REGISTERS = sorted(set(sdk.SCS_CONTROL_TABLE.registers) | set(sdk.STS_CONTROL_TABLE.registers))
+
+class BaudAction(argparse.Action):
+    # records that --baud was given, cache entries at other baudrates are skipped then
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, values)
+        namespace.baud_given = True
 
 def argument_parser():
     parser = argparse.ArgumentParser(description="Read Write Feetech registers", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     # By default we search for all CH430 ports with
     parser.add_argument("--hardware_regex", type=str, default='1A86:7523', help='Serial port filter for detecting multiple boards or specify single board')
-    parser.add_argument("--baud", type=int, default=1000000, help='Baudrate')
+    parser.add_argument("--baud", type=int, default=1000000, action=BaudAction, help='Baudrate')
     parser.add_argument("--protocol", '-p', type=int, default=0, help='SCS Protocol')
-    parser.add_argument("--id", '-i', type=int, help='Servo ID', required=True)
+    parser.add_argument("--id", '-i', type=int, help='Servo ID, required without --batch and --shell')
+    parser.add_argument("--register", '-g', type=str, help='Register name from the servo control table, replaces --addr, --length and --negative_bit', choices=REGISTERS)
     parser.add_argument("--addr", '-a',type=int, help='Register')
     parser.add_argument("--length", '-l',type=int, help='Address length in bytes', choices=[1,2])
     parser.add_argument("--negative_bit", '-n', type=int, help='Negative sign  bit for this register')
     parser.add_argument("--write", '-w', type=int, help='Data to write in the decimal format ')
     parser.add_argument("--action", '-c', type=str, help="Defined actions such as set", choices=list(ACTIONS.keys()))
     parser.add_argument("--repeat", '-r', nargs='?', const=True, help="Keep reading the register until the CTRL+C pressed")
-    parser.add_argument("--lock", '-x', type=int, nargs='?',const=55, help="Specify Lock register for permanent saves. The Lock will be unlocked for writing if specified")
+    parser.add_argument("--lock", '-x', type=int, nargs='?',const=-1, help="Specify Lock register for permanent saves. The Lock will be unlocked for writing if specified. Without a value the lock register of the servo control table is used")
+    parser.add_argument("--retries", type=int, default=0, help="Times a read or write is sent again when its status packet is lost or corrupt")
+    parser.add_argument("--timeouts", type=str, nargs='?', const=sdk.TIMEOUT_CALIBRATION_PATH, help="Use the packet timeouts calibrated by ping.py --calibrate from this file, and save them back adjusted to this run")
+    parser.add_argument("--topology", type=str, default=sdk.TOPOLOGY_PATH, help="Cache of the servos found on every port, refreshed by ping.py. A cached servo is checked with one ping, the ports are scanned only when it does not answer. With --baud only entries at that baudrate are used")
+    parser.add_argument("--rescan", nargs='?', const=True, help="Ignore the topology cache and scan the ports")
+    parser.add_argument("--batch", '-b', type=str, help="Run the operations of this file, - for stdin, in one session. Reads and writes of the same register on several servos are merged into sync reads and writes")
+    parser.add_argument("--shell", '-s', nargs='?', const=True, help="Interactive shell running one operation per line, the ports stay open between them")
+    parser.add_argument("--server", type=str, nargs='?', const=sdk.BUS_SERVER_PATH, help="Talk to the servos through a running bus_server.py on this socket instead of opening the ports")
+    parser.set_defaults(baud_given=False)
 
 
     args = parser.parse_args()
     args = vars(args)
+    if args.get('batch') or args.get('shell'):
+        if args.get('server'):
+            parser.error("--batch and --shell open the ports, they do not run through --server")
+        return args
+    if args.get('id') is None:
+        parser.error("Servo ID is required")
     if args.get('action', False):
         args.update(ACTIONS[args['action']])
+    if args.get('register'):
+        return args
     if not args.get('addr', False):
         parser.error("Register address is required")
     if not args.get('length', False):
@@ -75,41 +106,106 @@ def argument_parser():
 
 args = argument_parser()
 
-def find_servo_port(port, baud,  id):
-    port = sdk.PortHandler(port)
+def open_port(info, baud):
+    port = sdk.PortHandler(info.device)
     handler = sdk.PacketHandler(args['protocol'])
+    handler.setRetryPolicy(sdk.RetryPolicy(max_attempts=args['retries'] + 1))
+    port.openPort()
+    port.setBaudRate(baud)
+    load_calibration(port, info)
+    return port, handler
+
+def load_calibration(port, info):
+    # calibrations are saved per adapter and baudrate
+    if args.get('timeouts'):
+        calibration = sdk.TimeoutCalibration(port, port_info=info)
+        calibration.load(args['timeouts'])
+        port.setCalibration(calibration)
+
+def find_servo_port(info, baud,  id):
     try:
-        port.openPort()
-        port.setBaudRate(baud)
+        port, handler = open_port(info, baud)
         model_number, result, error = handler.ping(port, id)
         if result == sdk.COMM_SUCCESS:
-            return port, handler
+            return port, handler, model_number
     except Exception as e:
         print(e)
-    return None, None
+    return None, None, None
 
-def find_servo():
-    ports = [p.device for p in grep_serial_ports(args['hardware_regex'])]
-    for p in ports:
-        port, handler =  find_servo_port(p, args['baud'], args['id'])
+def find_server_servo():
+    # the port is the name of a port served by bus_server.py, the client has the packet handler methods
+    sdk.SCS_SETEND(args['protocol'])
+    try:
+        client = sdk.BusClient(args['server'])
+    except OSError as e:
+        print(f"Cant connect to bus server: {e}")
+        exit(1)
+    for port in client.getPorts():
+        model_number, result, error = client.ping(port, args['id'])
+        if result == sdk.COMM_SUCCESS:
+            return port, client, model_number
+    print("Servo not found")
+    exit(1)
+
+def cached_baud(baud):
+    # a cache entry is used at any baudrate, unless --baud was given
+    return not args['baud_given'] or baud == args['baud']
+
+def find_cached_servo(topology, ports):
+    # one ping on the port and baudrate the servo was last seen at, cache entries that do not answer are dropped
+    for p, baud, model in topology.findServo(args['id'], ports):
+        if not cached_baud(baud):
+            continue
+        port, handler, model_number = find_servo_port(p, baud, args['id'])
         if port is not None:
-            return port, handler
+            return port, handler, model_number
+        topology.removeServo(p, baud, args['id'])
+    return None, None, None
+
+def find_servo():
+    if args.get('server'):
+        return find_server_servo()
+    ports = list(grep_serial_ports(args['hardware_regex']))
+    topology = sdk.BusTopology(args['topology'])
+    try:
+        if not args.get('rescan') and topology.load():
+            port, handler, model_number = find_cached_servo(topology, ports)
+            if port is not None:
+                return port, handler, model_number
+        for p in ports:
+            port, handler, model_number =  find_servo_port(p, args['baud'], args['id'])
+            if port is not None:
+                topology.addServo(p, args['baud'], args['id'], model_number)
+                return port, handler, model_number
+    finally:
+        if topology.changed:
+            topology.save()
     print("Servo not found")
     exit(1)
 
-def write(port, handler):
+def find_register(model_number):
+    # Register from the control table of the servo model, or built from --addr, --length and --negative_bit
+    table = sdk.getControlTable(model_number, args['protocol'])
+    if args.get('register'):
+        if args['register'] not in table:
+            print(f"Register {args['register']} is not available for {table.family.upper()} servos")
+            exit(1)
+        return table[args['register']]
+    return make_register(table, args['addr'], args['length'], args['negative_bit'])
+
+def make_register(table, addr, length, negative_bit=None):
+    reg_class = sdk.REG_EEPROM if addr < 40 else sdk.REG_RAM
+    return sdk.Register(f"addr_{addr}", addr, length, reg_class, sign_bit=negative_bit, lock=table['lock'].address)
+
+def write(port, handler, register):
     data = args['write']
-    length = args['length']
     # negative values
     if data < 0:
-        bit  = args['negative_bit']
-        if bit < 2 or bit > length * 8 - 1:
+        bit = register.sign_bit
+        if bit is None or bit < 2 or bit > register.length * 8 - 1:
             print("Invalid negative bit")
-        data = abs(data) + 2**bit
-    if length == 1:
-        result, error = handler.write1ByteTxRx(port, args['id'], args['addr'], data)
-    if length == 2:
-        result, error = handler.write2ByteTxRx(port, args['id'], args['addr'], data)
+            return False
+    result, error = handler.writeRegisterTxRx(port, args['id'], register, data)
     if not result == sdk.COMM_SUCCESS:
         print("Error wiriting data")
         return False
@@ -118,57 +214,431 @@ def write(port, handler):
         return True
 
 
-def reading(port, handler):
+def reading(port, handler, register):
     try:
         while True:
-            read(port,handler)
+            read(port, handler, register)
             if args.get('repeat') is None:
                 break
             sleep(0.05)
     except KeyboardInterrupt:
         exit(0)
 
-def writing(port, handler):
+def writing(port, handler, register):
     locked = False
-    if args['addr'] < 40:
+    if register.reg_class == sdk.REG_EEPROM:
         if args.get('lock') is None:
             print("WARNING: for permanent write you need to specify the lock register with --lock sign")
         else:
+            lock = args['lock'] if args['lock'] >= 0 else register.lock
             # unlock
-            result, error = handler.write1ByteTxRx(port, args['id'], args['lock'], 0)
+            result, error = handler.write1ByteTxRx(port, args['id'], lock, 0)
             if not result == sdk.COMM_SUCCESS:
                 print("Error unlocking. May try again")
                 exit(1)
             locked = True
 
-    write(port, handler)
+    write(port, handler, register)
     # Lock back
     if locked:
-        result, error = handler.write1ByteTxRx(port, args['id'], args['lock'], 1)
+        result, error = handler.write1ByteTxRx(port, args['id'], lock, 1)
 
 
-def read(port, handler):
-    length = args['length']
-    if length == 1:
-        data, result, error = handler.read1ByteTxRx(port, args['id'], args['addr'])
-    if length == 2:
-        data, result, error = handler.read2ByteTxRx(port, args['id'], args['addr'])
+def read(port, handler, register):
+    data, result, error = handler.readRegisterTxRx(port, args['id'], register)
     if not result == sdk.COMM_SUCCESS:
         print("Error reading data")
         exit(1)
     else:
-        if args['negative_bit'] is not None:
-            bit = args['negative_bit']
-            if data > 2**bit:
-                data = 0-data%(2**bit)
         print(data)
 
+def parse_ids(text):
+    ids = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+def parse_register(text):
+    # register name, or (addr, length, negative_bit)
+    if text[0].isdigit():
+        fields = [int(field) for field in text.split(':')]
+        if len(fields) not in (2, 3) or fields[1] not in (1, 2):
+            raise ValueError(f"Register {text} is not ADDR:LENGTH[:NEGATIVE_BIT]")
+        return tuple(fields) + (None,) * (3 - len(fields))
+    if text not in REGISTERS:
+        raise ValueError(f"Unknown register {text}")
+    return text
+
+def parse_operation(line):
+    # (op, ids, register, value) of one batch line, None for empty lines
+    words = line.split('#', 1)[0].split()
+    if not words:
+        return None
+    op = words[0]
+    try:
+        if op == 'ping' and len(words) == 2:
+            return 'ping', parse_ids(words[1]), None, None
+        if op == 'read' and len(words) == 3:
+            return 'read', parse_ids(words[1]), parse_register(words[2]), None
+        if op == 'write' and len(words) == 4:
+            return 'write', parse_ids(words[1]), parse_register(words[2]), int(words[3])
+        if op == 'action' and len(words) == 3 and words[2] in ACTIONS:
+            action = ACTIONS[words[2]]
+            return ('write' if 'write' in action else 'read'), parse_ids(words[1]), action['register'], action.get('write')
+    except ValueError as e:
+        raise ValueError(f"{e}: {line.strip()}")
+    raise ValueError(f"Can not parse: {line.strip()}")
+
+Servo = collections.namedtuple('Servo', 'info port handler baud model table')
+Item = collections.namedtuple('Item', 'op id servo register value')
+
+class Session(object):
+    # Ports and servos of a batch or shell, opened when first needed and kept until close()
+    def __init__(self):
+        self.infos = list(grep_serial_ports(args['hardware_regex']))
+        self.topology = sdk.BusTopology(args['topology'])
+        if not args.get('rescan'):
+            self.topology.load()
+        self.ports = {}  # device: (port, handler)
+        self.caches = {}  # (device, baud): RegisterCache, repeated reads and writes of a register skip the bus
+        self.servos = {}  # id: Servo
+        self.unlocked = {}  # id: (servo, lock address) of servos unlocked for EEPROM writes
+        self.warned = False
+        self.errors = 0
+
+    def getPort(self, info, baud):
+        device = info.device
+        if device not in self.ports:
+            try:
+                self.ports[device] = open_port(info, baud)
+            except Exception as e:
+                print(e)
+                self.ports[device] = (None, None)
+        port, handler = self.ports[device]
+        if port is not None and port.getBaudRate() != baud:
+            # the calibration of the old baudrate is kept, the one of the new baudrate is used from now on
+            if args.get('timeouts'):
+                port.getCalibration().save(args['timeouts'])
+            port.setBaudRate(baud)
+            load_calibration(port, info)
+        return port, handler
+
+    def use(self, servo):
+        # port and handler of the servo, at its baudrate
+        return self.getPort(servo.info, servo.baud)
+
+    def getCache(self, servo):
+        key = (servo.info.device, servo.baud)
+        if key not in self.caches:
+            port, handler = self.use(servo)
+            self.caches[key] = sdk.RegisterCache(port, handler)
+        return self.caches[key]
+
+    def isCached(self, item):
+        # the register of the item holds its value by the cache, for writes the value to write
+        cache = self.getCache(item.servo)
+        shadow = cache.getShadow(item.id)
+        if not cache.isFresh(shadow, item.register, monotonic_ns()):
+            return False
+        if item.op == 'write':
+            data = bytes(item.register.encode(item.value))
+            return shadow.data[item.register.address:item.register.address + item.register.length] == data
+        return True
+
+    def find(self, id):
+        # the cached port and baudrate of the servo first, then every port at --baud
+        if id in self.servos:
+            return self.servos[id]
+        cached = [(p, baud) for p, baud, _ in self.topology.findServo(id, self.infos) if cached_baud(baud)]
+        tried = set()
+        for p, baud in cached + [(p, args['baud']) for p in self.infos]:
+            if (p.device, baud) in tried:
+                continue
+            tried.add((p.device, baud))
+            port, handler = self.getPort(p, baud)
+            if port is None:
+                continue
+            model_number, result, error = handler.ping(port, id)
+            if result == sdk.COMM_SUCCESS:
+                self.topology.addServo(p, baud, id, model_number)
+                servo = self.servos[id] = Servo(p, port, handler, baud, model_number,
+                                                sdk.getControlTable(model_number, args['protocol']))
+                return servo
+            if (p, baud) in cached:
+                self.topology.removeServo(p, baud, id)
+        return None
+
+    def report(self, id, name, text, failed=False):
+        self.errors += failed
+        print(f"{id} {name} {text}")
+
+    def expand(self, operation):
+        # Item for every servo of the operation, servos and registers that do not exist are reported
+        op, ids, spec, value = operation
+        name = spec if not isinstance(spec, tuple) else f"addr_{spec[0]}"
+        items = []
+        for id in ids:
+            servo = self.find(id)
+            if servo is None:
+                self.report(id, name or 'ping', "error: servo not found", True)
+                continue
+            register = None
+            if isinstance(spec, tuple):
+                register = make_register(servo.table, *spec)
+            elif spec is not None:
+                if spec not in servo.table:
+                    self.report(id, name, f"error: not available for {servo.table.family.upper()} servos", True)
+                    continue
+                register = servo.table[spec]
+            if op == 'write' and value < 0 and register.sign_bit is None:
+                self.report(id, name, "error: negative value for a register without negative bit", True)
+                continue
+            items.append(Item(op, id, servo, register, value))
+        return items
+
+    def run(self, operations):
+        # consecutive reads and consecutive writes are merged into sync reads and writes. The servos
+        # of a run are looked up when it starts, so they can be found under an id written before
+        for op, run in itertools.groupby(operations, key=lambda operation: operation[0]):
+            segment = []
+            for operation in run:
+                segment.extend(self.expand(operation))
+            if op == 'read':
+                self.readSegment(segment)
+            elif op == 'write':
+                self.writeSegment(segment)
+            else:
+                self.pingSegment(segment)
+
+    def pingSegment(self, items):
+        for item in items:
+            port, handler = self.use(item.servo)
+            model_number, result, error = handler.ping(port, item.id)
+            if result == sdk.COMM_SUCCESS:
+                self.report(item.id, 'model', model_number)
+            else:
+                self.report(item.id, 'ping', f"error: {handler.getTxRxResult(result)}", True)
+
+    def readSegment(self, items):
+        # one SYNC_READ per port and register range, single reads for servos it did not get
+        def value_key(item):
+            # registers of the same range decode differently with another sign bit
+            return (item.id, item.register.address, item.register.length, item.register.sign_bit)
+
+        groups = {}
+        values = {}  # value_key: (value, result, error)
+        for item in items:
+            # registers fresh in the cache are not read again
+            if self.isCached(item):
+                values[value_key(item)] = self.getCache(item.servo).read(item.id, item.register)
+                continue
+            key = (item.servo.info.device, item.servo.baud, item.register.address, item.register.length)
+            groups.setdefault(key, []).append(item)
+        for (_, _, address, length), group in groups.items():
+            port, handler = self.use(group[0].servo)
+            cache = self.getCache(group[0].servo)
+            ids = sorted(set(item.id for item in group))
+            if len(ids) > 1:
+                sync_read = sdk.GroupSyncRead(port, handler, address, length)
+                for id in ids:
+                    sync_read.addParam(id)
+                sync_read.txRxPacket()
+                cache.updateGroup(sync_read)
+                for item in group:
+                    if sync_read.getResult(item.id) == sdk.COMM_SUCCESS:
+                        values[value_key(item)] = (sync_read.getRegister(item.id, item.register),
+                                                   sdk.COMM_SUCCESS, sync_read.getError(item.id))
+            for item in group:
+                if value_key(item) not in values:
+                    values[value_key(item)] = cache.read(item.id, item.register)
+        for item in items:
+            value, result, error = values[value_key(item)]
+            if result != sdk.COMM_SUCCESS:
+                self.report(item.id, item.register.name, f"error: {item.servo.handler.getTxRxResult(result)}", True)
+            else:
+                self.report(item.id, item.register.name, value)
+
+    def writeSegment(self, items):
+        # one SYNC_WRITE per port and register range, the writes of every servo stay in order
+        groups = []  # [key, {id: item}]
+        placed = []  # group index of every item, None for writes of the value the cache already holds
+        for item in items:
+            if self.isCached(item):
+                placed.append(None)
+                continue
+            # the cached value is stale once the write is queued, a later write of it is not skipped
+            self.getCache(item.servo).invalidate(item.id, item.register)
+            if item.register.reg_class == sdk.REG_EEPROM:
+                self.unlock(item.servo, item.id, item.register)
+            key = (item.servo.info.device, item.servo.baud, item.register.address, item.register.length)
+            target = None
+            # id writes change the servo they go to, they are never merged
+            if item.register.name != 'id':
+                for idx in range(len(groups) - 1, -1, -1):
+                    if groups[idx][0] == key:
+                        target = idx
+                        break
+                    if item.id in groups[idx][1]:
+                        break
+            if target is None:
+                target = len(groups)
+                groups.append((key if item.register.name != 'id' else None, {}))
+            groups[target][1][item.id] = item  # a later write of the same register wins
+            placed.append(target)
+
+        results = {}  # (group index, id): (result, error)
+        for idx, (_, writes) in enumerate(groups):
+            first = next(iter(writes.values()))
+            port, handler = self.use(first.servo)
+            if len(writes) == 1:
+                results[(idx, first.id)] = self.getCache(first.servo).write(first.id, first.register, first.value)
+                if first.register.name == 'id' and results[(idx, first.id)][0] == sdk.COMM_SUCCESS:
+                    self.moveServo(first.id, first.value)
+                continue
+            sync_write = sdk.GroupSyncWrite(port, handler, first.register.address, first.register.length)
+            for id, item in writes.items():
+                sync_write.setRegister(id, item.register, item.value)
+            result = sync_write.txPacket()
+            for id in writes:
+                results[(idx, id)] = (result, 0)
+
+        for item, idx in zip(items, placed):
+            result, error = results[(idx, item.id)] if idx is not None else (sdk.COMM_SUCCESS, 0)
+            if result != sdk.COMM_SUCCESS:
+                self.report(item.id, item.register.name, f"error: {item.servo.handler.getTxRxResult(result)}", True)
+            elif error:
+                self.report(item.id, item.register.name, f"error: {item.servo.handler.getRxPacketError(error)}", True)
+            else:
+                self.report(item.id, item.register.name, "ok")
+
+    def moveServo(self, id, new_id):
+        # the servo answers to new_id after its id register was written
+        servo = self.servos.pop(id)
+        self.servos[new_id] = servo
+        # the cached registers of the old id belong to another servo now, pending writes of it are dropped
+        cache = self.getCache(servo)
+        cache.shadows.pop(id, None)
+        cache.shadows.pop(new_id, None)
+        if id in self.unlocked:
+            self.unlocked[new_id] = self.unlocked.pop(id)
+        self.topology.removeServo(servo.info, servo.baud, id)
+        self.topology.addServo(servo.info, servo.baud, new_id, servo.model)
+
+    def unlock(self, servo, id, register):
+        # EEPROM is unlocked once per servo and locked again by lock()
+        if id in self.unlocked:
+            return
+        if args.get('lock') is None:
+            if not self.warned:
+                print("WARNING: for permanent write you need to specify the lock register with --lock sign")
+                self.warned = True
+            return
+        lock = args['lock'] if args['lock'] >= 0 else register.lock
+        port, handler = self.use(servo)
+        result, error = handler.write1ByteTxRx(port, id, lock, 0)
+        self.getCache(servo).getShadow(id).invalidate(lock, 1)
+        if result == sdk.COMM_SUCCESS:
+            self.unlocked[id] = (servo, lock)
+        else:
+            self.report(id, 'lock', "error: unlocking failed", True)
+
+    def lock(self):
+        for id, (servo, lock) in self.unlocked.items():
+            port, handler = self.use(servo)
+            result, error = handler.write1ByteTxRx(port, id, lock, 1)
+            self.getCache(servo).getShadow(id).invalidate(lock, 1)
+            if result != sdk.COMM_SUCCESS:
+                self.report(id, 'lock', "error: locking failed", True)
+        self.unlocked.clear()
+
+    def close(self):
+        self.lock()
+        if self.topology.changed:
+            self.topology.save()
+        for port, handler in self.ports.values():
+            if port is None:
+                continue
+            if args.get('timeouts'):
+                port.getCalibration().save(args['timeouts'])
+            port.closePort()
+
+def run_batch():
+    # the whole file is parsed before the first servo is touched
+    operations = []
+    source = sys.stdin if args['batch'] == '-' else open(args['batch'])
+    with source:
+        for number, line in enumerate(source, 1):
+            try:
+                operation = parse_operation(line)
+            except ValueError as e:
+                print(f"Line {number}: {e}")
+                exit(1)
+            if operation is not None:
+                operations.append(operation)
+    session = Session()
+    try:
+        session.run(operations)
+    finally:
+        session.close()
+    exit(1 if session.errors else 0)
+
+def run_shell():
+    try:
+        import readline  # line editing and history for input()
+    except ImportError:
+        pass
+    session = Session()
+    print("Type help for the operations, quit to leave")
+    try:
+        while True:
+            try:
+                line = input('rw> ')
+            except EOFError:
+                print()
+                break
+            if line.strip() in ('quit', 'exit'):
+                break
+            if line.strip() == 'help':
+                print(BATCH_HELP)
+                continue
+            try:
+                operation = parse_operation(line)
+            except ValueError as e:
+                print(e)
+                continue
+            if operation is not None:
+                # a failed command is reported, the shell and its open ports stay
+                try:
+                    session.run([operation])
+                except Exception as e:
+                    print(f"error: {e}")
+                try:
+                    # EEPROM is not left unlocked while waiting for the next command
+                    session.lock()
+                except Exception as e:
+                    print(f"error: {e}")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        session.close()
+
 def main():
-    port, handler = find_servo()
-    if args.get('write') is not None:
-        writing(port, handler)
-    else:
-        reading(port, handler)
+    if args.get('batch'):
+        run_batch()
+    if args.get('shell'):
+        run_shell()
+        return
+    port, handler, model_number = find_servo()
+    register = find_register(model_number)
+    try:
+        if args.get('write') is not None:
+            writing(port, handler, register)
+        else:
+            reading(port, handler, register)
+    finally:
+        if args.get('timeouts') and not args.get('server'):
+            port.getCalibration().save(args['timeouts'])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -3,4 +3,19 @@
 from .port_handler import *
 from .packet_handler import *
 from .group_sync_read import *
-from .group_sync_write import *
\ No newline at end of file
+from .group_sync_write import *
+from .async_port_handler import *
+from .async_packet_handler import *
+from .control_loop import *
+from .control_table import *
+from .register_cache import *
+from .sim_port_handler import *
+from .bus_metrics import *
+from .bus_capture import *
+from .bus_arbiter import *
+from .bus_server import *
+from .bus_client import *
+from .telemetry import *
+from .trajectory import *
+from .timeout_calibration import *
+from .topology import *
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from . import scservo_def
+
+# numpy is only needed for the *Array methods of the group classes
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# byte positions of a little endian value in SCS_END 1 order (words low first, bytes swapped)
+SCS_END1_ORDER = {
+    1: [0],
+    2: [1, 0],
+    4: [1, 0, 3, 2],
+}
+
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("numpy is required for the array API")
+
+
+def encodeArray(values, data_length, sign_bit=None):
+    # int array of n values -> uint8 array of shape (n, data_length) in SCS_END byte order
+    requireNumpy()
+    values = np.asarray(values, dtype=np.int64)
+    if sign_bit is not None:
+        # SCS_TOSCS: magnitude with the sign bit set for negative values
+        values = np.where(values < 0, -values | (1 << sign_bit), values)
+
+    data = values.astype('<u4').view(np.uint8).reshape(-1, 4)[:, :data_length]
+    if scservo_def.SCS_END != 0:
+        data = data[:, SCS_END1_ORDER[data_length]]
+    return np.ascontiguousarray(data)
+
+
+def decodeArray(data, sign_bit=None):
+    # uint8 array of shape (n, data_length) in SCS_END byte order -> int64 array of n values
+    requireNumpy()
+    data = np.asarray(data, dtype=np.uint8)
+    data_length = data.shape[1]
+    if scservo_def.SCS_END != 0:
+        data = data[:, SCS_END1_ORDER[data_length]]
+
+    raw = np.zeros((data.shape[0], 4), dtype=np.uint8)
+    raw[:, :data_length] = data
+    values = raw.view('<u4').reshape(-1).astype(np.int64)
+    if sign_bit is not None:
+        # SCS_TOHOST: the sign bit marks a negative magnitude
+        magnitude = values & ~(1 << sign_bit)
+        values = np.where(values & (1 << sign_bit), -magnitude, magnitude)
+    return values
+
+
+def updateFrameArray(frame, scs_ids, data):
+    # SyncWriteFrame.update for many servos at once, scs_ids must be unique and compiled in the frame
+    buffer = np.frombuffer(frame.buffer, dtype=np.uint8)
+    offsets = np.fromiter(map(frame.slots.__getitem__, scs_ids), dtype=np.intp, count=len(scs_ids))
+    index = offsets[:, None] + np.arange(data.shape[1])
+    delta = int(data.sum(dtype=np.int64)) - int(buffer[index].sum(dtype=np.int64))
+    buffer[index] = data
+    if delta:
+        frame.sum += delta
+        frame.buffer[frame.length - 1] = ~frame.sum & 0xFF
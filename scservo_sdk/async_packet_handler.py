@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+import asyncio
+import threading
+
+from .scservo_def import *
+from .protocol_packet_handler import *
+
+
+def AsyncPacketHandler(protocol_end):
+    SCS_SETEND(protocol_end)
+    return async_protocol_packet_handler()
+
+
+class async_protocol_packet_handler(object):
+    """asyncio version of the protocol_packet_handler transaction API.
+
+    Works with AsyncPortHandler ports. Every coroutine runs a whole transaction
+    under the port lock, syncReadTxRx holds it from the SYNC_READ until the
+    last reply, so a cancelled task never leaves the port locked.
+    """
+
+    def __init__(self):
+        self.encoders = {}
+        self.decoders = {}
+        self.local = threading.local()
+        self.retry_policy = RetryPolicy()
+
+    getProtocolVersion = protocol_packet_handler.getProtocolVersion
+    getTxRxResult = protocol_packet_handler.getTxRxResult
+    getRxPacketError = protocol_packet_handler.getRxPacketError
+    getEncoder = protocol_packet_handler.getEncoder
+    getDecoder = protocol_packet_handler.getDecoder
+    setRetryPolicy = protocol_packet_handler.setRetryPolicy
+    getRetryPolicy = protocol_packet_handler.getRetryPolicy
+
+    def txFrame(self, port, frame):
+        # caller holds the port lock
+        if frame is None:
+            port.metrics.countError('tx_error')
+            return COMM_TX_ERROR
+
+        port.clearPort()
+        self.getDecoder(port).clear()
+        written_packet_length = port.writePort(frame)
+        port.metrics.countTx(frame, written_packet_length)
+        if frame[PKT_LENGTH] + 4 != written_packet_length:  # 4: HEADER0 HEADER1 ID LENGTH
+            port.metrics.countError('tx_fail')
+            return COMM_TX_FAIL
+
+        return COMM_SUCCESS
+
+    async def rxPacket(self, port, read_length=0):
+        # caller holds the port lock, read_length lets a sync read take the whole reply burst at once
+        decoder = self.getDecoder(port)
+
+        while True:
+            rxpacket, result = decoder.next()
+            if result != COMM_RX_WAITING:
+                if result == COMM_RX_CORRUPT:
+                    port.metrics.countError('checksum')
+                return rxpacket, result
+
+            data = port.readPort(max(decoder.needed(), read_length - decoder.pending()))
+            if data:
+                port.metrics.countRx(len(data))
+                decoder.feed(data)
+                continue
+
+            # check timeout, only when a read after the deadline came back empty
+            if port.isPacketTimeout():
+                if decoder.pending() == 0:
+                    result = COMM_RX_TIMEOUT
+                else:
+                    result = COMM_RX_CORRUPT
+                return decoder.clear(), result
+            await port.waitPortAsync()
+
+    async def txRxFrame(self, port, frame, timeout_ms=None, retry_policy=None):
+        # every attempt takes the port lock on its own, other tasks may use the bus during the backoff
+        policy = retry_policy if retry_policy is not None else self.retry_policy
+        # frames built by the shared encoder of the port are overwritten by other tasks while this one waits
+        if frame is not None:
+            frame = bytes(frame)
+        attempt = 1
+        while True:
+            rxpacket, result, error = await self.txRxOnce(port, frame, policy.getTimeout(timeout_ms))
+            if not policy.shouldRetry(frame, result, attempt):
+                policy.record(result, attempt)
+                return rxpacket, result, error
+
+            port.metrics.countRetry(frame[PKT_ID])
+            if policy.backoff_ms > 0:
+                await asyncio.sleep(policy.backoff_ms * policy.backoff_factor ** (attempt - 1) / 1000.0)
+            attempt += 1
+
+    async def txRxOnce(self, port, frame, timeout_ms=None):
+        await port.acquire()
+        try:
+            result = self.txFrame(port, frame)
+            if result != COMM_SUCCESS or frame[PKT_ID] == BROADCAST_ID:
+                return None, result, 0
+
+            # set packet timeout
+            if frame[PKT_INSTRUCTION] == INST_READ:
+                rx_length = frame[PKT_PARAMETER0 + 1] + 6
+            else:
+                rx_length = 6  # HEADER0 HEADER1 ID LENGTH ERROR CHECKSUM
+            if timeout_ms is not None:
+                port.setPacketTimeoutMillis(timeout_ms)
+            else:
+                port.setPacketTimeout(rx_length, frame[PKT_ID])
+
+            while True:
+                rxpacket, result = await self.rxPacket(port)
+                if result != COMM_SUCCESS or frame[PKT_ID] == rxpacket[PKT_ID]:
+                    break
+
+            error = rxpacket[PKT_ERROR] if result == COMM_SUCCESS else 0
+            port.metrics.countResult(frame[PKT_ID], result, error)
+            if port.calibration is not None:
+                port.calibration.record(frame[PKT_ID], result, rx_length)
+            return rxpacket, result, error
+        finally:
+            port.release()
+
+    async def ping(self, port, scs_id, timeout_ms=None, read_model=True):
+        model_number = 0
+
+        if scs_id >= BROADCAST_ID:
+            return model_number, COMM_NOT_AVAILABLE, 0
+
+        rxpacket, result, error = await self.txRxFrame(port, self.getEncoder(port).ping(scs_id), timeout_ms)
+
+        if result == COMM_SUCCESS and read_model:
+            data_read, result, error = await self.readTxRx(port, scs_id, 3, 2)  # Address 3 : Model Number
+            if result == COMM_SUCCESS:
+                model_number = SCS_MAKEWORD(data_read[0], data_read[1])
+
+        return model_number, result, error
+
+    async def action(self, port, scs_id):
+        _, result, _ = await self.txRxFrame(port, self.getEncoder(port).action(scs_id))
+
+        return result
+
+    async def readTxRx(self, port, scs_id, address, length):
+        data = []
+
+        if scs_id >= BROADCAST_ID:
+            return data, COMM_NOT_AVAILABLE, 0
+
+        rxpacket, result, error = await self.txRxFrame(port, self.getEncoder(port).read(scs_id, address, length))
+        if result == COMM_SUCCESS:
+            data.extend(rxpacket[PKT_PARAMETER0: PKT_PARAMETER0 + length])
+
+        return data, result, error
+
+    async def writeTxRx(self, port, scs_id, address, length, data):
+        frame = self.getEncoder(port).write(scs_id, INST_WRITE, address, length, data)
+        _, result, error = await self.txRxFrame(port, frame)
+
+        return result, error
+
+    async def regWriteTxRx(self, port, scs_id, address, length, data):
+        frame = self.getEncoder(port).write(scs_id, INST_REG_WRITE, address, length, data)
+        _, result, error = await self.txRxFrame(port, frame)
+
+        return result, error
+
+    def syncReadTx(self, port, start_address, data_length, param, param_length):
+        # caller holds the port lock
+        result = self.txFrame(port, self.getEncoder(port).syncRead(start_address, data_length, param, param_length))
+        if result != COMM_SUCCESS:
+            return result
+
+        port.setPacketTimeout((6 + data_length) * param_length)
+
+        return result
+
+    async def syncReadRx(self, port, data_length, param, param_length, slot_timeout_ms=None):
+        # caller holds the port lock. Returns ({scs_id: (data, result, error, rx_time_ns)}, result) for the ids
+        # of the last syncReadTx, see protocol_packet_handler.syncReadRx
+        rx_dict = {}
+        pending = set(param[0:param_length])
+        burst_length = (6 + data_length) * len(pending)
+        result = COMM_RX_TIMEOUT
+        if slot_timeout_ms is not None:
+            port.setPacketTimeoutMillis(port.tx_time_per_byte * port.metrics.tx_length + slot_timeout_ms)
+
+        while pending:
+            rxpacket, result = await self.rxPacket(port, burst_length)
+            if result == COMM_SUCCESS:
+                scs_id = rxpacket[PKT_ID]
+                if scs_id in pending:
+                    pending.discard(scs_id)
+                    burst_length -= 6 + data_length
+                    rx_dict[scs_id] = (list(rxpacket[PKT_PARAMETER0: PKT_PARAMETER0 + data_length]),
+                                       result, rxpacket[PKT_ERROR], port.getCurrentTimeNs())
+                    if slot_timeout_ms is not None:
+                        port.setPacketTimeoutMillis(slot_timeout_ms)
+            elif result != COMM_RX_CORRUPT or port.isPacketTimeout():
+                break
+
+        for scs_id in pending:
+            rx_dict[scs_id] = ([], result, 0, 0)
+
+        for scs_id, (_, slot_result, error, rx_time) in rx_dict.items():
+            port.metrics.countResult(scs_id, slot_result, error, rx_time)
+
+        return rx_dict, (COMM_SUCCESS if not pending else result)
+
+    async def syncReadTxRx(self, port, start_address, data_length, param, param_length, slot_timeout_ms=None):
+        await port.acquire()
+        try:
+            result = self.syncReadTx(port, start_address, data_length, param, param_length)
+            if result != COMM_SUCCESS:
+                return {}, result
+
+            return await self.syncReadRx(port, data_length, param, param_length, slot_timeout_ms)
+        finally:
+            port.release()
+
+    async def syncWriteTxOnly(self, port, start_address, data_length, param, param_length):
+        frame = self.getEncoder(port).syncWrite(start_address, data_length, param, param_length)
+
+        _, result, _ = await self.txRxFrame(port, frame)
+
+        return result
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import asyncio
+
+from .port_handler import *
+
+# poll interval when the port has no file descriptor to wait on
+ASYNC_POLL_INTERVAL = 0.0005
+
+
+class AsyncPortHandler(PortHandler):
+    """PortHandler for asyncio, one instance per bus.
+
+    The serial port stays non-blocking, waiting for status packets is done with
+    loop.add_reader() on the port file descriptor so many buses can be driven
+    from one event loop. A transaction holds the port lock instead of is_using.
+    """
+
+    def __init__(self, port_name):
+        super(AsyncPortHandler, self).__init__(port_name)
+        self.lock = None
+
+    def getLock(self):
+        # created lazily so it binds to the running loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    async def acquire(self):
+        await self.getLock().acquire()
+        self.is_using = True
+
+    def release(self):
+        self.is_using = False
+        if self.lock is not None and self.lock.locked():
+            self.lock.release()
+
+    async def waitPortAsync(self):
+        remaining = self.packet_deadline - self.getCurrentTimeNs()
+        if remaining <= 0:
+            return False
+
+        if self.fd is None:
+            await asyncio.sleep(min(ASYNC_POLL_INTERVAL, remaining / 1000000000.0))
+            return True
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.fd, lambda: readable.done() or readable.set_result(True))
+        try:
+            await asyncio.wait_for(readable, remaining / 1000000000.0)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self.fd)
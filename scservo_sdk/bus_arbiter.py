@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from .control_loop import LatencyHistogram
+
+# Transaction priorities, lower numbers are served first
+BUS_PRIORITY_MOTION = 0  # goal writes of the control loop
+BUS_PRIORITY_NORMAL = 50  # default of threads that did not set one
+BUS_PRIORITY_TELEMETRY = 100  # feedback and diagnostics reads
+BUS_PRIORITY_CONFIG = 200  # EEPROM and other configuration traffic
+
+# used by arbitrate() for ports without an arbiter
+NO_ARBITER = contextlib.nullcontext()
+
+
+class BusArbiter(object):
+    """Priority lock for the transactions of threads sharing one port.
+
+    The packet handler takes it around every whole transaction of a port
+    with an arbiter (see PortHandler.setArbiter), so the status packets of
+    one thread are never read by another. Waiting threads are served by
+    priority, first come first served within a priority. The lock is
+    reentrant, a thread may group several transactions with transaction().
+    Time spent waiting is recorded per priority.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.owner = None
+        self.depth = 0
+        self.waiting = []  # heap of (priority, sequence)
+        self.sequence = itertools.count()
+        self.local = threading.local()
+        self.wait_histograms = {}
+        self.acquisitions = 0
+        self.contended = 0
+
+    def setThreadPriority(self, priority):
+        # priority of the transactions of the calling thread
+        self.local.priority = priority
+
+    def getThreadPriority(self):
+        return getattr(self.local, 'priority', BUS_PRIORITY_NORMAL)
+
+    def acquire(self, priority=None):
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return
+
+            if priority is None:
+                priority = self.getThreadPriority()
+            self.acquisitions += 1
+            if self.owner is None and not self.waiting:
+                self.owner = me
+                self.depth = 1
+                self.addWait(priority, 0)
+                return
+
+            self.contended += 1
+            start = time.monotonic_ns()
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while self.owner is not None or self.waiting[0] != ticket:
+                    self.condition.wait()
+            except BaseException:
+                # interrupted waiter, a ticket left at the head would block the port for good
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+            heapq.heappop(self.waiting)
+            self.owner = me
+            self.depth = 1
+            self.addWait(priority, time.monotonic_ns() - start)
+
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("BusArbiter released by a thread that does not hold it")
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                if self.waiting:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def transaction(self, priority=None):
+        self.acquire(priority)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def addWait(self, priority, wait_ns):
+        histogram = self.wait_histograms.get(priority)
+        if histogram is None:
+            histogram = self.wait_histograms[priority] = LatencyHistogram()
+        histogram.add(wait_ns / 1000.0)
+
+    def clearStats(self):
+        with self.condition:
+            self.wait_histograms.clear()
+            self.acquisitions = 0
+            self.contended = 0
+
+    def getStats(self):
+        with self.condition:
+            return {
+                'acquisitions': self.acquisitions,
+                'contended': self.contended,
+                'waiting': len(self.waiting),
+                'wait': dict((priority, histogram.toDict()) for priority, histogram in self.wait_histograms.items()),
+            }
+
+
+def arbitrate(port):
+    # context manager for one transaction on port, a no-op for ports without an arbiter
+    arbiter = getattr(port, 'arbiter', None)
+    return arbiter if arbiter is not None else NO_ARBITER
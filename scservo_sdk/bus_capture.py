@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import struct
+import time
+
+from .scservo_def import *
+from .port_handler import *
+from .packet_codec import *
+
+# Capture file: CAPTURE_MAGIC, then one CAPTURE_RECORD header plus data per chunk
+CAPTURE_MAGIC = b'SCSCAP1\n'
+CAPTURE_RECORD = struct.Struct('<qBH')  # monotonic ns, direction, length
+CAPTURE_BUFFER = 65536
+
+# Record directions
+CAPTURE_TX = 0  # written by writePort
+CAPTURE_RX = 1  # returned by readPort
+
+
+class CaptureWriter(object):
+    # Append-only buffered writer of a capture file
+    def __init__(self, path):
+        self.file = open(path, 'ab', buffering=CAPTURE_BUFFER)
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.records = 0
+
+    def write(self, direction, data, now):
+        self.file.write(CAPTURE_RECORD.pack(now, direction, len(data)))
+        self.file.write(data)
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class PortCapture(object):
+    """Logs every chunk written to and read from a port into a capture file.
+
+    start() wraps writePort/readPort of the port object, so it works with any
+    PortHandler subclass, stop() restores them. Records are buffered and only
+    reach the disk when the buffer fills, on flush() or on stop().
+    """
+
+    def __init__(self, port, path):
+        self.port = port
+        self.path = path
+        self.writer = None
+
+    def start(self):
+        if self.writer is not None:
+            return
+        self.writer = CaptureWriter(self.path)
+        port_write = self.port.writePort
+        port_read = self.port.readPort
+        writer = self.writer
+
+        def writePort(packet):
+            written = port_write(packet)
+            writer.write(CAPTURE_TX, bytes(packet), time.monotonic_ns())
+            return written
+
+        def readPort(length):
+            data = port_read(length)
+            if data:
+                writer.write(CAPTURE_RX, bytes(data), time.monotonic_ns())
+            return data
+
+        self.port.writePort = writePort
+        self.port.readPort = readPort
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def stop(self):
+        if self.writer is None:
+            return
+        del self.port.writePort
+        del self.port.readPort
+        self.writer.close()
+        self.writer = None
+
+
+def readCapture(path):
+    # yields (time_ns, direction, data) of every record, a truncated last record is ignored
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        while True:
+            head = f.read(CAPTURE_RECORD.size)
+            if len(head) < CAPTURE_RECORD.size:
+                return
+            now, direction, length = CAPTURE_RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield now, direction, data
+
+
+def decodeCapture(path):
+    # (time_ns, direction, packet, result) of every frame. Tx records are one instruction packet each,
+    # rx records are split into status packets with the rxPacket decoder, time is when a packet completed
+    decoder = PacketDecoder()
+    frames = []
+    for now, direction, data in readCapture(path):
+        if direction == CAPTURE_TX:
+            frames.append((now, direction, data, COMM_SUCCESS))
+            continue
+        decoder.feed(data)
+        while True:
+            packet, result = decoder.next()
+            if result == COMM_RX_WAITING:
+                break
+            frames.append((now, direction, packet, result))
+    return frames
+
+
+class ReplayPortHandler(PortHandler):
+    """PortHandler that plays a capture file back to the packet handlers.
+
+    Every writePort moves to the next tx record of the capture, the rx records
+    after it are released with their recorded delay from that tx divided by
+    speed, or at once when speed is None. Writes that differ from the capture
+    are counted in mismatches.
+    """
+
+    def __init__(self, path, speed=1.0, port_name='replay'):
+        super(ReplayPortHandler, self).__init__(port_name)
+        self.records = list(readCapture(path))
+        self.speed = speed
+        self.rewind()
+
+    def rewind(self):
+        self.cursor = 0
+        self.rx_queue = []  # (release_ns, bytes)
+        self.rx_pending = b''
+        self.mismatches = 0
+
+    def closePort(self):
+        self.is_open = False
+
+    def clearPort(self):
+        pass
+
+    def setupPort(self, cflag_baud):
+        self.is_open = True
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        self.rewind()
+        return True
+
+    def isFinished(self):
+        return self.cursor >= len(self.records) and not self.rx_queue and not self.rx_pending
+
+    def collect(self, now):
+        arrived = 0
+        while arrived < len(self.rx_queue) and self.rx_queue[arrived][0] <= now:
+            arrived += 1
+        if arrived:
+            self.rx_pending += b''.join(data for _, data in self.rx_queue[:arrived])
+            del self.rx_queue[:arrived]
+
+    def getBytesAvailable(self):
+        self.collect(self.getCurrentTimeNs())
+        return len(self.rx_pending)
+
+    def readPort(self, length):
+        self.collect(self.getCurrentTimeNs())
+        data = self.rx_pending[:length]
+        self.rx_pending = self.rx_pending[length:]
+        return data
+
+    def writePort(self, packet):
+        packet = bytes(packet)
+        now = self.getCurrentTimeNs()
+
+        # rx records before the next tx were not asked for by this write, e.g. late replies
+        while self.cursor < len(self.records) and self.records[self.cursor][1] != CAPTURE_TX:
+            self.cursor += 1
+        if self.cursor >= len(self.records):
+            return len(packet)
+
+        tx_time, _, data = self.records[self.cursor]
+        if data != packet:
+            self.mismatches += 1
+        self.cursor += 1
+
+        while self.cursor < len(self.records) and self.records[self.cursor][1] == CAPTURE_RX:
+            rx_time, _, data = self.records[self.cursor]
+            delay = 0 if self.speed is None else int((rx_time - tx_time) / self.speed)
+            self.rx_queue.append((now + delay, data))
+            self.cursor += 1
+        return len(packet)
+
+    def waitPort(self):
+        # sleep until the next rx record is released or the packet deadline
+        now = self.getCurrentTimeNs()
+        if self.rx_pending:
+            return True
+        wake = self.packet_deadline
+        if self.rx_queue:
+            wake = min(wake, self.rx_queue[0][0])
+        if wake > now:
+            time.sleep((wake - now) / 1000000000.0)
+        self.collect(self.getCurrentTimeNs())
+        return bool(self.rx_pending)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import itertools
+import json
+import socket
+import struct
+
+from .scservo_def import *
+from .bus_server import *
+
+
+class BusClient(object):
+    """Blocking client of a BusServer.
+
+    The transaction methods follow the packet handler API with the port
+    given as an index or name of a served port, so tools written for a
+    PortHandler/PacketHandler pair can run through the server. pipeline()
+    sends several requests before reading any response, so they can share
+    one batch of the server.
+    """
+
+    def __init__(self, path=BUS_SERVER_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+        self.sequence = itertools.count()
+        self.ports = None
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def pack(self, op, port=0, scs_id=0, address=0, length=0, data=b''):
+        # returns (seq, request bytes)
+        seq = next(self.sequence) & 0xFFFFFFFF
+        return seq, BUS_REQUEST.pack(seq, op, self.getPortIndex(port), scs_id, address, length) + bytes(data)
+
+    def receive(self):
+        # returns (seq, result, error, data) of the next response
+        head = self.file.read(BUS_RESPONSE.size)
+        if len(head) < BUS_RESPONSE.size:
+            raise ConnectionError("bus server closed the connection")
+        reply_seq, result, error, reply_length = BUS_RESPONSE.unpack(head)
+        return reply_seq, result, error, self.file.read(reply_length)
+
+    def request(self, op, port=0, scs_id=0, address=0, length=0, data=b''):
+        seq, packet = self.pack(op, port, scs_id, address, length, data)
+        self.sock.sendall(packet)
+        reply_seq, result, error, data = self.receive()
+        if reply_seq != seq:
+            raise ConnectionError("bus server answered request %d instead of %d" % (reply_seq, seq))
+        return result, error, data
+
+    def pipeline(self, requests):
+        # requests are argument tuples of request(), sent at once. The server answers them
+        # in any order, returns the (result, error, data) of every request in request order
+        seqs = []
+        packets = []
+        for args in requests:
+            seq, packet = self.pack(*args)
+            seqs.append(seq)
+            packets.append(packet)
+        self.sock.sendall(b''.join(packets))
+
+        replies = {}
+        while len(replies) < len(seqs):
+            reply_seq, result, error, data = self.receive()
+            replies[reply_seq] = (result, error, data)
+        try:
+            return [replies[seq] for seq in seqs]
+        except KeyError as e:
+            raise ConnectionError("bus server did not answer request %d" % e.args[0])
+
+    def readMany(self, port, scs_ids, address, length):
+        # readTxRx of every servo in one pipeline, the server merges them into one SYNC_READ.
+        # Returns {scs_id: (data, result, error)}
+        replies = self.pipeline([(BUS_OP_READ, port, scs_id, address, length) for scs_id in scs_ids])
+        return dict((scs_id, (list(data), result, error)) for scs_id, (result, error, data) in zip(scs_ids, replies))
+
+    def getPorts(self):
+        if self.ports is None:
+            _, _, data = self.request(BUS_OP_PORTS)
+            self.ports = data.decode().split('\n') if data else []
+        return self.ports
+
+    def getPortIndex(self, port):
+        if isinstance(port, int):
+            return port
+        return self.getPorts().index(port)
+
+    def getStats(self):
+        _, _, data = self.request(BUS_OP_STATS)
+        return json.loads(data.decode())
+
+    def ping(self, port, scs_id):
+        result, error, data = self.request(BUS_OP_PING, port, scs_id)
+        model_number = struct.unpack('<H', data)[0] if result == COMM_SUCCESS else 0
+        return model_number, result, error
+
+    def readTxRx(self, port, scs_id, address, length):
+        result, error, data = self.request(BUS_OP_READ, port, scs_id, address, length)
+        return list(data), result, error
+
+    def read1ByteTxRx(self, port, scs_id, address):
+        data, result, error = self.readTxRx(port, scs_id, address, 1)
+        return (data[0] if result == COMM_SUCCESS else 0), result, error
+
+    def read2ByteTxRx(self, port, scs_id, address):
+        data, result, error = self.readTxRx(port, scs_id, address, 2)
+        return (SCS_MAKEWORD(data[0], data[1]) if result == COMM_SUCCESS else 0), result, error
+
+    def readRegisterTxRx(self, port, scs_id, register):
+        data, result, error = self.readTxRx(port, scs_id, register.address, register.length)
+        return (register.decode(data) if result == COMM_SUCCESS else 0), result, error
+
+    def writeTxRx(self, port, scs_id, address, length, data):
+        result, error, _ = self.request(BUS_OP_WRITE, port, scs_id, address, length, data)
+        return result, error
+
+    def write1ByteTxRx(self, port, scs_id, address, data):
+        return self.writeTxRx(port, scs_id, address, 1, [data])
+
+    def write2ByteTxRx(self, port, scs_id, address, data):
+        return self.writeTxRx(port, scs_id, address, 2, [SCS_LOBYTE(data), SCS_HIBYTE(data)])
+
+    def writeRegisterTxRx(self, port, scs_id, register, data):
+        return self.writeTxRx(port, scs_id, register.address, register.length, register.encode(data))
+
+    def writeGoal(self, port, scs_id, address, data):
+        # sent in the next SYNC_WRITE of the port together with the goals of other clients
+        result, _, _ = self.request(BUS_OP_GOAL, port, scs_id, address, len(data), data)
+        return result
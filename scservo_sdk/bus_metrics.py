@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import time
+
+from .scservo_def import *
+from .packet_codec import *
+from .control_loop import LatencyHistogram
+
+# instruction byte: label used in the Prometheus dump
+INSTRUCTION_NAMES = {
+    INST_PING: 'ping',
+    INST_READ: 'read',
+    INST_WRITE: 'write',
+    INST_REG_WRITE: 'reg_write',
+    INST_ACTION: 'action',
+    INST_SYNC_READ: 'sync_read',
+    INST_SYNC_WRITE: 'sync_write',
+}
+
+# COMM_* result: error counter it increments
+RESULT_COUNTERS = {
+    COMM_PORT_BUSY: 'busy',
+    COMM_TX_FAIL: 'tx_fail',
+    COMM_TX_ERROR: 'tx_error',
+    COMM_RX_TIMEOUT: 'timeout',
+    COMM_RX_CORRUPT: 'corrupt',
+}
+
+ERROR_COUNTERS = ('busy', 'tx_fail', 'tx_error', 'timeout', 'corrupt', 'checksum', 'status_error')
+
+
+class ServoMetrics(object):
+    def __init__(self, scs_id):
+        self.scs_id = scs_id
+        self.latency = LatencyHistogram()
+        self.clear()
+
+    def clear(self):
+        self.transactions = 0
+        self.retries = 0
+        self.errors = dict.fromkeys(ERROR_COUNTERS, 0)
+        self.latency.clear()
+
+    def toDict(self):
+        return {
+            'transactions': self.transactions,
+            'retries': self.retries,
+            'errors': dict(self.errors),
+            'latency': self.latency.toDict(),
+        }
+
+
+class PortMetrics(object):
+    """Always-on communication counters of one port.
+
+    Filled by the packet handlers: bytes on the wire, transactions by
+    instruction, errors by kind, and the round trip latency from the end of
+    the instruction write to each status packet, per port and per servo.
+    """
+
+    def __init__(self, port_name):
+        self.port_name = port_name
+        self.latency = LatencyHistogram()
+        self.servos = {}
+        self.clear()
+
+    def clear(self):
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.instructions = {}
+        self.retries = 0
+        self.errors = dict.fromkeys(ERROR_COUNTERS, 0)
+        self.latency.clear()
+        self.servos.clear()
+        self.tx_time = 0  # monotonic ns of the last instruction write
+        self.tx_length = 0  # bytes of the last instruction write
+
+    def getServo(self, scs_id):
+        servo = self.servos.get(scs_id)
+        if servo is None:
+            servo = self.servos[scs_id] = ServoMetrics(scs_id)
+        return servo
+
+    def countTx(self, frame, written):
+        self.tx_time = time.monotonic_ns()
+        self.tx_length = written
+        self.tx_bytes += written
+        instruction = frame[PKT_INSTRUCTION]
+        self.instructions[instruction] = self.instructions.get(instruction, 0) + 1
+
+    def countRx(self, length):
+        self.rx_bytes += length
+
+    def countError(self, name, scs_id=None):
+        self.errors[name] += 1
+        if scs_id is not None:
+            self.getServo(scs_id).errors[name] += 1
+
+    def countRetry(self, scs_id):
+        self.retries += 1
+        self.getServo(scs_id).retries += 1
+
+    def countResult(self, scs_id, result, error=0, rx_time=None):
+        # outcome of one transaction with one servo, rx_time is when its status packet arrived
+        servo = self.getServo(scs_id)
+        servo.transactions += 1
+        if result == COMM_SUCCESS:
+            if rx_time is None:
+                rx_time = time.monotonic_ns()
+            latency_us = (rx_time - self.tx_time) / 1000.0
+            self.latency.add(latency_us)
+            servo.latency.add(latency_us)
+            if error:
+                self.countError('status_error', scs_id)
+        elif result in RESULT_COUNTERS:
+            self.countError(RESULT_COUNTERS[result], scs_id)
+
+    def toDict(self):
+        return {
+            'port': self.port_name,
+            'tx_bytes': self.tx_bytes,
+            'rx_bytes': self.rx_bytes,
+            'instructions': dict((INSTRUCTION_NAMES.get(instruction, str(instruction)), count)
+                                 for instruction, count in self.instructions.items()),
+            'retries': self.retries,
+            'errors': dict(self.errors),
+            'latency': self.latency.toDict(),
+            'servos': dict((scs_id, servo.toDict()) for scs_id, servo in self.servos.items()),
+        }
+
+
+def formatLabels(labels):
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+def formatHistogram(lines, name, histogram, labels):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket%s %d' % (name, formatLabels(labels + [('le', bound)]), cumulative))
+    lines.append('%s_bucket%s %d' % (name, formatLabels(labels + [('le', '+Inf')]), histogram.count))
+    lines.append('%s_sum%s %s' % (name, formatLabels(labels), repr(float(histogram.total))))
+    lines.append('%s_count%s %d' % (name, formatLabels(labels), histogram.count))
+
+
+def formatPrometheus(ports, prefix='scservo'):
+    # Prometheus text format of PortHandler objects or PortMetrics
+    metrics = [getattr(port, 'metrics', port) for port in ports]
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+    header('tx_bytes_total', 'counter', 'Bytes written to the port')
+    for m in metrics:
+        lines.append('%s_tx_bytes_total%s %d' % (prefix, formatLabels([('port', m.port_name)]), m.tx_bytes))
+
+    header('rx_bytes_total', 'counter', 'Bytes read from the port')
+    for m in metrics:
+        lines.append('%s_rx_bytes_total%s %d' % (prefix, formatLabels([('port', m.port_name)]), m.rx_bytes))
+
+    header('instructions_total', 'counter', 'Instruction packets sent by instruction')
+    for m in metrics:
+        for instruction, count in sorted(m.instructions.items()):
+            labels = [('port', m.port_name), ('instruction', INSTRUCTION_NAMES.get(instruction, instruction))]
+            lines.append('%s_instructions_total%s %d' % (prefix, formatLabels(labels), count))
+
+    header('retries_total', 'counter', 'Transactions sent again by the retry policy')
+    for m in metrics:
+        lines.append('%s_retries_total%s %d' % (prefix, formatLabels([('port', m.port_name)]), m.retries))
+
+    header('errors_total', 'counter', 'Communication errors by kind')
+    for m in metrics:
+        for name in ERROR_COUNTERS:
+            labels = [('port', m.port_name), ('kind', name)]
+            lines.append('%s_errors_total%s %d' % (prefix, formatLabels(labels), m.errors[name]))
+
+    header('latency_us', 'histogram', 'Round trip time from instruction to status packet in us')
+    for m in metrics:
+        formatHistogram(lines, prefix + '_latency_us', m.latency, [('port', m.port_name)])
+
+    header('servo_transactions_total', 'counter', 'Transactions addressed to each servo')
+    for m in metrics:
+        for scs_id, servo in sorted(m.servos.items()):
+            labels = [('port', m.port_name), ('id', scs_id)]
+            lines.append('%s_servo_transactions_total%s %d' % (prefix, formatLabels(labels), servo.transactions))
+
+    header('servo_retries_total', 'counter', 'Transactions sent again to each servo')
+    for m in metrics:
+        for scs_id, servo in sorted(m.servos.items()):
+            labels = [('port', m.port_name), ('id', scs_id)]
+            lines.append('%s_servo_retries_total%s %d' % (prefix, formatLabels(labels), servo.retries))
+
+    header('servo_errors_total', 'counter', 'Communication errors of each servo by kind')
+    for m in metrics:
+        for scs_id, servo in sorted(m.servos.items()):
+            for name in ERROR_COUNTERS:
+                labels = [('port', m.port_name), ('id', scs_id), ('kind', name)]
+                lines.append('%s_servo_errors_total%s %d' % (prefix, formatLabels(labels), servo.errors[name]))
+
+    header('servo_latency_us', 'histogram', 'Round trip time of each servo in us')
+    for m in metrics:
+        for scs_id, servo in sorted(m.servos.items()):
+            formatHistogram(lines, prefix + '_servo_latency_us', servo.latency, [('port', m.port_name), ('id', scs_id)])
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import stat
+import struct
+import tempfile
+
+from .scservo_def import *
+from .async_packet_handler import *
+
+# in the runtime directory of the user when there is one, not in a world-writable directory
+BUS_SERVER_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), 'scservo_bus.sock')
+
+# permissions of the socket, clients must run as the same user or group
+BUS_SERVER_MODE = 0o660
+
+# time in ms a port worker collects requests before it sends them as one batch
+BUS_BATCH_WINDOW_MS = 1.0
+
+# Request operations
+BUS_OP_PORTS = 0  # names of the served ports, one per line
+BUS_OP_PING = 1
+BUS_OP_READ = 2  # merged with reads of the same range from other clients into one SYNC_READ
+BUS_OP_WRITE = 3  # WRITE with status packet, sent on its own
+BUS_OP_GOAL = 4  # write without status packet, merged with other goals of the same range into one SYNC_WRITE
+BUS_OP_STATS = 5  # JSON statistics of the server
+
+# Request: seq, op, port index, id, address, length, then length data bytes for writes
+BUS_REQUEST = struct.Struct('<IBHBBB')
+# Response: seq, COMM_* result, servo error, data length, then the data
+BUS_RESPONSE = struct.Struct('<IbBH')
+
+
+class BusRequest(object):
+    __slots__ = ('seq', 'op', 'port', 'scs_id', 'address', 'length', 'data', 'future')
+
+    def __init__(self, seq, op, port, scs_id, address, length, data, future):
+        self.seq = seq
+        self.op = op
+        self.port = port
+        self.scs_id = scs_id
+        self.address = address
+        self.length = length
+        self.data = data
+        self.future = future  # set to (result, error, data)
+
+
+class PortWorker(object):
+    """Sends the requests of every client for one port in batches.
+
+    Each batch runs the plain writes in order, then one SYNC_WRITE per goal
+    range, the pings, and one SYNC_READ (or READ for a single servo) per read
+    range, so reads see the writes of the same batch.
+    """
+
+    def __init__(self, port, ph, window_ms=BUS_BATCH_WINDOW_MS):
+        self.port = port
+        self.ph = ph
+        self.window = window_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.requests = 0
+        self.transactions = 0
+        self.batches = 0
+
+    def submit(self, request):
+        self.requests += 1
+        self.queue.put_nowait(request)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.batches += 1
+            try:
+                await self.runBatch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def fail(self, requests, e):
+        # an exception fails only the requests of its own transaction, the client gets COMM_TX_FAIL
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(e)
+
+    async def runBatch(self, batch):
+        goals = {}  # (address, length): {scs_id: [requests]}
+        reads = {}
+        pings = []
+        for request in batch:
+            if request.op == BUS_OP_WRITE:
+                self.transactions += 1
+                try:
+                    result, error = await self.ph.writeTxRx(self.port, request.scs_id, request.address,
+                                                            request.length, request.data)
+                except Exception as e:
+                    self.fail([request], e)
+                    continue
+                request.future.set_result((result, error, b''))
+            elif request.op == BUS_OP_GOAL:
+                goals.setdefault((request.address, request.length), {}).setdefault(request.scs_id, []).append(request)
+            elif request.op == BUS_OP_READ:
+                reads.setdefault((request.address, request.length), {}).setdefault(request.scs_id, []).append(request)
+            elif request.op == BUS_OP_PING:
+                pings.append(request)
+
+        for (address, length), servos in goals.items():
+            # the last goal of a servo wins
+            param = []
+            for scs_id, requests in servos.items():
+                param.append(scs_id)
+                param.extend(requests[-1].data)
+            self.transactions += 1
+            try:
+                result = await self.ph.syncWriteTxOnly(self.port, address, length, param, len(param))
+            except Exception as e:
+                self.fail([request for requests in servos.values() for request in requests], e)
+                continue
+            for requests in servos.values():
+                for request in requests:
+                    request.future.set_result((result, 0, b''))
+
+        for request in pings:
+            self.transactions += 1
+            try:
+                model_number, result, error = await self.ph.ping(self.port, request.scs_id)
+            except Exception as e:
+                self.fail([request], e)
+                continue
+            request.future.set_result((result, error, struct.pack('<H', model_number)))
+
+        for (address, length), servos in reads.items():
+            self.transactions += 1
+            try:
+                if len(servos) == 1:
+                    scs_id = next(iter(servos))
+                    data, result, error = await self.ph.readTxRx(self.port, scs_id, address, length)
+                    rx_dict = {scs_id: (data, result, error, 0)}
+                else:
+                    param = list(servos)
+                    rx_dict, _ = await self.ph.syncReadTxRx(self.port, address, length, param, len(param))
+            except Exception as e:
+                self.fail([request for requests in servos.values() for request in requests], e)
+                continue
+            for scs_id, requests in servos.items():
+                data, result, error, _ = rx_dict.get(scs_id, ([], COMM_RX_TIMEOUT, 0, 0))
+                for request in requests:
+                    request.future.set_result((result, error, bytes(data)))
+
+    def getStats(self):
+        return {
+            'port': self.port.getPortName(),
+            'requests': self.requests,
+            'transactions': self.transactions,
+            'batches': self.batches,
+        }
+
+
+class BusServer(object):
+    """Owns the ports and serves clients on a Unix domain socket.
+
+    ports are opened AsyncPortHandler objects. Every client connection may
+    pipeline requests, responses carry the sequence number of their request.
+    """
+
+    def __init__(self, ports, ph, path=BUS_SERVER_PATH, window_ms=BUS_BATCH_WINDOW_MS):
+        self.ports = list(ports)
+        self.ph = ph
+        self.path = path
+        self.workers = [PortWorker(port, ph, window_ms) for port in self.ports]
+        self.server = None
+        self.tasks = []
+        self.clients = 0
+
+    async def start(self):
+        await self.removeStale()
+        self.server = await asyncio.start_unix_server(self.serveClient, path=self.path)
+        os.chmod(self.path, BUS_SERVER_MODE)
+        self.tasks = [asyncio.ensure_future(worker.run()) for worker in self.workers]
+
+    async def removeStale(self):
+        # the socket of a server that is gone is removed, a running server is never taken over
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError("%s exists and is not a socket" % self.path)
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.path)
+            return
+        writer.close()
+        raise RuntimeError("a bus server is already running on %s" % self.path)
+
+    async def serveForever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            # only the socket this server created
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def getStats(self):
+        return {
+            'clients': self.clients,
+            'ports': [worker.getStats() for worker in self.workers],
+        }
+
+    async def serveClient(self, reader, writer):
+        self.clients += 1
+        pending = set()
+        try:
+            while True:
+                head = await reader.readexactly(BUS_REQUEST.size)
+                seq, op, port, scs_id, address, length = BUS_REQUEST.unpack(head)
+                data = b''
+                if op in (BUS_OP_WRITE, BUS_OP_GOAL):
+                    data = await reader.readexactly(length)
+                task = asyncio.ensure_future(self.handle(writer, seq, op, port, scs_id, address, length, data))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in list(pending):
+                task.cancel()
+            writer.close()
+
+    async def handle(self, writer, seq, op, port, scs_id, address, length, data):
+        if op == BUS_OP_PORTS:
+            result, error, data = COMM_SUCCESS, 0, '\n'.join(port.getPortName() for port in self.ports).encode()
+        elif op == BUS_OP_STATS:
+            result, error, data = COMM_SUCCESS, 0, json.dumps(self.getStats()).encode()
+        elif (port >= len(self.workers) or op not in (BUS_OP_PING, BUS_OP_READ, BUS_OP_WRITE, BUS_OP_GOAL) or
+              scs_id >= BROADCAST_ID):
+            # a request that cannot be sent is refused before it joins a batch with requests of other clients
+            result, error, data = COMM_NOT_AVAILABLE, 0, b''
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.workers[port].submit(BusRequest(seq, op, port, scs_id, address, length, data, future))
+            try:
+                result, error, data = await future
+            except Exception:
+                result, error, data = COMM_TX_FAIL, 0, b''
+        writer.write(BUS_RESPONSE.pack(seq, result, error, len(data)) + data)
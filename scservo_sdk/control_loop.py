@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import os
+import time
+
+from .scservo_def import *
+
+# What ControlLoop does when a cycle ends after the next deadline
+CONTROL_OVERRUN_DROP = 0  # skip the missed cycles and stay on the period grid
+CONTROL_OVERRUN_CATCHUP = 1  # run the missed cycles back to back until on schedule
+
+# Upper bounds in us of the LatencyHistogram buckets, the last bucket takes everything above
+HISTOGRAM_BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 3000, 5000, 7500, 10000, 20000, 50000)
+
+# time before a deadline that is spent polling the clock instead of sleeping
+CONTROL_SPIN_NS = 200000
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=HISTOGRAM_BUCKETS_US):
+        self.buckets = tuple(buckets)
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value_us):
+        idx = 0
+        for bound in self.buckets:
+            if value_us <= bound:
+                break
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value_us
+        if self.min is None or value_us < self.min:
+            self.min = value_us
+        if self.max is None or value_us > self.max:
+            self.max = value_us
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        # upper bound of the bucket holding the pct percentile, max for the overflow bucket
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100.0
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[idx] if idx < len(self.buckets) else self.max
+        return self.max
+
+    def toDict(self):
+        return {
+            'buckets_us': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'min_us': self.min,
+            'max_us': self.max,
+            'mean_us': self.mean(),
+            'p99_us': self.percentile(99),
+        }
+
+
+class ControlLoop(object):
+    """Fixed rate goal write / feedback read cycle.
+
+    Every cycle calls callback(cycle), sends group_sync_write and reads
+    group_sync_read, any of them may be None. Cycles start at absolute
+    monotonic deadlines, the jitter histogram records how late each cycle
+    started and the latency histogram how long its bus traffic took.
+    """
+
+    def __init__(self, rate, group_sync_write=None, group_sync_read=None, callback=None,
+                 overrun=CONTROL_OVERRUN_DROP):
+        self.period = int(1000000000 / rate)
+        self.group_sync_write = group_sync_write
+        self.group_sync_read = group_sync_read
+        self.callback = callback
+        self.overrun = overrun
+        self.spin = CONTROL_SPIN_NS
+        self.running = False
+
+        self.jitter = LatencyHistogram()
+        self.latency = LatencyHistogram()
+        self.clearStats()
+
+    def clearStats(self):
+        self.jitter.clear()
+        self.latency.clear()
+        self.cycles = 0
+        self.overruns = 0
+        self.dropped_cycles = 0
+        self.write_errors = 0
+        self.read_errors = 0
+        self.last_write_result = COMM_NOT_AVAILABLE
+        self.last_read_result = COMM_NOT_AVAILABLE
+
+    def setPriority(self, priority):
+        # SCHED_FIFO for the calling thread, needs CAP_SYS_NICE or root. Returns False if not allowed
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            return True
+        except (AttributeError, OSError):
+            return False
+
+    def setAffinity(self, cpus):
+        # pin the calling process to the given cpus. Returns False if not supported
+        try:
+            os.sched_setaffinity(0, set(cpus))
+            return True
+        except (AttributeError, OSError):
+            return False
+
+    def sleepUntil(self, deadline):
+        remaining = deadline - time.monotonic_ns()
+        if remaining > self.spin:
+            time.sleep((remaining - self.spin) / 1000000000.0)
+        while time.monotonic_ns() < deadline:
+            pass
+
+    def runOnce(self, cycle):
+        if self.callback is not None:
+            self.callback(cycle)
+
+        start = time.monotonic_ns()
+        if self.group_sync_write is not None:
+            self.last_write_result = self.group_sync_write.txPacket()
+            if self.last_write_result != COMM_SUCCESS:
+                self.write_errors += 1
+        if self.group_sync_read is not None:
+            self.last_read_result = self.group_sync_read.txRxPacket()
+            if self.last_read_result != COMM_SUCCESS:
+                self.read_errors += 1
+        self.latency.add((time.monotonic_ns() - start) / 1000.0)
+
+    def run(self, cycles=None):
+        # runs until stop() or for the given number of cycles
+        self.running = True
+        deadline = time.monotonic_ns()
+        done = 0
+        while self.running and (cycles is None or done < cycles):
+            self.sleepUntil(deadline)
+            self.jitter.add((time.monotonic_ns() - deadline) / 1000.0)
+
+            self.runOnce(self.cycles)
+            self.cycles += 1
+            done += 1
+
+            deadline += self.period
+            now = time.monotonic_ns()
+            if now > deadline:
+                self.overruns += 1
+                if self.overrun == CONTROL_OVERRUN_DROP:
+                    missed = (now - deadline) // self.period + 1
+                    self.dropped_cycles += missed
+                    deadline += missed * self.period
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def getStats(self):
+        return {
+            'rate': 1000000000.0 / self.period,
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'dropped_cycles': self.dropped_cycles,
+            'write_errors': self.write_errors,
+            'read_errors': self.read_errors,
+            'jitter': self.jitter.toDict(),
+            'latency': self.latency.toDict(),
+        }
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import struct
+
+from . import scservo_def
+
+# Register classes
+REG_EEPROM = 0  # saved, writes need the lock register opened
+REG_RAM = 1  # lost on power off, written by the host
+REG_STATUS = 2  # RAM updated by the servo itself (present_*), read only
+
+# Servo families
+FAMILY_SCS = 'scs'
+FAMILY_STS = 'sts'
+
+# protocol end used by each family, see SCS_SETEND
+FAMILY_END = {
+    FAMILY_SCS: 1,
+    FAMILY_STS: 0,
+}
+
+# struct codes by register width
+WIDTH_CODE = {
+    1: 'B',
+    2: 'H',
+    4: 'I',
+}
+
+
+class Register(object):
+    """One named control table entry with its codec.
+
+    The struct used to decode a register is built for the protocol end once and
+    cached, encode/decode only apply the sign bit on top of it.
+    """
+
+    def __init__(self, name, address, length, reg_class=REG_RAM, sign_bit=None, lock=None):
+        self.name = name
+        self.address = address
+        self.length = length
+        self.reg_class = reg_class
+        self.sign_bit = sign_bit
+        self.lock = lock  # lock register address for EEPROM entries
+        self.end = None  # protocol end of the family, set by ControlTable
+        self.structs = {}
+
+    def __repr__(self):
+        return "Register(%r, %d, %d)" % (self.name, self.address, self.length)
+
+    def getStruct(self, end=None):
+        if end is None:
+            end = self.end if self.end is not None else scservo_def.SCS_END
+        codec = self.structs.get(end)
+        if codec is None:
+            # SCS_END 1 swaps the bytes inside each word, words stay low first
+            if end == 0 or self.length == 1:
+                codec = struct.Struct('<' + WIDTH_CODE[self.length])
+            elif self.length == 2:
+                codec = struct.Struct('>H')
+            else:
+                codec = struct.Struct('>HH')
+            self.structs[end] = codec
+        return codec
+
+    def decode(self, data, offset=0, end=None):
+        codec = self.getStruct(end)
+        words = codec.unpack_from(bytes(data[offset:offset + self.length]))
+        value = words[0] if len(words) == 1 else words[0] | (words[1] << 16)
+        if self.sign_bit is not None and value & (1 << self.sign_bit):
+            return -(value & ~(1 << self.sign_bit))
+        return value
+
+    def encode(self, value, end=None):
+        if self.sign_bit is not None and value < 0:
+            value = -value | (1 << self.sign_bit)
+        codec = self.getStruct(end)
+        if codec.size == 4 and len(codec.format) == 3:
+            return list(codec.pack(value & 0xFFFF, (value >> 16) & 0xFFFF))
+        return list(codec.pack(value & (0xFFFFFFFF >> (32 - 8 * self.length))))
+
+
+class ControlTable(object):
+    def __init__(self, family, registers):
+        self.family = family
+        self.end = FAMILY_END[family]
+        self.registers = dict((register.name, register) for register in registers)
+        for register in registers:
+            register.end = self.end
+        self.blocks = {}
+
+    def __getitem__(self, name):
+        return self.registers[name]
+
+    def __contains__(self, name):
+        return name in self.registers
+
+    def get(self, name):
+        if isinstance(name, Register):
+            return name
+        return self.registers[name]
+
+    def span(self, names):
+        # (start_address, data_length) covering the named registers, for GroupSyncRead/GroupSyncWrite
+        registers = [self.get(name) for name in names]
+        start = min(register.address for register in registers)
+        stop = max(register.address + register.length for register in registers)
+        return start, stop - start
+
+    def registersIn(self, start_address, data_length):
+        return sorted((register for register in self.registers.values()
+                       if register.address >= start_address and
+                       register.address + register.length <= start_address + data_length),
+                      key=lambda register: register.address)
+
+    def getBlockDecoder(self, start_address, data_length):
+        # one struct for every register inside the block, gaps are skipped with pad bytes
+        key = (start_address, data_length)
+        block = self.blocks.get(key)
+        if block is None:
+            registers = self.registersIn(start_address, data_length)
+            byte_order = '<' if self.end == 0 else '>'
+            fmt = byte_order
+            position = start_address
+            fields = []  # (name, sign_bit, words)
+            for register in registers:
+                if register.address < position:  # overlapping entry
+                    continue
+                fmt += 'x' * (register.address - position)
+                if register.length == 4 and self.end != 0:
+                    fmt += 'HH'
+                    fields.append((register.name, register.sign_bit, 2))
+                else:
+                    fmt += WIDTH_CODE[register.length]
+                    fields.append((register.name, register.sign_bit, 1))
+                position = register.address + register.length
+            fmt += 'x' * (start_address + data_length - position)
+            block = (struct.Struct(fmt), fields)
+            self.blocks[key] = block
+        return block
+
+    def decodeBlock(self, start_address, data):
+        # {name: value} for every register inside data read from start_address
+        codec, fields = self.getBlockDecoder(start_address, len(data))
+        words = codec.unpack(bytes(data))
+        values = {}
+        idx = 0
+        for name, sign_bit, count in fields:
+            value = words[idx] if count == 1 else words[idx] | (words[idx + 1] << 16)
+            idx += count
+            if sign_bit is not None and value & (1 << sign_bit):
+                value = -(value & ~(1 << sign_bit))
+            values[name] = value
+        return values
+
+
+def commonRegisters(lock):
+    # entries shared by the SCS and STS families
+    return [
+        Register('model_number', 3, 2, REG_EEPROM, lock=lock),
+        Register('id', 5, 1, REG_EEPROM, lock=lock),
+        Register('baud_rate', 6, 1, REG_EEPROM, lock=lock),
+        Register('return_delay', 7, 1, REG_EEPROM, lock=lock),
+        Register('response_status_level', 8, 1, REG_EEPROM, lock=lock),
+        Register('min_angle_limit', 9, 2, REG_EEPROM, lock=lock),
+        Register('max_angle_limit', 11, 2, REG_EEPROM, lock=lock),
+        Register('max_temperature_limit', 13, 1, REG_EEPROM, lock=lock),
+        Register('max_input_voltage', 14, 1, REG_EEPROM, lock=lock),
+        Register('min_input_voltage', 15, 1, REG_EEPROM, lock=lock),
+        Register('max_torque', 16, 2, REG_EEPROM, lock=lock),
+        Register('p_coefficient', 21, 1, REG_EEPROM, lock=lock),
+        Register('d_coefficient', 22, 1, REG_EEPROM, lock=lock),
+        Register('i_coefficient', 23, 1, REG_EEPROM, lock=lock),
+        Register('cw_dead_zone', 26, 1, REG_EEPROM, lock=lock),
+        Register('ccw_dead_zone', 27, 1, REG_EEPROM, lock=lock),
+        Register('torque_enable', 40, 1, REG_RAM),
+        Register('goal_time', 44, 2, REG_RAM),
+        Register('present_voltage', 62, 1, REG_STATUS),
+        Register('present_temperature', 63, 1, REG_STATUS),
+        Register('moving', 66, 1, REG_STATUS),
+    ]
+
+
+SCS_CONTROL_TABLE = ControlTable(FAMILY_SCS, commonRegisters(lock=48) + [
+    Register('goal_position', 42, 2, REG_RAM),
+    Register('goal_speed', 46, 2, REG_RAM),
+    Register('lock', 48, 1, REG_RAM),
+    Register('present_position', 56, 2, REG_STATUS),
+    Register('present_speed', 58, 2, REG_STATUS, sign_bit=15),
+    Register('present_load', 60, 2, REG_STATUS, sign_bit=10),
+])
+
+STS_CONTROL_TABLE = ControlTable(FAMILY_STS, commonRegisters(lock=55) + [
+    Register('position_offset', 31, 2, REG_EEPROM, sign_bit=11, lock=55),
+    Register('operating_mode', 33, 1, REG_EEPROM, lock=55),
+    Register('goal_acc', 41, 1, REG_RAM),
+    Register('goal_position', 42, 2, REG_RAM, sign_bit=15),
+    Register('goal_speed', 46, 2, REG_RAM, sign_bit=15),
+    Register('torque_limit', 48, 2, REG_RAM),
+    Register('lock', 55, 1, REG_RAM),
+    Register('present_position', 56, 2, REG_STATUS, sign_bit=15),
+    Register('present_speed', 58, 2, REG_STATUS, sign_bit=15),
+    Register('present_load', 60, 2, REG_STATUS, sign_bit=10),
+    Register('present_current', 69, 2, REG_STATUS, sign_bit=15),
+])
+
+CONTROL_TABLES = {
+    FAMILY_SCS: SCS_CONTROL_TABLE,
+    FAMILY_STS: STS_CONTROL_TABLE,
+}
+
+# model number from ping: family, more can be added with registerModel
+MODEL_FAMILIES = {
+    777: FAMILY_STS,  # STS3215
+    2825: FAMILY_STS,  # STS3250
+    11272: FAMILY_STS,  # SM8512BL
+    # SCS0009, as read with either protocol end
+    1284: FAMILY_SCS,
+    1029: FAMILY_SCS,
+}
+
+
+def registerModel(model_number, family):
+    MODEL_FAMILIES[model_number] = family
+
+
+def getControlTable(model_number=None, protocol_end=None):
+    # Control table of a servo model. Models not registered fall back to the family
+    # of the protocol end in use: SCS_END 1 is SCS, SCS_END 0 is STS
+    family = MODEL_FAMILIES.get(model_number)
+    if family is None:
+        if protocol_end is None:
+            protocol_end = scservo_def.SCS_END
+        family = FAMILY_SCS if protocol_end else FAMILY_STS
+    return CONTROL_TABLES[family]
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
 from .scservo_def import *
+from .array_codec import decodeArray, requireNumpy, np
+from .bus_arbiter import arbitrate
+
+# time in ms added to the wire time of one status packet to wait for the next servo
+SYNC_READ_SLOT_MARGIN = 2.0
 
 class GroupSyncRead:
     def __init__(self, port, ph, start_address, data_length):
@@ -13,6 +18,16 @@ class GroupSyncRead:
         self.is_param_changed = False
         self.param = []
         self.data_dict = {}
+        # per servo outcome of the last rxPacket
+        self.result_dict = {}
+        self.error_dict = {}
+        self.timestamp_dict = {}  # monotonic ns of the last good status packet
+        # None: computed from the baudrate, see getSlotTimeout
+        self.slot_timeout = None
+        # data of all servos in param order for getDataArray, one row of data_length bytes per servo
+        self.row_dict = {}
+        self.data_buffer = bytearray()
+        self.fresh_buffer = bytearray()  # 1 where the last rxPacket got data
 
         self.clearParam()
 
@@ -25,11 +40,20 @@ class GroupSyncRead:
         for scs_id in self.data_dict:
             self.param.append(scs_id)
 
+        self.row_dict = dict((scs_id, row) for row, scs_id in enumerate(self.param))
+        self.data_buffer = bytearray(len(self.param) * self.data_length)
+        self.fresh_buffer = bytearray(len(self.param))
+
+        self.is_param_changed = False
+
     def addParam(self, scs_id):
         if scs_id in self.data_dict:  # scs_id already exist
             return False
 
         self.data_dict[scs_id] = []  # [0] * self.data_length
+        self.result_dict[scs_id] = COMM_NOT_AVAILABLE
+        self.error_dict[scs_id] = 0
+        self.timestamp_dict[scs_id] = 0
 
         self.is_param_changed = True
         return True
@@ -39,11 +63,26 @@ class GroupSyncRead:
             return
 
         del self.data_dict[scs_id]
+        del self.result_dict[scs_id]
+        del self.error_dict[scs_id]
+        del self.timestamp_dict[scs_id]
 
         self.is_param_changed = True
 
     def clearParam(self):
         self.data_dict.clear()
+        self.result_dict.clear()
+        self.error_dict.clear()
+        self.timestamp_dict.clear()
+
+    def setSlotTimeout(self, msec):
+        self.slot_timeout = msec
+
+    def getSlotTimeout(self):
+        # wait for the next status packet: its wire time plus a margin
+        if self.slot_timeout is not None:
+            return self.slot_timeout
+        return self.port.tx_time_per_byte * (6 + self.data_length) + SYNC_READ_SLOT_MARGIN
 
     def txPacket(self):
         if len(self.data_dict.keys()) == 0:
@@ -63,10 +102,26 @@ class GroupSyncRead:
         if len(self.data_dict.keys()) == 0:
             return COMM_NOT_AVAILABLE
 
-        for scs_id in self.data_dict:
-            self.data_dict[scs_id], result, _ = self.ph.readRx(self.port, scs_id, self.data_length)
-            if result != COMM_SUCCESS:
-                return result
+        # all status packets of the burst are read together and matched by id, servos that
+        # did not answer keep their previous data but isAvailable reports them as stale
+        rx_dict, result = self.ph.syncReadRx(self.port, self.data_length, self.param, len(self.param),
+                                             self.getSlotTimeout())
+        for scs_id, (data, scs_result, error, rx_time) in rx_dict.items():
+            if scs_id not in self.data_dict:
+                continue
+            self.result_dict[scs_id] = scs_result
+            row = self.row_dict[scs_id]
+            if scs_result == COMM_SUCCESS:
+                self.data_dict[scs_id] = data
+                self.error_dict[scs_id] = error
+                self.timestamp_dict[scs_id] = rx_time
+                if len(data) == self.data_length:
+                    self.data_buffer[row * self.data_length:(row + 1) * self.data_length] = bytes(data)
+                    self.fresh_buffer[row] = 1
+                else:
+                    self.fresh_buffer[row] = 0
+            else:
+                self.fresh_buffer[row] = 0
 
         if result == COMM_SUCCESS:
             self.last_result = True
@@ -74,17 +129,21 @@ class GroupSyncRead:
         return result
 
     def txRxPacket(self):
-        result = self.txPacket()
-        if result != COMM_SUCCESS:
-            return result
+        with arbitrate(self.port):
+            result = self.txPacket()
+            if result != COMM_SUCCESS:
+                return result
 
-        return self.rxPacket()
+            return self.rxPacket()
 
     def isAvailable(self, scs_id, address, data_length):
         #if self.last_result is False or scs_id not in self.data_dict:
         if scs_id not in self.data_dict:
             return False
 
+        if self.result_dict[scs_id] != COMM_SUCCESS:
+            return False
+
         if (address < self.start_address) or (self.start_address + self.data_length - data_length < address):
             return False
 
@@ -107,4 +166,53 @@ class GroupSyncRead:
                                  SCS_MAKEWORD(self.data_dict[scs_id][address - self.start_address + 2],
                                               self.data_dict[scs_id][address - self.start_address + 3]))
         else:
-            return 0
\ No newline at end of file
+            return 0
+
+    def getResult(self, scs_id):
+        return self.result_dict.get(scs_id, COMM_NOT_AVAILABLE)
+
+    def getError(self, scs_id):
+        return self.error_dict.get(scs_id, 0)
+
+    def getTimestamp(self, scs_id):
+        return self.timestamp_dict.get(scs_id, 0)
+
+    def getDataArray(self, address, data_length, scs_ids=None, sign_bit=None):
+        # getData for many servos as one int64 ndarray, in param order when scs_ids is None.
+        # Values are decoded in SCS_END byte order, sign_bit decodes them like SCS_TOHOST.
+        # Servos without data from the last rxPacket read 0
+        requireNumpy()
+        if scs_ids is None:
+            rows = np.arange(len(self.param))
+        else:
+            rows = np.fromiter((self.row_dict.get(int(scs_id), -1) for scs_id in scs_ids), dtype=np.intp)
+
+        if (address < self.start_address) or (self.start_address + self.data_length - data_length < address):
+            return np.zeros(len(rows), dtype=np.int64)
+
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+        if not len(self.fresh_buffer):
+            return np.zeros(len(rows), dtype=np.int64)
+
+        offset = address - self.start_address
+        block = np.frombuffer(self.data_buffer, dtype=np.uint8).reshape(-1, self.data_length)
+        values = decodeArray(block[rows, offset:offset + data_length], sign_bit)
+        fresh = np.frombuffer(self.fresh_buffer, dtype=np.uint8)[rows].astype(bool) & known
+        values[~fresh] = 0
+        return values
+
+    def getRegister(self, scs_id, register):
+        # getData for a control_table.Register, decoded with its sign bit
+        if not self.isAvailable(scs_id, register.address, register.length):
+            return 0
+        return register.decode(self.data_dict[scs_id], register.address - self.start_address)
+
+    def getRegisterArray(self, register, scs_ids=None):
+        return self.getDataArray(register.address, register.length, scs_ids, register.sign_bit)
+
+    def decodeBlock(self, scs_id, control_table):
+        # {name: value} of every register of control_table inside the read range
+        if not self.isAvailable(scs_id, self.start_address, self.data_length):
+            return {}
+        return control_table.decodeBlock(self.start_address, self.data_dict[scs_id])
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+import time
+
 from .scservo_def import *
+from .packet_codec import SyncWriteFrame
+from .array_codec import encodeArray, updateFrameArray
 
 class GroupSyncWrite:
     def __init__(self, port, ph, start_address, data_length):
@@ -12,6 +16,17 @@ class GroupSyncWrite:
         self.is_param_changed = False
         self.param = []
         self.data_dict = {}
+        # packet compiled by makeParam, changeParam patches it in place
+        self.frame = SyncWriteFrame(start_address, data_length)
+
+        # delta mode, see setDeltaMode
+        self.deadband = None
+        self.refresh_period = None
+        self.sign_bit = None
+        self.delta_frame = SyncWriteFrame(start_address, data_length)
+        self.sent_dict = {}  # scs_id: last transmitted value
+        self.last_refresh = 0
+        self.clearDeltaStats()
 
         self.clearParam()
 
@@ -23,11 +38,16 @@ class GroupSyncWrite:
 
         for scs_id in self.data_dict:
             if not self.data_dict[scs_id]:
+                # nothing to send for this servo, do not send a stale packet either
+                self.frame.clear()
                 return
 
             self.param.append(scs_id)
             self.param.extend(self.data_dict[scs_id])
 
+        self.frame.compile(self.data_dict)
+        self.is_param_changed = False
+
     def addParam(self, scs_id, data):
         if scs_id in self.data_dict:  # scs_id already exist
             return False
@@ -35,16 +55,23 @@ class GroupSyncWrite:
         if len(data) > self.data_length:  # input data is longer than set
             return False
 
-        self.data_dict[scs_id] = data
+        self.data_dict[scs_id] = self.padData(data)
 
         self.is_param_changed = True
         return True
 
+    def padData(self, data):
+        # short data is zero padded to data_length, as SyncWriteFrame.compile sends it
+        if data and len(data) < self.data_length:
+            return list(data) + [0] * (self.data_length - len(data))
+        return data
+
     def removeParam(self, scs_id):
         if scs_id not in self.data_dict:  # NOT exist
             return
 
         del self.data_dict[scs_id]
+        self.sent_dict.pop(scs_id, None)
 
         self.is_param_changed = True
 
@@ -55,13 +82,118 @@ class GroupSyncWrite:
         if len(data) > self.data_length:  # input data is longer than set
             return False
 
-        self.data_dict[scs_id] = data
+        data = self.data_dict[scs_id] = self.padData(data)
+
+        # same servos, only the data of one slot changes
+        if not self.is_param_changed and self.frame.update(scs_id, data):
+            return True
 
         self.is_param_changed = True
         return True
 
+    def setParamArray(self, scs_ids, values, sign_bit=None):
+        # Batch addParam/changeParam: values are encoded in one numpy operation and
+        # patched into the compiled packet when every id is already in it
+        return self.setDataArray(scs_ids, encodeArray(values, self.data_length, sign_bit))
+
+    def setDataArray(self, scs_ids, data):
+        # setParamArray with data already encoded, a uint8 array of one data_length row per servo
+        scs_ids = [int(scs_id) for scs_id in scs_ids]
+        if len(set(scs_ids)) != len(scs_ids):  # duplicated scs_id
+            return False
+
+        if len(data) != len(scs_ids) or data.shape[1] != self.data_length:
+            return False
+
+        if not self.is_param_changed and self.frame.slots.keys() >= set(scs_ids):
+            updateFrameArray(self.frame, scs_ids, data)
+        else:
+            self.is_param_changed = True
+
+        self.data_dict.update(zip(scs_ids, data.tolist()))
+        return True
+
+    def setRegister(self, scs_id, register, value):
+        # addParam/changeParam with a control_table.Register value, the register must span the whole group
+        if register.address != self.start_address or register.length != self.data_length:
+            return False
+
+        if scs_id in self.data_dict:
+            return self.changeParam(scs_id, register.encode(value))
+        return self.addParam(scs_id, register.encode(value))
+
     def clearParam(self):
         self.data_dict.clear()
+        self.sent_dict.clear()
+        self.is_param_changed = True
+
+    def setDeltaMode(self, deadband, refresh_period=None, sign_bit=None):
+        # Only servos whose value moved more than deadband since it was last sent go out,
+        # nothing is sent when no servo moved. Every refresh_period ms all servos are sent
+        # again as a keep-alive. deadband None turns delta mode off
+        self.deadband = deadband
+        self.refresh_period = refresh_period
+        self.sign_bit = sign_bit
+        self.sent_dict.clear()
+        self.last_refresh = 0
+
+    def clearDeltaStats(self):
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+
+    def getDeltaStats(self):
+        return {
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+            'bytes_sent': self.bytes_sent,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    def getValue(self, scs_id):
+        data = self.data_dict[scs_id]
+        if self.data_length == 1:
+            value = data[0]
+        elif self.data_length == 2:
+            value = SCS_MAKEWORD(data[0], data[1])
+        else:
+            value = SCS_MAKEDWORD(SCS_MAKEWORD(data[0], data[1]), SCS_MAKEWORD(data[2], data[3]))
+        if self.sign_bit is not None:
+            value = SCS_TOHOST(value, self.sign_bit)
+        return value
+
+    def txDeltaPacket(self):
+        full_length = self.frame.length
+        now = time.monotonic_ns()
+        if self.refresh_period is not None and now - self.last_refresh >= self.refresh_period * 1000000:
+            changed = list(self.data_dict)
+        else:
+            changed = []
+            for scs_id in self.data_dict:
+                last = self.sent_dict.get(scs_id)
+                if last is None or abs(self.getValue(scs_id) - last) > self.deadband:
+                    changed.append(scs_id)
+
+        if not changed:
+            self.frames_skipped += 1
+            self.bytes_saved += full_length
+            return COMM_SUCCESS
+
+        if len(changed) == len(self.data_dict):
+            frame = self.frame.getFrame()
+            self.last_refresh = now
+        else:
+            frame = self.delta_frame.compile(dict((scs_id, self.data_dict[scs_id]) for scs_id in changed))
+
+        _, result, _ = self.ph.txRxFrame(self.port, frame)
+        if result == COMM_SUCCESS:
+            for scs_id in changed:
+                self.sent_dict[scs_id] = self.getValue(scs_id)
+            self.frames_sent += 1
+            self.bytes_sent += len(frame)
+            self.bytes_saved += full_length - len(frame)
+        return result
 
     def txPacket(self):
         if len(self.data_dict.keys()) == 0:
@@ -70,5 +202,8 @@ class GroupSyncWrite:
         if self.is_param_changed is True or not self.param:
             self.makeParam()
 
-        return self.ph.syncWriteTxOnly(self.port, self.start_address, self.data_length, self.param,
-                                       len(self.data_dict.keys()) * (1 + self.data_length))
\ No newline at end of file
+        if self.deadband is not None:
+            return self.txDeltaPacket()
+
+        _, result, _ = self.ph.txRxFrame(self.port, self.frame.getFrame())
+        return result
\ No newline at end of file
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+import struct
+
+from .scservo_def import *
+
+TXPACKET_MAX_LEN = 250
+RXPACKET_MAX_LEN = 250
+
+# for Protocol Packet
+PKT_HEADER0 = 0
+PKT_HEADER1 = 1
+PKT_ID = 2
+PKT_LENGTH = 3
+PKT_INSTRUCTION = 4
+PKT_ERROR = 4
+PKT_PARAMETER0 = 5
+
+# ID LENGTH INSTRUCTION ADDRESS, packed in front of every read/write parameter block
+PKT_HEAD = struct.Struct('<BBBB')
+# ID LENGTH INSTRUCTION ADDRESS DATA_LENGTH, used for READ and SYNC_READ
+PKT_HEAD_READ = struct.Struct('<BBBBB')
+
+
+class PacketEncoder(object):
+    """Builds instruction packets in a preallocated buffer.
+
+    Frames are returned as memoryview slices of the encoder buffer, so they are
+    only valid until the next call on the same encoder. Frames that never change
+    (PING, ACTION, READ, SYNC_READ of the same ids) are kept as immutable bytes.
+    None is returned for packets longer than TXPACKET_MAX_LEN.
+    """
+
+    def __init__(self, size=TXPACKET_MAX_LEN):
+        self.buffer = bytearray(size)
+        self.buffer[PKT_HEADER0] = 0xFF
+        self.buffer[PKT_HEADER1] = 0xFF
+        self.view = memoryview(self.buffer)
+        self.frame_cache = {}
+
+    def finish(self, total_length, head_sum):
+        # head_sum covers everything from PKT_ID up to the first data byte
+        buffer = self.buffer
+        buffer[total_length - 1] = ~(head_sum + sum(self.view[PKT_PARAMETER0 + 1:total_length - 1])) & 0xFF
+        return self.view[:total_length]
+
+    def fixedFrame(self, scs_id, instruction, params=()):
+        key = (scs_id, instruction, bytes(params))
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            if len(key[2]) + 6 > TXPACKET_MAX_LEN:
+                return None
+            length = len(key[2]) + 2
+            frame = bytearray(length + 4)
+            frame[PKT_HEADER0] = 0xFF
+            frame[PKT_HEADER1] = 0xFF
+            frame[PKT_ID] = scs_id
+            frame[PKT_LENGTH] = length
+            frame[PKT_INSTRUCTION] = instruction
+            frame[PKT_PARAMETER0:PKT_PARAMETER0 + length - 2] = key[2]
+            frame[-1] = ~sum(frame[PKT_ID:-1]) & 0xFF
+            frame = bytes(frame)
+            if len(self.frame_cache) > 1024:
+                self.frame_cache.clear()
+            self.frame_cache[key] = frame
+        return frame
+
+    def ping(self, scs_id):
+        return self.fixedFrame(scs_id, INST_PING)
+
+    def action(self, scs_id):
+        return self.fixedFrame(scs_id, INST_ACTION)
+
+    def read(self, scs_id, address, length):
+        return self.fixedFrame(scs_id, INST_READ, (address, length))
+
+    def write(self, scs_id, instruction, address, length, data):
+        # WRITE and REG_WRITE: HEADER0 HEADER1 ID LEN INST ADDR DATA... CHKSUM
+        total_length = length + 7
+        if total_length > TXPACKET_MAX_LEN:
+            return None
+        PKT_HEAD.pack_into(self.buffer, PKT_ID, scs_id, length + 3, instruction, address)
+        # short data is zero padded, the slice must keep its size while the buffer is exported
+        self.buffer[PKT_PARAMETER0 + 1:PKT_PARAMETER0 + 1 + length] = bytes(data[0:length]).ljust(length, b'\0')
+        return self.finish(total_length, scs_id + length + 3 + instruction + address)
+
+    def syncRead(self, start_address, data_length, param, param_length):
+        return self.fixedFrame(BROADCAST_ID, INST_SYNC_READ,
+                               bytes((start_address, data_length)) + bytes(param[0:param_length]))
+
+    def syncWrite(self, start_address, data_length, param, param_length):
+        # HEADER0 HEADER1 ID LEN INST START_ADDR DATA_LEN PARAM... CHKSUM
+        total_length = param_length + 8
+        if total_length > TXPACKET_MAX_LEN:
+            return None
+        PKT_HEAD_READ.pack_into(self.buffer, PKT_ID, BROADCAST_ID, param_length + 4, INST_SYNC_WRITE,
+                                start_address, data_length)
+        self.buffer[PKT_PARAMETER0 + 2:PKT_PARAMETER0 + 2 + param_length] = \
+            bytes(param[0:param_length]).ljust(param_length, b'\0')
+        head_sum = BROADCAST_ID + param_length + 4 + INST_SYNC_WRITE + start_address
+        return self.finish(total_length, head_sum)
+
+
+RXBUFFER_LEN = 4096
+
+# PacketDecoder states
+RX_STATE_HEADER = 0  # looking for 0xFF 0xFF
+RX_STATE_FIELDS = 1  # waiting for ID LENGTH ERROR
+RX_STATE_BODY = 2  # waiting for the rest of the packet
+
+
+class PacketDecoder(object):
+    """Incremental status packet parser.
+
+    Bytes are fed in chunks of any size into a fixed buffer. next() returns one
+    packet at a time, so a single read of a sync read reply burst yields all of
+    its packets. Junk is dropped a byte at a time only while the packet fields
+    look invalid, a packet with a bad checksum is consumed whole, so the parser
+    never rescans data it has already accepted.
+    """
+
+    def __init__(self, size=RXBUFFER_LEN):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.head = 0
+        self.tail = 0
+        self.state = RX_STATE_HEADER
+        self.wait_length = 6  # minimum length (HEADER0 HEADER1 ID LENGTH ERROR CHKSUM)
+
+        self.dropped_bytes = 0
+        self.checksum_errors = 0
+
+    def clear(self):
+        # returns the discarded bytes
+        data = bytes(self.view[self.head:self.tail])
+        self.head = 0
+        self.tail = 0
+        self.state = RX_STATE_HEADER
+        self.wait_length = 6
+        return data
+
+    def pending(self):
+        return self.tail - self.head
+
+    def needed(self):
+        # bytes still missing for the packet being parsed
+        return max(self.wait_length - (self.tail - self.head), 1)
+
+    def feed(self, data):
+        length = len(data)
+        if not length:
+            return 0
+
+        size = len(self.buffer)
+        if length > size:
+            # larger than the whole buffer, only the newest bytes can be kept
+            self.dropped_bytes += length - size
+            data = data[length - size:]
+            length = size
+
+        if self.tail + length > size:
+            pending = self.tail - self.head
+            if pending + length > size:
+                # overflow, drop the oldest bytes and look for a new header
+                drop = pending + length - size
+                self.dropped_bytes += drop
+                self.head += drop
+                pending -= drop
+                self.state = RX_STATE_HEADER
+                self.wait_length = 6
+            # move unparsed bytes to the front of the buffer
+            self.buffer[0:pending] = bytes(self.view[self.head:self.tail])
+            self.head = 0
+            self.tail = pending
+
+        self.buffer[self.tail:self.tail + length] = data
+        self.tail += length
+        return length
+
+    def next(self):
+        buffer = self.buffer
+        while True:
+            head = self.head
+            available = self.tail - head
+
+            if self.state == RX_STATE_HEADER:
+                idx = buffer.find(b'\xff\xff', head, self.tail)
+                if idx < 0:
+                    # keep a trailing 0xFF, it may be the first header byte
+                    keep = 1 if available and buffer[self.tail - 1] == 0xFF else 0
+                    self.dropped_bytes += available - keep
+                    self.head = self.tail - keep
+                    if not keep:
+                        self.head = self.tail = 0
+                    return None, COMM_RX_WAITING
+                self.dropped_bytes += idx - head
+                self.head = idx
+                self.state = RX_STATE_FIELDS
+                self.wait_length = 6
+                continue
+
+            if available < self.wait_length:
+                return None, COMM_RX_WAITING
+
+            if self.state == RX_STATE_FIELDS:
+                if (buffer[head + PKT_ID] > 0xFD) or (buffer[head + PKT_LENGTH] > RXPACKET_MAX_LEN) or (
+                        buffer[head + PKT_LENGTH] < 2) or (buffer[head + PKT_ERROR] > 0x7F):
+                    # unavailable ID or unavailable Length or unavailable Error
+                    # remove the first byte and look for the next header
+                    self.dropped_bytes += 1
+                    self.head = head + 1
+                    self.state = RX_STATE_HEADER
+                    continue
+
+                # exact length of the rx packet
+                self.wait_length = buffer[head + PKT_LENGTH] + PKT_LENGTH + 1
+                self.state = RX_STATE_BODY
+                continue
+
+            end = head + self.wait_length
+            packet = bytes(self.view[head:end])
+            self.head = end
+            self.state = RX_STATE_HEADER
+            self.wait_length = 6
+            if self.head == self.tail:
+                self.head = self.tail = 0
+
+            # verify checksum, except header and checksum
+            if packet[-1] == ~sum(packet[PKT_ID:-1]) & 0xFF:
+                return packet, COMM_SUCCESS
+
+            self.checksum_errors += 1
+            return packet, COMM_RX_CORRUPT
+
+
+class SyncWriteFrame(object):
+    """SYNC_WRITE packet compiled once for a fixed set of servos.
+
+    Every servo gets a slot of data_length bytes. update() patches a slot in place
+    and adjusts the checksum by the difference of the old and new bytes, so
+    sending a frame again does not allocate or rescan the packet.
+    """
+
+    def __init__(self, start_address, data_length):
+        self.start_address = start_address
+        self.data_length = data_length
+        self.buffer = bytearray(TXPACKET_MAX_LEN)
+        self.view = memoryview(self.buffer)
+        self.slots = {}  # scs_id: offset of its data in buffer
+        self.frame = None
+        self.length = 0
+        self.sum = 0  # sum of ID..last data byte
+
+    def compile(self, data_dict):
+        # HEADER0 HEADER1 ID LEN INST START_ADDR DATA_LEN [ID DATA...]... CHKSUM
+        self.clear()
+        param_length = len(data_dict) * (1 + self.data_length)
+        self.length = param_length + 8
+        if self.length > TXPACKET_MAX_LEN:
+            return None
+
+        buffer = self.buffer
+        buffer[PKT_HEADER0] = 0xFF
+        buffer[PKT_HEADER1] = 0xFF
+        PKT_HEAD_READ.pack_into(buffer, PKT_ID, BROADCAST_ID, param_length + 4, INST_SYNC_WRITE,
+                                self.start_address, self.data_length)
+        offset = PKT_PARAMETER0 + 2
+        for scs_id, data in data_dict.items():
+            buffer[offset] = scs_id
+            self.slots[scs_id] = offset + 1
+            # short data is zero padded to data_length
+            buffer[offset + 1:offset + 1 + self.data_length] = bytes(data[0:self.data_length]).ljust(self.data_length, b'\0')
+            offset += 1 + self.data_length
+
+        self.sum = sum(self.view[PKT_ID:self.length - 1])
+        buffer[self.length - 1] = ~self.sum & 0xFF
+        self.frame = self.view[:self.length]
+        return self.frame
+
+    def clear(self):
+        self.slots.clear()
+        self.frame = None
+        self.length = 0
+
+    def update(self, scs_id, data):
+        offset = self.slots.get(scs_id)
+        if offset is None:
+            return False
+
+        buffer = self.buffer
+        delta = 0
+        # short data is zero padded, as in compile
+        for idx in range(self.data_length):
+            value = data[idx] if idx < len(data) else 0
+            delta += value - buffer[offset + idx]
+            buffer[offset + idx] = value
+        if delta:
+            self.sum += delta
+            buffer[self.length - 1] = ~self.sum & 0xFF
+        return True
+
+    def getFrame(self):
+        return self.frame
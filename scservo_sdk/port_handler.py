@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
 import time
+import select
 import serial
 import sys
 import platform
 
+from .bus_metrics import PortMetrics
+
 LATENCY_TIMER = 16
 DEFAULT_BAUDRATE = 1000000
 
+# How rxPacket waits for status packet bytes
+PORT_WAIT_SPIN = 0  # keep polling readPort until the packet timeout
+PORT_WAIT_BLOCK = 1  # sleep in select() on the port until data arrives or the packet timeout
+
 
 class PortHandler(object):
     def __init__(self, port_name):
@@ -15,11 +22,17 @@ class PortHandler(object):
         self.baudrate = DEFAULT_BAUDRATE
         self.packet_start_time = 0.0
         self.packet_timeout = 0.0
+        self.packet_deadline = 0  # monotonic ns
         self.tx_time_per_byte = 0.0
+        self.wait_mode = PORT_WAIT_BLOCK
+        self.fd = None
 
         self.is_using = False
         self.port_name = port_name
         self.ser = None
+        self.metrics = PortMetrics(port_name)
+        self.arbiter = None  # BusArbiter of threads sharing the port
+        self.calibration = None  # TimeoutCalibration of the packet timeouts
 
     def openPort(self):
         return self.setBaudRate(self.baudrate)
@@ -27,16 +40,32 @@ class PortHandler(object):
     def closePort(self):
         self.ser.close()
         self.is_open = False
+        self.fd = None
 
     def clearPort(self):
+        # before every instruction: finish the output and drop stale input, such as a reply that came too late
         self.ser.flush()
+        self.ser.reset_input_buffer()
 
     def setPortName(self, port_name):
         self.port_name = port_name
+        self.metrics.port_name = port_name
 
     def getPortName(self):
         return self.port_name
 
+    def setArbiter(self, arbiter):
+        self.arbiter = arbiter
+
+    def getArbiter(self):
+        return self.arbiter
+
+    def setCalibration(self, calibration):
+        self.calibration = calibration
+
+    def getCalibration(self):
+        return self.calibration
+
     def setBaudRate(self, baudrate):
         baud = self.getCFlagBaud(baudrate)
 
@@ -63,30 +92,54 @@ class PortHandler(object):
     def writePort(self, packet):
         return self.ser.write(packet)
 
-    def setPacketTimeout(self, packet_length):
-        self.packet_start_time = self.getCurrentTime()
-        self.packet_timeout = (self.tx_time_per_byte * packet_length) + (LATENCY_TIMER * 2.0) + 2.0
+    def setPacketTimeout(self, packet_length, scs_id=None):
+        # the calibrated timeout of scs_id when the port has one, else the worst case latency timer allowance
+        if self.calibration is not None:
+            msec = self.calibration.getTimeout(scs_id, packet_length)
+            if msec is not None:
+                return self.setPacketTimeoutMillis(msec)
+        self.setPacketTimeoutMillis((self.tx_time_per_byte * packet_length) + (LATENCY_TIMER * 2.0) + 2.0)
 
     def setPacketTimeoutMillis(self, msec):
-        self.packet_start_time = self.getCurrentTime()
+        now = self.getCurrentTimeNs()
+        self.packet_start_time = now / 1000000.0
         self.packet_timeout = msec
+        self.packet_deadline = now + int(msec * 1000000)
 
     def isPacketTimeout(self):
-        if self.getTimeSinceStart() > self.packet_timeout:
+        if self.getCurrentTimeNs() > self.packet_deadline:
             self.packet_timeout = 0
             return True
 
         return False
 
     def getCurrentTime(self):
-        return round(time.time() * 1000000000) / 1000000.0
+        return self.getCurrentTimeNs() / 1000000.0
+
+    def getCurrentTimeNs(self):
+        return time.monotonic_ns()
 
     def getTimeSinceStart(self):
-        time_since = self.getCurrentTime() - self.packet_start_time
-        if time_since < 0.0:
-            self.packet_start_time = self.getCurrentTime()
+        return self.getCurrentTime() - self.packet_start_time
+
+    def setWaitMode(self, wait_mode):
+        self.wait_mode = wait_mode
 
-        return time_since
+    def getWaitMode(self):
+        return self.wait_mode
+
+    def waitPort(self):
+        # Blocks until the port is readable or the packet deadline passes.
+        # Returns immediately in PORT_WAIT_SPIN mode or when the port has no file descriptor
+        if self.wait_mode != PORT_WAIT_BLOCK or self.fd is None:
+            return True
+
+        remaining = self.packet_deadline - self.getCurrentTimeNs()
+        if remaining <= 0:
+            return False
+
+        readable, _, _ = select.select([self.fd], [], [], remaining / 1000000000.0)
+        return bool(readable)
 
     def setupPort(self, cflag_baud):
         if self.is_open:
@@ -105,6 +158,12 @@ class PortHandler(object):
 
         self.ser.reset_input_buffer()
 
+        # select() needs a real file descriptor, not available on Windows
+        try:
+            self.fd = self.ser.fileno()
+        except (AttributeError, NotImplementedError, serial.SerialException):
+            self.fd = None
+
         self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
 
         return True
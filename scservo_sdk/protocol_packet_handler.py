@@ -1,18 +1,11 @@
 #!/usr/bin/env python
 
-from .scservo_def import *
-
-TXPACKET_MAX_LEN = 250
-RXPACKET_MAX_LEN = 250
+import threading
+import time
 
-# for Protocol Packet
-PKT_HEADER0 = 0
-PKT_HEADER1 = 1
-PKT_ID = 2
-PKT_LENGTH = 3
-PKT_INSTRUCTION = 4
-PKT_ERROR = 4
-PKT_PARAMETER0 = 5
+from .scservo_def import *
+from .packet_codec import *
+from .bus_arbiter import arbitrate
 
 # Protocol Error bit
 ERRBIT_VOLTAGE = 1
@@ -21,8 +14,78 @@ ERRBIT_OVERHEAT = 4
 ERRBIT_OVERELE = 8
 ERRBIT_OVERLOAD = 32
 
+# Instructions sent again by default after a lost or corrupt status packet. Writing the
+# same value twice is harmless, REG_WRITE/ACTION sequences are not. PING is left out
+# so that scans do not wait twice for every missing id
+RETRY_SAFE_INSTRUCTIONS = (INST_READ, INST_WRITE)
+
+# Results worth another attempt, the others will not change by sending again
+RETRY_RESULTS = (COMM_RX_TIMEOUT, COMM_RX_CORRUPT)
+
+
+class RetryPolicy(object):
+    """How txRxPacket/txRxFrame repeat a transaction that got no valid status packet.
+
+    max_attempts counts the first try, timeout_ms replaces the default packet
+    timeout of every attempt, and attempt n waits backoff_ms * backoff_factor ** (n - 2)
+    before it is sent. The default policy makes a single attempt.
+    """
+
+    def __init__(self, max_attempts=1, timeout_ms=None, backoff_ms=0.0, backoff_factor=2.0,
+                 instructions=RETRY_SAFE_INSTRUCTIONS):
+        self.max_attempts = max_attempts
+        self.timeout_ms = timeout_ms
+        self.backoff_ms = backoff_ms
+        self.backoff_factor = backoff_factor
+        self.instructions = frozenset(instructions)
+        self.clearStats()
+
+    def clearStats(self):
+        self.transactions = 0
+        self.retries = 0
+        self.recovered = 0  # succeeded after at least one retry
+        self.failed = 0  # still failing after the last attempt
+
+    def getTimeout(self, timeout_ms):
+        return timeout_ms if timeout_ms is not None else self.timeout_ms
+
+    def shouldRetry(self, txpacket, result, attempt):
+        return (attempt < self.max_attempts and result in RETRY_RESULTS and
+                txpacket[PKT_INSTRUCTION] in self.instructions and txpacket[PKT_ID] != BROADCAST_ID)
+
+    def backoff(self, attempt):
+        # attempt is the one that just failed
+        if self.backoff_ms > 0:
+            time.sleep(self.backoff_ms * self.backoff_factor ** (attempt - 1) / 1000.0)
+
+    def record(self, result, attempt):
+        self.transactions += 1
+        self.retries += attempt - 1
+        if result == COMM_SUCCESS:
+            if attempt > 1:
+                self.recovered += 1
+        elif result in RETRY_RESULTS:
+            self.failed += 1
+
+    def getStats(self):
+        return {
+            'transactions': self.transactions,
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'failed': self.failed,
+        }
+
 
 class protocol_packet_handler(object):
+    def __init__(self):
+        # one encoder per port, frames are only valid until the next packet on that port
+        self.encoders = {}
+        # one decoder per port, bytes past the current status packet are kept for the next rxPacket
+        self.decoders = {}
+        # threads sharing a port through an arbiter keep their encoders here, freed with the thread
+        self.local = threading.local()
+        self.retry_policy = RetryPolicy()
+
     def getProtocolVersion(self):
         return 1.0
 
@@ -66,106 +129,103 @@ class protocol_packet_handler(object):
 
         return ""
 
+    def setRetryPolicy(self, retry_policy):
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+    def getRetryPolicy(self):
+        return self.retry_policy
+
+    def getEncoder(self, port):
+        # threads sharing a port through an arbiter encode into their own buffers
+        encoders = self.encoders
+        if getattr(port, 'arbiter', None) is not None:
+            encoders = getattr(self.local, 'encoders', None)
+            if encoders is None:
+                encoders = self.local.encoders = {}
+        encoder = encoders.get(port)
+        if encoder is None:
+            encoder = encoders.setdefault(port, PacketEncoder())
+        return encoder
+
+    def getDecoder(self, port):
+        decoder = self.decoders.get(port)
+        if decoder is None:
+            decoder = self.decoders.setdefault(port, PacketDecoder())
+        return decoder
+
     def txPacket(self, port, txpacket):
-        checksum = 0
         total_packet_length = txpacket[PKT_LENGTH] + 4  # 4: HEADER0 HEADER1 ID LENGTH
 
-        if port.is_using:
-            return COMM_PORT_BUSY
-        port.is_using = True
-
         # check max packet length
         if total_packet_length > TXPACKET_MAX_LEN:
-            port.is_using = False
+            if port.is_using:
+                port.metrics.countError('busy')
+                return COMM_PORT_BUSY
+            port.metrics.countError('tx_error')
             return COMM_TX_ERROR
 
         # make packet header
         txpacket[PKT_HEADER0] = 0xFF
         txpacket[PKT_HEADER1] = 0xFF
 
-        # add a checksum to the packet
-        for idx in range(2, total_packet_length - 1):  # except header, checksum
-            checksum += txpacket[idx]
-
-        txpacket[total_packet_length - 1] = ~checksum & 0xFF
+        # add a checksum to the packet, except header and checksum
+        txpacket[total_packet_length - 1] = ~sum(txpacket[2:total_packet_length - 1]) & 0xFF
 
         #print "[TxPacket] %r" % txpacket
 
+        return self.txFrame(port, txpacket)
+
+    def txFrame(self, port, frame):
+        # frame already carries header and checksum, see PacketEncoder
+        if port.is_using:
+            port.metrics.countError('busy')
+            return COMM_PORT_BUSY
+
+        # encoder returns None for packets longer than TXPACKET_MAX_LEN
+        if frame is None:
+            port.metrics.countError('tx_error')
+            return COMM_TX_ERROR
+        port.is_using = True
+
         # tx packet
         port.clearPort()
-        written_packet_length = port.writePort(txpacket)
-        if total_packet_length != written_packet_length:
+        self.getDecoder(port).clear()
+        written_packet_length = port.writePort(frame)
+        port.metrics.countTx(frame, written_packet_length)
+        if frame[PKT_LENGTH] + 4 != written_packet_length:  # 4: HEADER0 HEADER1 ID LENGTH
             port.is_using = False
+            port.metrics.countError('tx_fail')
             return COMM_TX_FAIL
 
         return COMM_SUCCESS
 
-    def rxPacket(self, port):
-        rxpacket = []
+    def rxPacket(self, port, read_length=0):
+        # read_length lets a sync read take the whole reply burst in one read
+        decoder = self.getDecoder(port)
 
-        result = COMM_TX_FAIL
-        checksum = 0
-        rx_length = 0
-        wait_length = 6  # minimum length (HEADER0 HEADER1 ID LENGTH ERROR CHKSUM)
         while True:
-            rxpacket.extend(port.readPort(wait_length - rx_length))
-            rx_length = len(rxpacket)
-            if rx_length >= wait_length:
-                # find packet header
-                for idx in range(0, (rx_length - 1)):
-                    if (rxpacket[idx] == 0xFF) and (rxpacket[idx + 1] == 0xFF):
-                        break
-
-                if idx == 0:  # found at the beginning of the packet
-                    if (rxpacket[PKT_ID] > 0xFD) or (rxpacket[PKT_LENGTH] > RXPACKET_MAX_LEN) or (
-                            rxpacket[PKT_ERROR] > 0x7F):
-                        # unavailable ID or unavailable Length or unavailable Error
-                        # remove the first byte in the packet
-                        del rxpacket[0]
-                        rx_length -= 1
-                        continue
-
-                    # re-calculate the exact length of the rx packet
-                    if wait_length != (rxpacket[PKT_LENGTH] + PKT_LENGTH + 1):
-                        wait_length = rxpacket[PKT_LENGTH] + PKT_LENGTH + 1
-                        continue
-
-                    if rx_length < wait_length:
-                        # check timeout
-                        if port.isPacketTimeout():
-                            if rx_length == 0:
-                                result = COMM_RX_TIMEOUT
-                            else:
-                                result = COMM_RX_CORRUPT
-                            break
-                        else:
-                            continue
-
-                    # calculate checksum
-                    for i in range(2, wait_length - 1):  # except header, checksum
-                        checksum += rxpacket[i]
-                    checksum = ~checksum & 0xFF
-
-                    # verify checksum
-                    if rxpacket[wait_length - 1] == checksum:
-                        result = COMM_SUCCESS
-                    else:
-                        result = COMM_RX_CORRUPT
-                    break
+            rxpacket, result = decoder.next()
+            if result != COMM_RX_WAITING:
+                if result == COMM_RX_CORRUPT:
+                    port.metrics.countError('checksum')
+                break
 
+            data = port.readPort(max(decoder.needed(), read_length - decoder.pending()))
+            if data:
+                port.metrics.countRx(len(data))
+                decoder.feed(data)
+                continue
+
+            # check timeout, only when a read after the deadline came back empty
+            if port.isPacketTimeout():
+                if decoder.pending() == 0:
+                    result = COMM_RX_TIMEOUT
                 else:
-                    # remove unnecessary packets
-                    del rxpacket[0: idx]
-                    rx_length -= idx
-
-            else:
-                # check timeout
-                if port.isPacketTimeout():
-                    if rx_length == 0:
-                        result = COMM_RX_TIMEOUT
-                    else:
-                        result = COMM_RX_CORRUPT
-                    break
+                    result = COMM_RX_CORRUPT
+                # drop the partial packet so it does not swallow the next one
+                rxpacket = decoder.clear()
+                break
+            port.waitPort()
 
         port.is_using = False
 
@@ -173,15 +233,51 @@ class protocol_packet_handler(object):
 
         return rxpacket, result
 
-    def txRxPacket(self, port, txpacket):
+    def txRxPacket(self, port, txpacket, retry_policy=None):
+        # retry_policy overrides the policy of the handler for this call
+        policy = retry_policy if retry_policy is not None else self.retry_policy
+        attempt = 1
+        while True:
+            with arbitrate(port):
+                # tx packet
+                result = self.txPacket(port, txpacket)
+                if result != COMM_SUCCESS:
+                    return None, result, 0
+
+                rxpacket, result, error = self.rxAfterTx(port, txpacket, policy.getTimeout(None))
+            if not policy.shouldRetry(txpacket, result, attempt):
+                policy.record(result, attempt)
+                return rxpacket, result, error
+
+            port.metrics.countRetry(txpacket[PKT_ID])
+            policy.backoff(attempt)
+            attempt += 1
+
+    def txRxFrame(self, port, frame, timeout_ms=None, retry_policy=None):
+        policy = retry_policy if retry_policy is not None else self.retry_policy
+        attempt = 1
+        while True:
+            # the port is released between attempts, so a retry backoff does not hold up other threads
+            with arbitrate(port):
+                # tx packet
+                result = self.txFrame(port, frame)
+                if result != COMM_SUCCESS:
+                    return None, result, 0
+
+                rxpacket, result, error = self.rxAfterTx(port, frame, policy.getTimeout(timeout_ms))
+            if not policy.shouldRetry(frame, result, attempt):
+                policy.record(result, attempt)
+                return rxpacket, result, error
+
+            port.metrics.countRetry(frame[PKT_ID])
+            policy.backoff(attempt)
+            attempt += 1
+
+    def rxAfterTx(self, port, txpacket, timeout_ms=None):
         rxpacket = None
+        result = COMM_SUCCESS
         error = 0
 
-        # tx packet
-        result = self.txPacket(port, txpacket)
-        if result != COMM_SUCCESS:
-            return rxpacket, result, error
-
         # (ID == Broadcast ID) == no need to wait for status packet or not available
         if (txpacket[PKT_ID] == BROADCAST_ID):
             port.is_using = False
@@ -189,9 +285,13 @@ class protocol_packet_handler(object):
 
         # set packet timeout
         if txpacket[PKT_INSTRUCTION] == INST_READ:
-            port.setPacketTimeout(txpacket[PKT_PARAMETER0 + 1] + 6)
+            rx_length = txpacket[PKT_PARAMETER0 + 1] + 6
+        else:
+            rx_length = 6  # HEADER0 HEADER1 ID LENGTH ERROR CHECKSUM
+        if timeout_ms is not None:
+            port.setPacketTimeoutMillis(timeout_ms)
         else:
-            port.setPacketTimeout(6)  # HEADER0 HEADER1 ID LENGTH ERROR CHECKSUM
+            port.setPacketTimeout(rx_length, txpacket[PKT_ID])
 
         # rx packet
         while True:
@@ -202,24 +302,22 @@ class protocol_packet_handler(object):
         if result == COMM_SUCCESS and txpacket[PKT_ID] == rxpacket[PKT_ID]:
             error = rxpacket[PKT_ERROR]
 
+        port.metrics.countResult(txpacket[PKT_ID], result, error)
+        if port.calibration is not None:
+            port.calibration.record(txpacket[PKT_ID], result, rx_length)
+
         return rxpacket, result, error
 
-    def ping(self, port, scs_id):
+    def ping(self, port, scs_id, timeout_ms=None, read_model=True):
         model_number = 0
         error = 0
 
-        txpacket = [0] * 6
-
         if scs_id >= BROADCAST_ID:
             return model_number, COMM_NOT_AVAILABLE, error
 
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = 2
-        txpacket[PKT_INSTRUCTION] = INST_PING
+        rxpacket, result, error = self.txRxFrame(port, self.getEncoder(port).ping(scs_id), timeout_ms)
 
-        rxpacket, result, error = self.txRxPacket(port, txpacket)
-
-        if result == COMM_SUCCESS:
+        if result == COMM_SUCCESS and read_model:
             data_read, result, error = self.readTxRx(port, scs_id, 3, 2)  # Address 3 : Model Number
             if result == COMM_SUCCESS:
                 model_number = SCS_MAKEWORD(data_read[0], data_read[1])
@@ -227,34 +325,19 @@ class protocol_packet_handler(object):
         return model_number, result, error
 
     def action(self, port, scs_id):
-        txpacket = [0] * 6
-
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = 2
-        txpacket[PKT_INSTRUCTION] = INST_ACTION
-
-        _, result, _ = self.txRxPacket(port, txpacket)
+        _, result, _ = self.txRxFrame(port, self.getEncoder(port).action(scs_id))
 
         return result
 
     def readTx(self, port, scs_id, address, length):
-
-        txpacket = [0] * 8
-
         if scs_id >= BROADCAST_ID:
             return COMM_NOT_AVAILABLE
 
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = 4
-        txpacket[PKT_INSTRUCTION] = INST_READ
-        txpacket[PKT_PARAMETER0 + 0] = address
-        txpacket[PKT_PARAMETER0 + 1] = length
-
-        result = self.txPacket(port, txpacket)
+        result = self.txFrame(port, self.getEncoder(port).read(scs_id, address, length))
 
         # set packet timeout
         if result == COMM_SUCCESS:
-            port.setPacketTimeout(length + 6)
+            port.setPacketTimeout(length + 6, scs_id)
 
         return result
 
@@ -276,22 +359,19 @@ class protocol_packet_handler(object):
 
             data.extend(rxpacket[PKT_PARAMETER0: PKT_PARAMETER0 + length])
 
+        port.metrics.countResult(scs_id, result, error)
+        if port.calibration is not None:
+            port.calibration.record(scs_id, result, length + 6)
+
         return data, result, error
 
     def readTxRx(self, port, scs_id, address, length):
-        txpacket = [0] * 8
         data = []
 
         if scs_id >= BROADCAST_ID:
             return data, COMM_NOT_AVAILABLE, 0
 
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = 4
-        txpacket[PKT_INSTRUCTION] = INST_READ
-        txpacket[PKT_PARAMETER0 + 0] = address
-        txpacket[PKT_PARAMETER0 + 1] = length
-
-        rxpacket, result, error = self.txRxPacket(port, txpacket)
+        rxpacket, result, error = self.txRxFrame(port, self.getEncoder(port).read(scs_id, address, length))
         if result == COMM_SUCCESS:
             error = rxpacket[PKT_ERROR]
 
@@ -340,31 +420,22 @@ class protocol_packet_handler(object):
                                   SCS_MAKEWORD(data[2], data[3])) if (result == COMM_SUCCESS) else 0
         return data_read, result, error
 
-    def writeTxOnly(self, port, scs_id, address, length, data):
-        txpacket = [0] * (length + 7)
-
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = length + 3
-        txpacket[PKT_INSTRUCTION] = INST_WRITE
-        txpacket[PKT_PARAMETER0] = address
-
-        txpacket[PKT_PARAMETER0 + 1: PKT_PARAMETER0 + 1 + length] = data[0: length]
+    def readRegisterTxRx(self, port, scs_id, register):
+        # register is a control_table.Register, the value is decoded with its sign bit
+        data, result, error = self.readTxRx(port, scs_id, register.address, register.length)
+        data_read = register.decode(data) if (result == COMM_SUCCESS) else 0
+        return data_read, result, error
 
-        result = self.txPacket(port, txpacket)
-        port.is_using = False
+    def writeTxOnly(self, port, scs_id, address, length, data):
+        with arbitrate(port):
+            result = self.txFrame(port, self.getEncoder(port).write(scs_id, INST_WRITE, address, length, data))
+            port.is_using = False
 
         return result
 
     def writeTxRx(self, port, scs_id, address, length, data):
-        txpacket = [0] * (length + 7)
-
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = length + 3
-        txpacket[PKT_INSTRUCTION] = INST_WRITE
-        txpacket[PKT_PARAMETER0] = address
-
-        txpacket[PKT_PARAMETER0 + 1: PKT_PARAMETER0 + 1 + length] = data[0: length]
-        rxpacket, result, error = self.txRxPacket(port, txpacket)
+        frame = self.getEncoder(port).write(scs_id, INST_WRITE, address, length, data)
+        rxpacket, result, error = self.txRxFrame(port, frame)
 
         return result, error
 
@@ -398,66 +469,72 @@ class protocol_packet_handler(object):
                       SCS_HIBYTE(SCS_HIWORD(data))]
         return self.writeTxRx(port, scs_id, address, 4, data_write)
 
-    def regWriteTxOnly(self, port, scs_id, address, length, data):
-        txpacket = [0] * (length + 7)
-
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = length + 3
-        txpacket[PKT_INSTRUCTION] = INST_REG_WRITE
-        txpacket[PKT_PARAMETER0] = address
+    def writeRegisterTxRx(self, port, scs_id, register, data):
+        return self.writeTxRx(port, scs_id, register.address, register.length, register.encode(data))
 
-        txpacket[PKT_PARAMETER0 + 1: PKT_PARAMETER0 + 1 + length] = data[0: length]
-
-        result = self.txPacket(port, txpacket)
-        port.is_using = False
+    def regWriteTxOnly(self, port, scs_id, address, length, data):
+        with arbitrate(port):
+            result = self.txFrame(port, self.getEncoder(port).write(scs_id, INST_REG_WRITE, address, length, data))
+            port.is_using = False
 
         return result
 
     def regWriteTxRx(self, port, scs_id, address, length, data):
-        txpacket = [0] * (length + 7)
-
-        txpacket[PKT_ID] = scs_id
-        txpacket[PKT_LENGTH] = length + 3
-        txpacket[PKT_INSTRUCTION] = INST_REG_WRITE
-        txpacket[PKT_PARAMETER0] = address
-
-        txpacket[PKT_PARAMETER0 + 1: PKT_PARAMETER0 + 1 + length] = data[0: length]
-
-        _, result, error = self.txRxPacket(port, txpacket)
+        frame = self.getEncoder(port).write(scs_id, INST_REG_WRITE, address, length, data)
+        _, result, error = self.txRxFrame(port, frame)
 
         return result, error
 
     def syncReadTx(self, port, start_address, data_length, param, param_length):
-        txpacket = [0] * (param_length + 8)
-        # 8: HEADER0 HEADER1 ID LEN INST START_ADDR DATA_LEN CHKSUM
-
-        txpacket[PKT_ID] = BROADCAST_ID
-        txpacket[PKT_LENGTH] = param_length + 4  # 7: INST START_ADDR DATA_LEN CHKSUM
-        txpacket[PKT_INSTRUCTION] = INST_SYNC_READ
-        txpacket[PKT_PARAMETER0 + 0] = start_address
-        txpacket[PKT_PARAMETER0 + 1] = data_length
-
-        txpacket[PKT_PARAMETER0 + 2: PKT_PARAMETER0 + 2 + param_length] = param[0: param_length]
+        frame = self.getEncoder(port).syncRead(start_address, data_length, param, param_length)
 
-        result = self.txPacket(port, txpacket)
+        result = self.txFrame(port, frame)
         if result == COMM_SUCCESS:
             port.setPacketTimeout((6 + data_length) * param_length)
 
         return result
 
+    def syncReadRx(self, port, data_length, param, param_length, slot_timeout_ms=None):
+        # Returns ({scs_id: (data, result, error, rx_time_ns)}, result) for the ids of the last syncReadTx,
+        # status packets are matched by id in whatever order they arrive.
+        # With slot_timeout_ms the first packet is awaited for the wire time of the request plus one slot,
+        # and every received packet restarts the timeout with that value, so missing servos cost one slot
+        # instead of the whole sync read timeout.
+        # result is COMM_SUCCESS only if every servo answered
+        rx_dict = {}
+        pending = set(param[0:param_length])
+        burst_length = (6 + data_length) * len(pending)
+        result = COMM_RX_TIMEOUT
+        if slot_timeout_ms is not None:
+            port.setPacketTimeoutMillis(port.tx_time_per_byte * port.metrics.tx_length + slot_timeout_ms)
+
+        while pending:
+            rxpacket, result = self.rxPacket(port, burst_length)
+            if result == COMM_SUCCESS:
+                scs_id = rxpacket[PKT_ID]
+                if scs_id in pending:
+                    pending.discard(scs_id)
+                    burst_length -= 6 + data_length
+                    rx_dict[scs_id] = (list(rxpacket[PKT_PARAMETER0: PKT_PARAMETER0 + data_length]),
+                                       result, rxpacket[PKT_ERROR], port.getCurrentTimeNs())
+                    if slot_timeout_ms is not None:
+                        port.setPacketTimeoutMillis(slot_timeout_ms)
+            elif result != COMM_RX_CORRUPT or port.isPacketTimeout():
+                break
 
-    def syncWriteTxOnly(self, port, start_address, data_length, param, param_length):
-        txpacket = [0] * (param_length + 8)
-        # 8: HEADER0 HEADER1 ID LEN INST START_ADDR DATA_LEN ... CHKSUM
+        port.is_using = False
 
-        txpacket[PKT_ID] = BROADCAST_ID
-        txpacket[PKT_LENGTH] = param_length + 4  # 4: INST START_ADDR DATA_LEN ... CHKSUM
-        txpacket[PKT_INSTRUCTION] = INST_SYNC_WRITE
-        txpacket[PKT_PARAMETER0 + 0] = start_address
-        txpacket[PKT_PARAMETER0 + 1] = data_length
+        for scs_id in pending:
+            rx_dict[scs_id] = ([], result, 0, 0)
 
-        txpacket[PKT_PARAMETER0 + 2: PKT_PARAMETER0 + 2 + param_length] = param[0: param_length]
+        for scs_id, (_, slot_result, error, rx_time) in rx_dict.items():
+            port.metrics.countResult(scs_id, slot_result, error, rx_time)
 
-        _, result, _ = self.txRxPacket(port, txpacket)
+        return rx_dict, (COMM_SUCCESS if not pending else result)
 
-        return result
\ No newline at end of file
+    def syncWriteTxOnly(self, port, start_address, data_length, param, param_length):
+        frame = self.getEncoder(port).syncWrite(start_address, data_length, param, param_length)
+
+        _, result, _ = self.txRxFrame(port, frame)
+
+        return result
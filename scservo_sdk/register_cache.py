@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import time
+
+from .scservo_def import *
+from .control_table import *
+
+# bytes of control table kept per servo
+SHADOW_TABLE_LEN = 256
+
+# Default freshness per register class, max age in ms. None: valid until invalidated
+DEFAULT_MAX_AGE = {
+    REG_EEPROM: None,  # only changes when written
+    REG_RAM: 100,  # written by the host, but also by other hosts and the protections of the servo
+    REG_STATUS: 0,  # updated by the servo, always read from the bus
+}
+
+
+class ServoShadow(object):
+    def __init__(self, scs_id):
+        self.scs_id = scs_id
+        self.data = bytearray(SHADOW_TABLE_LEN)
+        self.times = [0] * SHADOW_TABLE_LEN  # monotonic ns each byte was last confirmed, 0 invalid
+        self.dirty = {}  # address: Register written to the shadow but not confirmed by the servo
+        self.control_table = None
+
+    def invalidate(self, address=0, length=SHADOW_TABLE_LEN):
+        for idx in range(address, min(address + length, SHADOW_TABLE_LEN)):
+            self.times[idx] = 0
+
+    def store(self, address, data, now):
+        # data read from the servo, bytes of dirty registers keep the value waiting to be written
+        length = len(data)
+        if not self.dirty:
+            self.data[address:address + length] = bytes(data)
+            for idx in range(address, address + length):
+                self.times[idx] = now
+            return
+        pending = set()
+        for register in self.dirty.values():
+            pending.update(range(register.address, register.address + register.length))
+        for idx in range(address, address + length):
+            if idx not in pending:
+                self.data[idx] = data[idx - address]
+                self.times[idx] = now
+
+    def setPending(self, register, data):
+        # value written to the shadow, dirty until the servo confirms it
+        self.data[register.address:register.address + register.length] = bytes(data)
+        self.invalidate(register.address, register.length)
+        self.dirty[register.address] = register
+
+    def age(self, address, length, now):
+        # ns since the oldest byte of the range was confirmed, None if any byte is invalid
+        oldest = min(self.times[address:address + length])
+        if not oldest:
+            return None
+        return now - oldest
+
+
+class RegisterCache(object):
+    """Shadow copy of the control table of every servo on one port.
+
+    read() serves registers from the shadow while they are fresh by the max age
+    of their class. write() is write-through and skipped when the shadow already
+    holds the value. A failed write leaves the register dirty, flush() retries it.
+    Registers are control_table.Register objects or names from the control table
+    of the servo model.
+    """
+
+    def __init__(self, port, ph, control_table=None):
+        self.port = port
+        self.ph = ph
+        self.control_table = control_table  # None: by model number of every servo
+        self.max_age = dict(DEFAULT_MAX_AGE)
+        self.shadows = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.writes_skipped = 0
+
+    def setMaxAge(self, reg_class, msec):
+        self.max_age[reg_class] = msec
+
+    def getShadow(self, scs_id):
+        shadow = self.shadows.get(scs_id)
+        if shadow is None:
+            shadow = self.shadows[scs_id] = ServoShadow(scs_id)
+        return shadow
+
+    def getControlTable(self, scs_id):
+        if self.control_table is not None:
+            return self.control_table
+        shadow = self.getShadow(scs_id)
+        if shadow.control_table is None:
+            model_number, result, _ = self.getModelNumber(scs_id)
+            if result != COMM_SUCCESS:
+                return getControlTable()
+            shadow.control_table = getControlTable(model_number)
+        return shadow.control_table
+
+    def getRegister(self, scs_id, register):
+        if isinstance(register, Register):
+            return register
+        return self.getControlTable(scs_id)[register]
+
+    def getModelNumber(self, scs_id):
+        # model number is at the same address for every family
+        return self.read(scs_id, STS_CONTROL_TABLE['model_number'])
+
+    def isFresh(self, shadow, register, now):
+        if register.address in shadow.dirty:
+            return False
+        age = shadow.age(register.address, register.length, now)
+        if age is None:
+            return False
+        max_age = self.max_age.get(register.reg_class)
+        return max_age is None or age <= max_age * 1000000
+
+    def read(self, scs_id, register):
+        register = self.getRegister(scs_id, register)
+        shadow = self.getShadow(scs_id)
+        if self.isFresh(shadow, register, time.monotonic_ns()):
+            self.hits += 1
+            return register.decode(shadow.data, register.address), COMM_SUCCESS, 0
+
+        self.misses += 1
+        data, result, error = self.ph.readTxRx(self.port, scs_id, register.address, register.length)
+        if result != COMM_SUCCESS:
+            return 0, result, error
+
+        shadow.store(register.address, data, time.monotonic_ns())
+        return register.decode(data), result, error
+
+    def write(self, scs_id, register, value):
+        register = self.getRegister(scs_id, register)
+        shadow = self.getShadow(scs_id)
+        data = register.encode(value)
+        now = time.monotonic_ns()
+        if (self.isFresh(shadow, register, now) and
+                shadow.data[register.address:register.address + register.length] == bytes(data)):
+            self.writes_skipped += 1
+            return COMM_SUCCESS, 0
+
+        # the shadow holds the wanted value until the servo confirms it
+        shadow.setPending(register, data)
+        return self.writeThrough(shadow, register)
+
+    def writeThrough(self, shadow, register):
+        self.writes += 1
+        data = bytes(shadow.data[register.address:register.address + register.length])
+        result, error = self.ph.writeTxRx(self.port, shadow.scs_id, register.address, register.length, data)
+        if result == COMM_SUCCESS:
+            del shadow.dirty[register.address]
+            shadow.store(register.address, data, time.monotonic_ns())
+        return result, error
+
+    def flush(self, scs_id=None):
+        # retry dirty writes, returns the first failure or COMM_SUCCESS
+        final_result = COMM_SUCCESS
+        shadows = self.shadows.values() if scs_id is None else [self.getShadow(scs_id)]
+        for shadow in shadows:
+            for register in list(shadow.dirty.values()):
+                result, _ = self.writeThrough(shadow, register)
+                if result != COMM_SUCCESS and final_result == COMM_SUCCESS:
+                    final_result = result
+        return final_result
+
+    def isDirty(self, scs_id=None):
+        if scs_id is None:
+            return any(shadow.dirty for shadow in self.shadows.values())
+        return bool(self.getShadow(scs_id).dirty)
+
+    def invalidate(self, scs_id=None, register=None):
+        # forget cached values: of one register, of one servo or of every servo. Pending writes
+        # of the servos are flushed first, the ones that still fail stay dirty for the next flush()
+        if register is not None:
+            register = self.getRegister(scs_id, register)
+            self.getShadow(scs_id).invalidate(register.address, register.length)
+            return COMM_SUCCESS
+        result = self.flush(scs_id)
+        for shadow_id in ([scs_id] if scs_id is not None else list(self.shadows)):
+            shadow = self.shadows.get(shadow_id)
+            if shadow is None:
+                continue
+            if shadow.dirty:
+                shadow.invalidate()
+                shadow.control_table = None
+            else:
+                del self.shadows[shadow_id]
+        return result
+
+    def update(self, scs_id, address, data):
+        # store data read elsewhere, e.g. by a GroupSyncRead
+        self.getShadow(scs_id).store(address, data, time.monotonic_ns())
+
+    def updateGroup(self, group_sync_read):
+        for scs_id in group_sync_read.data_dict:
+            if group_sync_read.getResult(scs_id) == COMM_SUCCESS:
+                self.update(scs_id, group_sync_read.start_address, group_sync_read.data_dict[scs_id])
+
+    def getStats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'writes_skipped': self.writes_skipped,
+        }
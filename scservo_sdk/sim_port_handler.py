@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+import math
+import os
+import random
+import threading
+import time
+
+from .scservo_def import *
+from .port_handler import *
+from .packet_codec import *
+from .control_table import *
+
+# bits on the wire per byte: start, 8 data, stop
+SIM_BITS_PER_BYTE = 10
+
+
+class SimServo(object):
+    """Control table and first order motion of one simulated servo.
+
+    present_position follows goal_position with time constant tau (s), limited
+    to max_speed (steps/s) or to goal_speed when it is set.
+    """
+
+    def __init__(self, scs_id, model_number=0, control_table=STS_CONTROL_TABLE, position=2048,
+                 tau=0.05, max_speed=3000.0):
+        self.control_table = control_table
+        self.memory = bytearray(256)
+        self.tau = tau
+        self.max_speed = max_speed
+        self.reg_write = None  # (address, data) waiting for ACTION
+        self.position = float(position)
+        self.last_step = None
+
+        self.set('model_number', model_number)
+        self.set('id', scs_id)
+        self.set('max_angle_limit', 4095)
+        self.set('max_torque', 1000)
+        self.set('max_temperature_limit', 70)
+        self.set('max_input_voltage', 140)
+        self.set('min_input_voltage', 40)
+        self.set('torque_enable', 1)
+        self.set('goal_position', position)
+        self.set('present_position', position)
+        self.set('present_voltage', 120)
+        self.set('present_temperature', 30)
+
+    def getId(self):
+        return self.memory[self.control_table['id'].address]
+
+    def get(self, name):
+        register = self.control_table[name]
+        return register.decode(self.memory, register.address)
+
+    def set(self, name, value):
+        register = self.control_table[name]
+        self.memory[register.address:register.address + register.length] = bytes(register.encode(value))
+
+    def read(self, address, length, now):
+        self.step(now)
+        return bytes(self.memory[address:address + length])
+
+    def write(self, address, data, now):
+        self.step(now)
+        self.memory[address:address + len(data)] = bytes(data)
+
+    def step(self, now):
+        # advance the motion model to now (monotonic ns)
+        if self.last_step is None:
+            self.last_step = now
+            return
+        dt = (now - self.last_step) / 1000000000.0
+        if dt <= 0:
+            return
+        self.last_step = now
+
+        goal = self.get('goal_position') if self.get('torque_enable') else self.position
+        speed_limit = self.max_speed
+        if 'goal_speed' in self.control_table and self.get('goal_speed'):
+            speed_limit = min(speed_limit, abs(self.get('goal_speed')))
+
+        step = (goal - self.position) * (1.0 - math.exp(-dt / self.tau))
+        limit = speed_limit * dt
+        step = max(-limit, min(limit, step))
+        self.position += step
+
+        self.set('present_position', int(round(self.position)))
+        self.set('present_speed', int(round(step / dt)))
+        self.set('moving', 1 if abs(goal - self.position) >= 1.0 else 0)
+
+
+class SimBus(object):
+    """Instruction side of a simulated half duplex servo bus.
+
+    feed() takes the bytes written by the host and returns the status packets
+    as (arrival_ns, bytes) with baud accurate wire time. drop_rate is the chance
+    that a servo does not answer, noise_rate the chance that one byte of an
+    answer is corrupted.
+    """
+
+    def __init__(self, servos=(), baudrate=DEFAULT_BAUDRATE, response_delay_us=20, latency_us=0,
+                 drop_rate=0.0, noise_rate=0.0, seed=None):
+        self.servos = {}
+        for servo in servos:
+            self.addServo(servo)
+        self.baudrate = baudrate
+        self.response_delay = int(response_delay_us * 1000)
+        self.latency = int(latency_us * 1000)
+        self.drop_rate = drop_rate
+        self.noise_rate = noise_rate
+        self.random = random.Random(seed)
+        self.buffer = bytearray()
+        self.bus_free = 0  # ns when the last status packet leaves the wire
+
+        self.instructions = 0
+        self.replies = 0
+        self.dropped = 0
+        self.corrupted = 0
+
+    def addServo(self, servo):
+        self.servos[servo.getId()] = servo
+
+    def byteTime(self, length):
+        return length * SIM_BITS_PER_BYTE * 1000000000 // self.baudrate
+
+    def feed(self, data, now):
+        # (arrival_ns, bytes) of every status packet caused by data
+        replies = []
+        self.buffer.extend(data)
+        tx_done = now + self.byteTime(len(data))
+        while True:
+            idx = self.buffer.find(b'\xff\xff')
+            if idx < 0:
+                del self.buffer[:max(len(self.buffer) - 1, 0)]
+                break
+            del self.buffer[:idx]
+            if len(self.buffer) < 4:
+                break
+            total_length = self.buffer[PKT_LENGTH] + 4
+            if len(self.buffer) < total_length:
+                break
+            packet = bytes(self.buffer[:total_length])
+            del self.buffer[:total_length]
+            if packet[-1] != ~sum(packet[PKT_ID:-1]) & 0xFF:
+                continue
+            self.instructions += 1
+            replies.extend(self.execute(packet, tx_done))
+        return replies
+
+    def statusPacket(self, scs_id, params=b''):
+        packet = bytearray(6 + len(params))
+        packet[PKT_HEADER0] = 0xFF
+        packet[PKT_HEADER1] = 0xFF
+        packet[PKT_ID] = scs_id
+        packet[PKT_LENGTH] = len(params) + 2
+        packet[PKT_ERROR] = 0
+        packet[PKT_PARAMETER0:PKT_PARAMETER0 + len(params)] = params
+        packet[-1] = ~sum(packet[PKT_ID:-1]) & 0xFF
+        return packet
+
+    def reply(self, replies, packet, start):
+        # queue one status packet on the wire after start, returns when the wire is free again
+        start = max(start, self.bus_free) + self.response_delay
+        end = start + self.byteTime(len(packet))
+        self.bus_free = end
+        if self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return end
+        if self.random.random() < self.noise_rate:
+            self.corrupted += 1
+            packet[self.random.randrange(len(packet))] ^= 1 << self.random.randrange(8)
+        self.replies += 1
+        replies.append((end + self.latency, bytes(packet)))
+        return end
+
+    def targets(self, scs_id):
+        if scs_id == BROADCAST_ID:
+            return list(self.servos.values())
+        servo = self.servos.get(scs_id)
+        return [servo] if servo is not None else []
+
+    def execute(self, packet, now):
+        replies = []
+        scs_id = packet[PKT_ID]
+        instruction = packet[PKT_INSTRUCTION]
+        params = packet[PKT_PARAMETER0:-1]
+
+        if instruction == INST_PING:
+            for servo in self.targets(scs_id):
+                now = self.reply(replies, self.statusPacket(servo.getId()), now)
+
+        elif instruction == INST_READ and scs_id != BROADCAST_ID:
+            for servo in self.targets(scs_id):
+                self.reply(replies, self.statusPacket(scs_id, servo.read(params[0], params[1], now)), now)
+
+        elif instruction in (INST_WRITE, INST_REG_WRITE):
+            for servo in self.targets(scs_id):
+                if instruction == INST_WRITE:
+                    servo.write(params[0], params[1:], now)
+                else:
+                    servo.reg_write = (params[0], params[1:])
+                if scs_id != BROADCAST_ID:
+                    self.reply(replies, self.statusPacket(scs_id), now)
+            self.remap()
+
+        elif instruction == INST_ACTION:
+            for servo in self.targets(scs_id):
+                if servo.reg_write is not None:
+                    servo.write(servo.reg_write[0], servo.reg_write[1], now)
+                    servo.reg_write = None
+                if scs_id != BROADCAST_ID:
+                    self.reply(replies, self.statusPacket(scs_id), now)
+            self.remap()
+
+        elif instruction == INST_SYNC_READ:
+            address, length = params[0], params[1]
+            for target in params[2:]:
+                servo = self.servos.get(target)
+                if servo is not None:
+                    now = self.reply(replies, self.statusPacket(target, servo.read(address, length, now)), now)
+
+        elif instruction == INST_SYNC_WRITE:
+            address, length = params[0], params[1]
+            for idx in range(2, len(params) - length, length + 1):
+                servo = self.servos.get(params[idx])
+                if servo is not None:
+                    servo.write(address, params[idx + 1:idx + 1 + length], now)
+            self.remap()
+
+        return replies
+
+    def remap(self):
+        # a write to the id register moves the servo to its new id
+        self.servos = dict((servo.getId(), servo) for servo in self.servos.values())
+
+
+class SimPortHandler(PortHandler):
+    """In-memory PortHandler talking to a SimBus, no serial device needed."""
+
+    def __init__(self, bus, port_name='sim'):
+        super(SimPortHandler, self).__init__(port_name)
+        self.bus = bus
+        self.rx_queue = []  # (arrival_ns, bytes) sorted by arrival
+        self.rx_pending = b''  # arrived bytes not read yet
+
+    def closePort(self):
+        self.is_open = False
+
+    def clearPort(self):
+        # replies that arrived and were not read are dropped, the ones still on the wire are not
+        self.collect(self.getCurrentTimeNs())
+        self.rx_pending = b''
+
+    def setupPort(self, cflag_baud):
+        self.is_open = True
+        self.bus.baudrate = self.baudrate
+        self.rx_queue = []
+        self.rx_pending = b''
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        return True
+
+    def collect(self, now):
+        arrived = 0
+        while arrived < len(self.rx_queue) and self.rx_queue[arrived][0] <= now:
+            arrived += 1
+        if arrived:
+            self.rx_pending += b''.join(data for _, data in self.rx_queue[:arrived])
+            del self.rx_queue[:arrived]
+
+    def getBytesAvailable(self):
+        self.collect(self.getCurrentTimeNs())
+        return len(self.rx_pending)
+
+    def readPort(self, length):
+        self.collect(self.getCurrentTimeNs())
+        data = self.rx_pending[:length]
+        self.rx_pending = self.rx_pending[length:]
+        return data
+
+    def writePort(self, packet):
+        packet = bytes(packet)
+        self.rx_queue.extend(self.bus.feed(packet, self.getCurrentTimeNs()))
+        self.rx_queue.sort(key=lambda reply: reply[0])
+        return len(packet)
+
+    def waitPort(self):
+        # sleep until the next status packet arrives or the packet deadline
+        now = self.getCurrentTimeNs()
+        if self.rx_pending:
+            return True
+        wake = self.packet_deadline
+        if self.rx_queue:
+            wake = min(wake, self.rx_queue[0][0])
+        if wake > now:
+            time.sleep((wake - now) / 1000000000.0)
+        self.collect(self.getCurrentTimeNs())
+        return bool(self.rx_pending)
+
+
+class PtySimBus(object):
+    """SimBus served on a pseudo terminal, open getPortName() with any PortHandler."""
+
+    def __init__(self, bus):
+        import pty
+        import tty
+
+        self.bus = bus
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+        self.running = False
+        self.thread = None
+
+    def getPortName(self):
+        return self.port_name
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def serve(self):
+        import select
+
+        queue = []
+        while self.running:
+            timeout = 0.05
+            if queue:
+                timeout = max(0.0, (queue[0][0] - time.monotonic_ns()) / 1000000000.0)
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                data = os.read(self.master, 1024)
+                queue.extend(self.bus.feed(data, time.monotonic_ns()))
+                queue.sort(key=lambda reply: reply[0])
+            now = time.monotonic_ns()
+            while queue and queue[0][0] <= now:
+                os.write(self.master, queue.pop(0)[1])
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import collections
+import threading
+import time
+import warnings
+
+from .scservo_def import *
+from .control_table import *
+from .group_sync_read import GroupSyncRead
+from .bus_arbiter import BUS_PRIORITY_TELEMETRY
+from .array_codec import requireNumpy, np
+
+# samples kept per register
+TELEMETRY_HISTORY = 1000
+
+# time in ms every bus transaction costs on top of its wire time, until measured
+TELEMETRY_OVERHEAD_MS = 1.0
+
+# weight of a new measurement in the cost estimate of a group
+TELEMETRY_COST_ALPHA = 0.2
+
+# samples a subscription keeps before dropping the oldest
+TELEMETRY_SUBSCRIPTION_DEPTH = 100
+
+# (name, registers, period in ms) polled by addDefaultGroups
+TELEMETRY_DEFAULT_GROUPS = (
+    ('motion', ('present_position', 'present_speed'), 10.0),
+    ('load', ('present_load',), 50.0),
+    ('health', ('present_voltage', 'present_temperature'), 1000.0),
+)
+
+
+class TelemetryRing(object):
+    """Preallocated history of one register for every polled servo.
+
+    Only the polling thread writes. A reader takes the index first and the
+    rows before it, which are complete, so reads need no lock. history()
+    drops the rows the writer wrapped over during the copy. Missing
+    servos are stored as NaN.
+    """
+
+    def __init__(self, capacity, count):
+        self.capacity = capacity
+        self.values = np.full((capacity, count), np.nan)
+        self.times = np.zeros(capacity, dtype=np.int64)  # monotonic ns of each sample
+        self.count = 0  # samples written so far
+
+    def append(self, values, now):
+        row = self.count % self.capacity
+        self.values[row] = values
+        self.times[row] = now
+        self.count += 1
+
+    def latest(self):
+        # (values, time_ns) of the newest sample, (None, 0) before the first one
+        count = self.count
+        if not count:
+            return None, 0
+        row = (count - 1) % self.capacity
+        return self.values[row].copy(), int(self.times[row])
+
+    def history(self, samples=None):
+        # (values, times) of the last samples, oldest first
+        count = self.count
+        samples = min(count, self.capacity) if samples is None else min(samples, count, self.capacity)
+        rows = np.arange(count - samples, count) % self.capacity
+        values, times = self.values[rows], self.times[rows]
+        # samples appended during the copy wrapped over the oldest rows
+        overwritten = self.count - count - (self.capacity - samples)
+        if overwritten > 0:
+            values, times = values[overwritten:], times[overwritten:]
+        return values, times
+
+
+class TelemetryGroup(object):
+    # registers read together with one GroupSyncRead every period
+    def __init__(self, name, registers, period_ms, group_sync_read):
+        self.name = name
+        self.registers = registers
+        self.period = int(period_ms * 1000000)
+        self.group_sync_read = group_sync_read
+        self.deadline = 0  # monotonic ns the group is due
+        self.cost = 0  # estimated ns of one read
+        self.polls = 0
+        self.deferred = 0
+        self.failures = 0
+
+
+class TelemetrySubscription(object):
+    # samples of one register pushed by the poller, the oldest are dropped when nobody reads
+    def __init__(self, name, depth=TELEMETRY_SUBSCRIPTION_DEPTH):
+        self.name = name
+        self.samples = collections.deque(maxlen=depth)
+        self.event = threading.Event()
+
+    def push(self, values, now):
+        self.samples.append((values, now))
+        self.event.set()
+
+    def get(self, timeout=None):
+        # (values, time_ns) of the oldest unread sample, None on timeout
+        while True:
+            try:
+                return self.samples.popleft()
+            except IndexError:
+                self.event.clear()
+                if self.samples:
+                    continue
+                if not self.event.wait(timeout):
+                    return None
+
+
+class TelemetryPoller(object):
+    """Background reads of register groups at their own rates on one port.
+
+    Every cycle polls the groups that are due, most overdue first, while the
+    estimated bus time stays inside budget_ms. Groups that do not fit are
+    deferred to the next cycle, so a slow group never stretches a cycle. The
+    most overdue group is always polled, even a group over the whole budget.
+    Values go into a TelemetryRing per register, latest() and history() read
+    them and subscribe() gets every new sample, none of them block the
+    polling thread.
+    """
+
+    def __init__(self, port, ph, scs_ids, control_table=None, cycle_ms=10.0, budget_ms=None,
+                 history=TELEMETRY_HISTORY):
+        requireNumpy()
+        self.port = port
+        self.ph = ph
+        self.scs_ids = list(scs_ids)
+        self.control_table = control_table if control_table is not None else getControlTable()
+        self.cycle = int(cycle_ms * 1000000)
+        self.budget = int((budget_ms if budget_ms is not None else cycle_ms * 0.8) * 1000000)
+        self.history = history
+        self.groups = []
+        self.rings = {}
+        self.subscriptions = {}
+        self.running = False
+        self.thread = None
+        self.cycles = 0
+        self.overruns = 0
+
+    def addGroup(self, name, registers, period_ms):
+        registers = [self.control_table.get(register) for register in registers]
+        start_address, data_length = self.control_table.span(registers)
+        group_sync_read = GroupSyncRead(self.port, self.ph, start_address, data_length)
+        for scs_id in self.scs_ids:
+            group_sync_read.addParam(scs_id)
+
+        group = TelemetryGroup(name, registers, period_ms, group_sync_read)
+        group.cost = int((self.port.tx_time_per_byte * (8 + len(self.scs_ids) + (6 + data_length) * len(self.scs_ids)) +
+                          TELEMETRY_OVERHEAD_MS) * 1000000)
+        if group.cost > self.budget:
+            warnings.warn("telemetry group %s takes about %.1f ms, over the %.1f ms budget, "
+                          "the cycles it is polled in overrun" % (name, group.cost / 1000000.0, self.budget / 1000000.0))
+        self.groups.append(group)
+        for register in registers:
+            self.rings[register.name] = TelemetryRing(self.history, len(self.scs_ids))
+            self.subscriptions.setdefault(register.name, [])
+        return group
+
+    def addDefaultGroups(self):
+        for name, registers, period_ms in TELEMETRY_DEFAULT_GROUPS:
+            self.addGroup(name, registers, period_ms)
+
+    def subscribe(self, register, depth=TELEMETRY_SUBSCRIPTION_DEPTH):
+        name = self.control_table.get(register).name
+        subscription = TelemetrySubscription(name, depth)
+        self.subscriptions.setdefault(name, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get(subscription.name, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+
+    def latest(self, register, scs_id=None):
+        # (values of every servo, time_ns) or (value of scs_id, time_ns)
+        values, now = self.rings[self.control_table.get(register).name].latest()
+        if values is None or scs_id is None:
+            return values, now
+        return values[self.scs_ids.index(scs_id)], now
+
+    def getHistory(self, register, samples=None):
+        return self.rings[self.control_table.get(register).name].history(samples)
+
+    def poll(self, group, now):
+        start = time.monotonic_ns()
+        result = group.group_sync_read.txRxPacket()
+        done = time.monotonic_ns()
+        group.cost += int(TELEMETRY_COST_ALPHA * ((done - start) - group.cost))
+        group.polls += 1
+        if result != COMM_SUCCESS:
+            group.failures += 1
+
+        fresh = np.fromiter((group.group_sync_read.getResult(scs_id) == COMM_SUCCESS for scs_id in self.scs_ids),
+                            dtype=bool, count=len(self.scs_ids))
+        for register in group.registers:
+            values = group.group_sync_read.getRegisterArray(register, self.scs_ids).astype(np.float64)
+            values[~fresh] = np.nan
+            self.rings[register.name].append(values, done)
+            for subscription in self.subscriptions[register.name]:
+                subscription.push(values, done)
+        return done - start
+
+    def runOnce(self, now):
+        # polls the due groups that fit in the budget, returns the bus time used
+        due = sorted((group for group in self.groups if group.deadline <= now), key=lambda group: group.deadline)
+        used = 0
+        for group in due:
+            # a group that does not fit waits for a cycle it comes first in, so it is never starved
+            if used and used + group.cost > self.budget:
+                group.deferred += 1
+                continue
+            used += self.poll(group, now)
+            # stay on the period grid, a group that fell far behind is not polled back to back
+            group.deadline = max(group.deadline + group.period, now)
+        return used
+
+    def run(self):
+        arbiter = getattr(self.port, 'arbiter', None)
+        if arbiter is not None:
+            arbiter.setThreadPriority(BUS_PRIORITY_TELEMETRY)
+        deadline = time.monotonic_ns()
+        for group in self.groups:
+            group.deadline = deadline
+        while self.running:
+            now = time.monotonic_ns()
+            if now < deadline:
+                time.sleep((deadline - now) / 1000000000.0)
+                now = time.monotonic_ns()
+            self.runOnce(now)
+            self.cycles += 1
+            deadline += self.cycle
+            if time.monotonic_ns() > deadline:
+                self.overruns += 1
+                deadline = time.monotonic_ns()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def getStats(self):
+        return {
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'groups': dict((group.name, {
+                'polls': group.polls,
+                'deferred': group.deferred,
+                'failures': group.failures,
+                'cost_us': group.cost / 1000.0,
+            }) for group in self.groups),
+        }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import collections
+import json
+import math
+import os
+import time
+
+from .scservo_def import *
+from .topology import getPortKey
+
+TIMEOUT_CALIBRATION_PATH = os.path.expanduser('~/.scservo_timeouts.json')
+
+# percentile of the measured turnaround times a timeout covers, plus the margin in ms
+TIMEOUT_PERCENTILE = 99.9
+TIMEOUT_MARGIN_MS = 0.5
+
+# turnaround samples kept per servo, the timeouts follow the latest ones
+TIMEOUT_WINDOW = 500
+# samples needed before the first calibrated timeout of a servo
+TIMEOUT_MIN_SAMPLES = 20
+# a calibrated timeout is recomputed after this many new samples
+TIMEOUT_UPDATE_SAMPLES = 25
+
+# every timeout of a calibrated servo doubles its timeout up to this factor, until the next update
+TIMEOUT_WIDEN_MAX = 4.0
+
+# pings per servo sent by calibrate()
+TIMEOUT_CALIBRATION_SAMPLES = 50
+
+
+class ServoTimeout(object):
+    # turnaround samples of one servo, or of the whole port, and the calibrated turnaround in ms
+    def __init__(self, window=TIMEOUT_WINDOW):
+        self.samples = collections.deque(maxlen=window)
+        self.pending = 0  # samples since the last update
+        self.turnaround = None
+        self.widen = 1.0
+        self.timeouts = 0
+
+    def add(self, turnaround_ms, percentile, margin_ms):
+        self.samples.append(turnaround_ms)
+        self.pending += 1
+        if self.pending >= TIMEOUT_UPDATE_SAMPLES or \
+                (self.turnaround is None and len(self.samples) >= TIMEOUT_MIN_SAMPLES):
+            self.update(percentile, margin_ms)
+
+    def update(self, percentile, margin_ms):
+        if not self.samples:
+            return
+        ordered = sorted(self.samples)
+        rank = min(len(ordered), max(1, int(math.ceil(len(ordered) * percentile / 100.0))))
+        self.turnaround = ordered[rank - 1] + margin_ms
+        self.widen = 1.0
+        self.pending = 0
+
+    def getTurnaround(self):
+        if self.turnaround is None:
+            return None
+        return self.turnaround * self.widen
+
+
+class TimeoutCalibration(object):
+    """Packet timeouts of one port from measured round trips.
+
+    The turnaround of a transaction is its round trip, from the end of the
+    instruction write to the status packet, minus the wire time of both
+    packets. Its percentile over a window of recent samples plus a margin,
+    per servo and for the whole port, replaces the fixed latency timer
+    allowance of PortHandler.setPacketTimeout once enough samples are in.
+    Ids without samples of their own, such as the missing ones of a scan,
+    get the timeout of the port.
+
+    The packet handlers record every transaction of a port with a
+    calibration (see PortHandler.setCalibration), so the timeouts keep
+    following the bus. save() and load() keep them between runs, keyed by
+    the adapter like BusTopology when port_info, the ListPortInfo of the
+    port, is given.
+    """
+
+    def __init__(self, port, percentile=TIMEOUT_PERCENTILE, margin_ms=TIMEOUT_MARGIN_MS, window=TIMEOUT_WINDOW,
+                 port_info=None):
+        self.port = port
+        self.port_info = port_info
+        self.percentile = percentile
+        self.margin = margin_ms
+        self.window = window
+        self.bus = ServoTimeout(window)
+        self.servos = {}
+
+    def getServo(self, scs_id):
+        servo = self.servos.get(scs_id)
+        if servo is None:
+            servo = self.servos[scs_id] = ServoTimeout(self.window)
+        return servo
+
+    def getTimeout(self, scs_id, rx_length):
+        # timeout in ms for the status packet of rx_length bytes after the last write, None until calibrated
+        servo = self.servos.get(scs_id)
+        turnaround = servo.getTurnaround() if servo is not None else None
+        if turnaround is None:
+            turnaround = self.bus.getTurnaround()
+        if turnaround is None:
+            return None
+        wire_time = self.port.tx_time_per_byte * (self.port.metrics.tx_length + rx_length)
+        return max(turnaround + wire_time, self.margin)
+
+    def record(self, scs_id, result, rx_length):
+        # outcome of the transaction with scs_id that ended just now
+        if result == COMM_SUCCESS:
+            latency = (time.monotonic_ns() - self.port.metrics.tx_time) / 1000000.0
+            turnaround = latency - self.port.tx_time_per_byte * (self.port.metrics.tx_length + rx_length)
+            self.getServo(scs_id).add(turnaround, self.percentile, self.margin)
+            self.bus.add(turnaround, self.percentile, self.margin)
+        elif result == COMM_RX_TIMEOUT:
+            # maybe cut off too early, wait longer for this servo until new samples come in
+            servo = self.servos.get(scs_id)
+            if servo is not None and servo.turnaround is not None:
+                servo.timeouts += 1
+                servo.widen = min(servo.widen * 2.0, TIMEOUT_WIDEN_MAX)
+
+    def update(self):
+        # recompute every timeout from the samples so far
+        for servo in self.servos.values():
+            servo.update(self.percentile, self.margin)
+        self.bus.update(self.percentile, self.margin)
+
+    def calibrate(self, ph, scs_ids, samples=TIMEOUT_CALIBRATION_SAMPLES):
+        # pings every servo samples times with the default timeout, returns {scs_id: timeout in ms}
+        calibration = self.port.calibration
+        self.port.setCalibration(None)
+        try:
+            for scs_id in scs_ids:
+                for _ in range(samples):
+                    _, result, _ = ph.ping(self.port, scs_id, read_model=False)
+                    self.record(scs_id, result, 6)
+        finally:
+            self.port.setCalibration(calibration)
+        self.update()
+        return dict((scs_id, self.getTimeout(scs_id, 6)) for scs_id in scs_ids)
+
+    def getKey(self):
+        # the adapter, not its device path, which changes when adapters are plugged in another order
+        port_key = getPortKey(self.port_info if self.port_info is not None else self.port.getPortName())
+        return '%s@%d' % (port_key, self.port.getBaudRate())
+
+    def save(self, path=TIMEOUT_CALIBRATION_PATH):
+        # stores the calibrated turnarounds of this port and baudrate, keeping the other entries of the file
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        entries[self.getKey()] = {
+            'turnaround_ms': self.bus.turnaround,
+            'servos': dict((str(scs_id), servo.turnaround) for scs_id, servo in sorted(self.servos.items())
+                           if servo.turnaround is not None),
+        }
+        # written next to the file and renamed, tools saving at the same time never share a temp file
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def load(self, path=TIMEOUT_CALIBRATION_PATH):
+        # calibrated turnarounds saved for this port and baudrate, False if there are none
+        try:
+            with open(path) as f:
+                entry = json.load(f).get(self.getKey())
+        except (OSError, ValueError):
+            return False
+        if not entry:
+            return False
+        self.bus.turnaround = entry.get('turnaround_ms')
+        for scs_id, turnaround in entry.get('servos', {}).items():
+            self.getServo(int(scs_id)).turnaround = turnaround
+        return True
+
+    def getStats(self):
+        return {
+            'port': self.port.getPortName(),
+            'turnaround_ms': self.bus.turnaround,
+            'samples': len(self.bus.samples),
+            'servos': dict((scs_id, {
+                'turnaround_ms': servo.turnaround,
+                'samples': len(servo.samples),
+                'timeouts': servo.timeouts,
+                'widen': servo.widen,
+            }) for scs_id, servo in self.servos.items()),
+        }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import json
+import os
+import time
+
+TOPOLOGY_PATH = os.path.expanduser('~/.scservo_topology.json')
+
+
+def getPortKey(port_info):
+    # stable name of a USB serial adapter: its serial number, else the USB location it is plugged in, else the device
+    serial_number = getattr(port_info, 'serial_number', None)
+    if serial_number:
+        return 'sn:' + serial_number
+    location = getattr(port_info, 'location', None)
+    if location:
+        return 'usb:' + location
+    return getattr(port_info, 'device', port_info)
+
+
+def getPortDevice(port_info):
+    return getattr(port_info, 'device', port_info)
+
+
+class BusTopology(object):
+    """Cache of the servos found on every adapter, stored on disk.
+
+    Maps the key of a USB serial adapter (see getPortKey) to the baudrates
+    its servos answered at and the model number of every servo id. Ports are
+    given as the ListPortInfo objects of serial.tools.list_ports, or plain
+    device paths, so an adapter is found again when its device path changes.
+    A cached servo may be gone, check it with a ping before use.
+    """
+
+    def __init__(self, path=TOPOLOGY_PATH):
+        self.path = path
+        self.ports = {}  # key: {'device': path, 'updated': time, 'bauds': {baud: {scs_id: model}}}
+        self.changed = False
+
+    def load(self):
+        # False if there is no readable cache
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.ports = {}
+        for key, entry in entries.items():
+            bauds = dict((int(baud), dict((int(scs_id), model) for scs_id, model in servos.items()))
+                         for baud, servos in entry.get('bauds', {}).items())
+            self.ports[key] = {'device': entry.get('device'), 'updated': entry.get('updated', 0), 'bauds': bauds}
+        self.changed = False
+        return True
+
+    def save(self):
+        entries = dict((key, {
+            'device': entry['device'],
+            'updated': entry['updated'],
+            'bauds': dict((str(baud), dict((str(scs_id), model) for scs_id, model in sorted(servos.items())))
+                          for baud, servos in entry['bauds'].items() if servos),
+        }) for key, entry in self.ports.items())
+        # written next to the cache and renamed, tools running at the same time never read half a file
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def getPort(self, port_info):
+        key = getPortKey(port_info)
+        entry = self.ports.get(key)
+        if entry is None:
+            entry = self.ports[key] = {'device': None, 'updated': 0, 'bauds': {}}
+        entry['device'] = getPortDevice(port_info)
+        return entry
+
+    def setServos(self, port_info, baud, servos, scs_ids=None):
+        # servos [(scs_id, model)] found at baud, replacing the cached ones of the scanned scs_ids
+        entry = self.getPort(port_info)
+        cached = entry['bauds'].setdefault(baud, {})
+        if scs_ids is not None:
+            for scs_id in scs_ids:
+                cached.pop(scs_id, None)
+        for scs_id, model in servos:
+            cached[scs_id] = model
+        entry['updated'] = time.time()
+        self.changed = True
+
+    def addServo(self, port_info, baud, scs_id, model):
+        self.setServos(port_info, baud, [(scs_id, model)])
+
+    def removeServo(self, port_info, baud, scs_id):
+        entry = self.ports.get(getPortKey(port_info))
+        if entry is not None and entry['bauds'].get(baud, {}).pop(scs_id, None) is not None:
+            self.changed = True
+
+    def findServo(self, scs_id, port_infos):
+        # [(port_info, baud, model)] of the present ports the servo was last seen on, latest first
+        found = []
+        for port_info in port_infos:
+            entry = self.ports.get(getPortKey(port_info))
+            if entry is None:
+                continue
+            for baud, servos in entry['bauds'].items():
+                if scs_id in servos:
+                    found.append((entry['updated'], port_info, baud, servos[scs_id]))
+        found.sort(key=lambda item: -item[0])
+        return [(port_info, baud, model) for _, port_info, baud, model in found]
+
+    def getServos(self, port_info):
+        # {baud: {scs_id: model}} cached for the port
+        entry = self.ports.get(getPortKey(port_info))
+        return entry['bauds'] if entry is not None else {}
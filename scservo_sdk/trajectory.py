@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import threading
+
+from .scservo_def import *
+from .control_table import *
+from .control_loop import ControlLoop
+from .bus_arbiter import BUS_PRIORITY_MOTION
+from .group_sync_write import GroupSyncWrite
+from .array_codec import encodeArray, requireNumpy, np
+
+# Interpolation between keyframes
+TRAJECTORY_LINEAR = 0
+TRAJECTORY_CUBIC = 1  # Catmull-Rom, passes through every keyframe
+
+# frames interpolated at once into the lookahead buffer
+TRAJECTORY_LOOKAHEAD = 50
+
+
+def interpolate(key_times, key_values, times, mode=TRAJECTORY_LINEAR):
+    # key_values (k, n) at increasing key_times (k,) -> values (len(times), n), held constant outside the keys
+    key_times = np.asarray(key_times, dtype=np.float64)
+    key_values = np.asarray(key_values, dtype=np.float64).reshape(len(key_times), -1)
+    times = np.clip(np.asarray(times, dtype=np.float64), key_times[0], key_times[-1])
+    if len(key_times) == 1:
+        return np.repeat(key_values, len(times), axis=0)
+
+    idx = np.clip(np.searchsorted(key_times, times, side='right') - 1, 0, len(key_times) - 2)
+    t0 = key_times[idx]
+    dt = key_times[idx + 1] - t0
+    u = ((times - t0) / dt)[:, None]
+    p0 = key_values[idx]
+    p1 = key_values[idx + 1]
+    if mode == TRAJECTORY_LINEAR:
+        return p0 + (p1 - p0) * u
+
+    # Catmull-Rom slopes, one sided at the ends
+    slopes = np.empty_like(key_values)
+    slopes[1:-1] = (key_values[2:] - key_values[:-2]) / (key_times[2:] - key_times[:-2])[:, None]
+    slopes[0] = (key_values[1] - key_values[0]) / (key_times[1] - key_times[0])
+    slopes[-1] = (key_values[-1] - key_values[-2]) / (key_times[-1] - key_times[-2])
+    m0 = slopes[idx] * dt[:, None]
+    m1 = slopes[idx + 1] * dt[:, None]
+    u2 = u * u
+    u3 = u2 * u
+    return ((2 * u3 - 3 * u2 + 1) * p0 + (u3 - 2 * u2 + u) * m0 +
+            (-2 * u3 + 3 * u2) * p1 + (u3 - u2) * m1)
+
+
+class Trajectory(object):
+    """Time stamped keyframes of a set of servos.
+
+    Keyframes come as a block shared by every servo (setBlock) or per servo
+    with their own times (addKeyframes). Times are in seconds from the start
+    of the trajectory.
+    """
+
+    def __init__(self, scs_ids, mode=TRAJECTORY_LINEAR):
+        requireNumpy()
+        self.scs_ids = list(scs_ids)
+        self.mode = mode
+        self.block = None  # (times, positions (k, n))
+        self.keyframes = {}  # scs_id: (times, positions)
+
+    def setBlock(self, times, positions):
+        self.block = (np.asarray(times, dtype=np.float64), np.asarray(positions, dtype=np.float64))
+
+    def addKeyframes(self, scs_id, times, positions):
+        # keyframes of one servo, merged with the ones it already has
+        times = np.asarray(times, dtype=np.float64)
+        positions = np.asarray(positions, dtype=np.float64)
+        if scs_id in self.keyframes:
+            times = np.concatenate((self.keyframes[scs_id][0], times))
+            positions = np.concatenate((self.keyframes[scs_id][1], positions))
+        order = np.argsort(times, kind='stable')
+        self.keyframes[scs_id] = (times[order], positions[order])
+
+    def getDuration(self):
+        ends = [times[-1] for times, _ in self.keyframes.values() if len(times)]
+        if self.block is not None and len(self.block[0]):
+            ends.append(self.block[0][-1])
+        return max(ends) if ends else 0.0
+
+    def sample(self, times):
+        # positions (len(times), n) in scs_ids order, NaN for servos without keyframes
+        values = np.full((len(times), len(self.scs_ids)), np.nan)
+        if self.block is not None:
+            values[:] = interpolate(self.block[0], self.block[1], times, self.mode)
+        for col, scs_id in enumerate(self.scs_ids):
+            if scs_id in self.keyframes:
+                key_times, key_values = self.keyframes[scs_id]
+                values[:, col] = interpolate(key_times, key_values, times, self.mode)[:, 0]
+        return values
+
+
+class TrajectoryStreamer(object):
+    """Plays a Trajectory through one precompiled GroupSyncWrite at a fixed rate.
+
+    Frames are interpolated lookahead at a time and sent by a ControlLoop.
+    With setpoint_period_ms only every setpoint period a goal is sent, the
+    position the trajectory reaches one period later together with the goal
+    speed that gets there on time, and the servo moves between setpoints on
+    its own. acceleration also writes goal_acc where the control table has it.
+    """
+
+    def __init__(self, port, ph, scs_ids, rate=100.0, control_table=None, lookahead=TRAJECTORY_LOOKAHEAD,
+                 setpoint_period_ms=None, acceleration=None):
+        requireNumpy()
+        self.port = port
+        self.ph = ph
+        self.scs_ids = list(scs_ids)
+        self.rate = rate
+        self.control_table = control_table if control_table is not None else getControlTable()
+        self.lookahead = lookahead
+        self.every = 1 if not setpoint_period_ms else max(1, int(round(setpoint_period_ms * rate / 1000.0)))
+        self.acceleration = acceleration if 'goal_acc' in self.control_table else None
+
+        self.registers = [self.control_table['goal_position']]
+        if self.every > 1:
+            self.registers += [self.control_table['goal_time'], self.control_table['goal_speed']]
+        if self.acceleration is not None:
+            self.registers.append(self.control_table['goal_acc'])
+        start_address, data_length = self.control_table.span(self.registers)
+        self.group_sync_write = GroupSyncWrite(port, ph, start_address, data_length)
+        self.data = np.zeros((len(self.scs_ids), data_length), dtype=np.uint8)
+
+        self.loop = ControlLoop(rate, callback=self.step)
+        self.trajectory = None
+        self.thread = None
+        self.clearBuffer()
+        self.frames_sent = 0
+        self.write_errors = 0
+
+    def clearBuffer(self):
+        self.buffer = None  # positions of frames buffer_start .. buffer_start + lookahead
+        self.buffer_start = 0
+        self.last_goal = None
+        self.last_speed = None
+
+    def play(self, trajectory):
+        # starts over with frame 0 at the next cycle
+        self.trajectory = trajectory
+        self.clearBuffer()
+        self.loop.cycles = 0
+        self.frames = int(np.ceil(trajectory.getDuration() * self.rate)) + 1
+
+    def getFrames(self, first, count):
+        # positions of frames first .. first + count, taken from the lookahead buffer
+        if self.buffer is None or first < self.buffer_start or first + count > self.buffer_start + len(self.buffer):
+            self.buffer_start = first
+            times = np.arange(first, first + max(count, self.lookahead)) / self.rate
+            self.buffer = np.rint(self.trajectory.sample(times))
+        offset = first - self.buffer_start
+        return self.buffer[offset:offset + count]
+
+    def encode(self, name, values):
+        register = self.control_table[name]
+        offset = register.address - self.group_sync_write.start_address
+        self.data[:, offset:offset + register.length] = encodeArray(values, register.length, register.sign_bit)
+
+    def step(self, frame):
+        # ControlLoop callback, sends frame number frame
+        if self.trajectory is None:
+            return
+        if frame >= self.frames:
+            self.loop.stop()
+            return
+        if frame % self.every:
+            return
+
+        if self.every == 1:
+            goal = self.getFrames(frame, 1)[0]
+        else:
+            # aim one setpoint period ahead, the servo gets there at the speed it needs
+            ahead = min(frame + self.every, self.frames - 1)
+            goal = self.getFrames(ahead, 1)[0]
+            current = self.last_goal if self.last_goal is not None else self.getFrames(frame, 1)[0]
+            speed = np.nan_to_num(np.abs(goal - current) * self.rate / self.every)
+            # goal_speed 0 is full speed, a servo holding its goal keeps the speed it had to finish the move
+            if self.last_speed is not None:
+                speed = np.where(speed < 1, self.last_speed, speed)
+            speed = np.maximum(speed, 1)
+            self.encode('goal_speed', speed)
+            self.last_speed = speed
+            self.encode('goal_time', np.zeros(len(self.scs_ids)))
+            if self.acceleration is not None:
+                self.encode('goal_acc', np.full(len(self.scs_ids), self.acceleration))
+
+        known = ~np.isnan(goal)
+        goal = np.where(known, goal, self.last_goal if self.last_goal is not None else 0)
+        self.encode('goal_position', goal)
+        self.last_goal = goal
+
+        ids = [scs_id for scs_id, ok in zip(self.scs_ids, known) if ok]
+        if len(ids) != len(self.scs_ids):
+            self.group_sync_write.clearParam()
+            self.group_sync_write.setDataArray(ids, self.data[known])
+        else:
+            self.group_sync_write.setDataArray(self.scs_ids, self.data)
+        if self.group_sync_write.txPacket() != COMM_SUCCESS:
+            self.write_errors += 1
+        self.frames_sent += 1
+
+    def run(self):
+        # blocks until the trajectory is played or stop() is called
+        arbiter = getattr(self.port, 'arbiter', None)
+        if arbiter is not None:
+            arbiter.setThreadPriority(BUS_PRIORITY_MOTION)
+        self.loop.run()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='trajectory', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.loop.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def isPlaying(self):
+        return self.loop.running
+
+    def getStats(self):
+        stats = self.loop.getStats()
+        stats['frames_sent'] = self.frames_sent
+        stats['write_errors'] = self.write_errors
+        return stats
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+#
+# Hardware free tests, the bus is a SimBus behind a SimPortHandler
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scservo_sdk as sdk
+
+
+@pytest.fixture
+def ph():
+    # STS byte order
+    return sdk.PacketHandler(0)
+
+
+@pytest.fixture
+def bus():
+    return sdk.SimBus([sdk.SimServo(scs_id) for scs_id in (1, 2, 3)], seed=1)
+
+
+@pytest.fixture
+def port(bus):
+    port = sdk.SimPortHandler(bus)
+    port.openPort()
+    return port
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+import scservo_sdk as sdk
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.001)
+
+
+def test_reentrant():
+    arbiter = sdk.BusArbiter()
+    arbiter.acquire()
+    arbiter.acquire()
+    arbiter.release()
+    assert arbiter.owner == threading.get_ident()
+    arbiter.release()
+    assert arbiter.owner is None
+
+
+def test_release_by_other_thread():
+    arbiter = sdk.BusArbiter()
+    arbiter.acquire()
+    errors = []
+
+    def release():
+        try:
+            arbiter.release()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    thread.join()
+    assert errors
+    arbiter.release()
+
+
+def test_priority_order():
+    arbiter = sdk.BusArbiter()
+    order = []
+
+    def worker(name, priority):
+        with arbiter.transaction(priority):
+            order.append(name)
+
+    arbiter.acquire()
+    threads = []
+    # queued while the lock is held, lowest priority first
+    for name, priority in (('config', sdk.BUS_PRIORITY_CONFIG), ('telemetry', sdk.BUS_PRIORITY_TELEMETRY),
+                           ('motion', sdk.BUS_PRIORITY_MOTION), ('telemetry2', sdk.BUS_PRIORITY_TELEMETRY)):
+        thread = threading.Thread(target=worker, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: len(arbiter.waiting) == len(threads))
+    arbiter.release()
+    for thread in threads:
+        thread.join()
+    # by priority, first come first served within one
+    assert order == ['motion', 'telemetry', 'telemetry2', 'config']
+
+
+def test_thread_priority():
+    arbiter = sdk.BusArbiter()
+    assert arbiter.getThreadPriority() == sdk.BUS_PRIORITY_NORMAL
+    arbiter.setThreadPriority(sdk.BUS_PRIORITY_MOTION)
+    assert arbiter.getThreadPriority() == sdk.BUS_PRIORITY_MOTION
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(arbiter.getThreadPriority()))
+    thread.start()
+    thread.join()
+    assert seen == [sdk.BUS_PRIORITY_NORMAL]
+
+
+def test_interrupted_waiter_leaves_queue():
+    arbiter = sdk.BusArbiter()
+    arbiter.acquire()
+    errors = []
+
+    def interrupted():
+        def wait(*args):
+            raise KeyboardInterrupt
+        arbiter.condition.wait = wait
+        try:
+            arbiter.acquire()
+        except KeyboardInterrupt as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=interrupted)
+    thread.start()
+    thread.join()
+    del arbiter.condition.wait
+    assert errors and not arbiter.waiting
+
+    arbiter.release()
+    acquired = []
+    thread = threading.Thread(target=lambda: (arbiter.acquire(), acquired.append(True), arbiter.release()))
+    thread.start()
+    thread.join(2.0)
+    assert acquired
+
+
+def test_transactions_of_threads_do_not_mix(port, ph):
+    port.setArbiter(sdk.BusArbiter())
+    results = {}
+
+    def reader(scs_id):
+        values = []
+        for _ in range(20):
+            value, result, _ = ph.read1ByteTxRx(port, scs_id, sdk.STS_CONTROL_TABLE['id'].address)
+            values.append((value, result))
+        results[scs_id] = values
+
+    threads = [threading.Thread(target=reader, args=(scs_id,)) for scs_id in (1, 2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for scs_id in (1, 2, 3):
+        assert results[scs_id] == [(scs_id, sdk.COMM_SUCCESS)] * 20
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import scservo_sdk as sdk
+
+
+def goal_write(port, ph, deadband, refresh_period=None):
+    group = sdk.GroupSyncWrite(port, ph, sdk.STS_CONTROL_TABLE['goal_position'].address, 2)
+    group.setDeltaMode(deadband, refresh_period, sign_bit=15)
+    for scs_id in (1, 2, 3):
+        group.setRegister(scs_id, sdk.STS_CONTROL_TABLE['goal_position'], 2048)
+    return group
+
+
+def goals(bus):
+    return [bus.servos[scs_id].get('goal_position') for scs_id in (1, 2, 3)]
+
+
+def test_delta_first_packet_sends_every_servo(port, ph, bus):
+    group = goal_write(port, ph, deadband=5)
+    for scs_id in (1, 2, 3):
+        group.setRegister(scs_id, sdk.STS_CONTROL_TABLE['goal_position'], 1000 + scs_id)
+    assert group.txPacket() == sdk.COMM_SUCCESS
+    assert goals(bus) == [1001, 1002, 1003]
+    assert group.getDeltaStats()['frames_sent'] == 1
+
+
+def test_delta_sends_only_moved_servos(port, ph, bus):
+    group = goal_write(port, ph, deadband=5)
+    group.txPacket()
+    bus.servos[1].set('goal_position', 0)
+    bus.servos[3].set('goal_position', 0)
+
+    group.setRegister(1, sdk.STS_CONTROL_TABLE['goal_position'], 2048 + 3)  # inside the deadband
+    group.setRegister(2, sdk.STS_CONTROL_TABLE['goal_position'], 2048 + 100)
+    assert group.txPacket() == sdk.COMM_SUCCESS
+    # servos 1 and 3 are not in the packet, they keep the value set behind the group's back
+    assert goals(bus) == [0, 2148, 0]
+
+    stats = group.getDeltaStats()
+    assert stats['frames_sent'] == 2
+    assert stats['bytes_saved'] == 2 * (1 + 2)  # two slots of id + data left out
+
+
+def test_delta_skips_frame_without_changes(port, ph, bus):
+    group = goal_write(port, ph, deadband=5)
+    group.txPacket()
+    instructions = bus.instructions
+    group.setRegister(2, sdk.STS_CONTROL_TABLE['goal_position'], 2048 - 5)
+    assert group.txPacket() == sdk.COMM_SUCCESS
+    assert bus.instructions == instructions
+    assert group.getDeltaStats()['frames_skipped'] == 1
+
+
+def test_delta_negative_values(port, ph, bus):
+    group = goal_write(port, ph, deadband=5)
+    group.txPacket()
+    group.setRegister(1, sdk.STS_CONTROL_TABLE['goal_position'], -10)
+    group.txPacket()
+    assert bus.servos[1].get('goal_position') == -10
+    assert group.getValue(1) == -10
+
+
+def test_delta_refresh_sends_every_servo(port, ph, bus):
+    group = goal_write(port, ph, deadband=5, refresh_period=0)
+    group.txPacket()
+    bus.servos[2].set('goal_position', 0)
+    assert group.txPacket() == sdk.COMM_SUCCESS
+    assert goals(bus) == [2048, 2048, 2048]
+
+
+def test_short_data_padded_in_both_paths(port, ph):
+    changed = sdk.GroupSyncWrite(port, ph, 42, 2)
+    changed.addParam(1, [0x00, 0x08])
+    changed.addParam(2, [0x10, 0x02])
+    changed.makeParam()
+    changed.changeParam(1, [0x05])
+
+    built = sdk.GroupSyncWrite(port, ph, 42, 2)
+    built.addParam(1, [0x05])
+    built.addParam(2, [0x10, 0x02])
+    built.makeParam()
+    assert bytes(changed.frame.getFrame()) == bytes(built.frame.getFrame())
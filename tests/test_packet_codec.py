@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from scservo_sdk.packet_codec import PacketDecoder, PacketEncoder, SyncWriteFrame
+from scservo_sdk.sim_port_handler import SimBus
+from scservo_sdk.scservo_def import *
+
+
+def status(scs_id, params=b''):
+    return bytes(SimBus().statusPacket(scs_id, params))
+
+
+def test_decoder_packet_split_over_feeds():
+    decoder = PacketDecoder()
+    packet = status(1, b'\x00\x08')
+    for idx in range(len(packet) - 1):
+        decoder.feed(packet[idx:idx + 1])
+        assert decoder.next() == (None, COMM_RX_WAITING)
+    decoder.feed(packet[-1:])
+    assert decoder.next() == (packet, COMM_SUCCESS)
+    assert decoder.pending() == 0
+
+
+def test_decoder_burst_in_one_feed():
+    decoder = PacketDecoder()
+    packets = [status(scs_id, bytes((scs_id, 0))) for scs_id in (1, 2, 3)]
+    decoder.feed(b''.join(packets))
+    assert [decoder.next() for _ in packets] == [(packet, COMM_SUCCESS) for packet in packets]
+    assert decoder.next() == (None, COMM_RX_WAITING)
+
+
+def test_decoder_drops_junk_before_header():
+    decoder = PacketDecoder()
+    packet = status(5)
+    decoder.feed(b'\x00\x12\xff' + packet)
+    assert decoder.next() == (packet, COMM_SUCCESS)
+    assert decoder.dropped_bytes == 3
+
+
+def test_decoder_skips_invalid_fields():
+    decoder = PacketDecoder()
+    packet = status(5)
+    # 0xFE is not a valid status packet id, the header is dropped a byte at a time
+    decoder.feed(b'\xff\xff\xfe' + packet)
+    assert decoder.next() == (packet, COMM_SUCCESS)
+
+
+def test_decoder_checksum_error_consumes_packet():
+    decoder = PacketDecoder()
+    bad = bytearray(status(1, b'\x00\x08'))
+    bad[-1] ^= 0xFF
+    good = status(2, b'\x00\x08')
+    decoder.feed(bytes(bad) + good)
+    assert decoder.next() == (bytes(bad), COMM_RX_CORRUPT)
+    assert decoder.next() == (good, COMM_SUCCESS)
+    assert decoder.checksum_errors == 1
+
+
+def test_decoder_keeps_trailing_header_byte():
+    decoder = PacketDecoder()
+    packet = status(1)
+    decoder.feed(b'\x00\x00' + packet[:1])
+    assert decoder.next() == (None, COMM_RX_WAITING)
+    decoder.feed(packet[1:])
+    assert decoder.next() == (packet, COMM_SUCCESS)
+
+
+def test_decoder_clear_returns_pending():
+    decoder = PacketDecoder()
+    decoder.feed(b'\xff\xff\x01')
+    decoder.next()
+    assert decoder.clear() == b'\xff\xff\x01'
+    assert decoder.pending() == 0
+
+
+def compiled(data_dict, start_address=42, data_length=2):
+    frame = SyncWriteFrame(start_address, data_length)
+    return bytes(frame.compile(data_dict))
+
+
+def test_sync_write_frame_update_matches_compile():
+    frame = SyncWriteFrame(42, 2)
+    frame.compile({1: [0x00, 0x08], 2: [0x10, 0x02], 3: [0xff, 0x0f]})
+    assert frame.update(2, [0x34, 0x12])
+    assert frame.update(3, [0x00, 0x00])
+    assert bytes(frame.getFrame()) == compiled({1: [0x00, 0x08], 2: [0x34, 0x12], 3: [0x00, 0x00]})
+
+
+def test_sync_write_frame_update_unknown_id():
+    frame = SyncWriteFrame(42, 2)
+    frame.compile({1: [0x00, 0x08]})
+    assert not frame.update(7, [0x00, 0x00])
+
+
+def test_sync_write_frame_pads_short_data():
+    frame = SyncWriteFrame(42, 2)
+    frame.compile({1: [0x00, 0x08], 2: [0x10, 0x02]})
+    frame.update(1, [0x05])
+    assert bytes(frame.getFrame()) == compiled({1: [0x05, 0x00], 2: [0x10, 0x02]})
+
+
+def test_sync_write_frame_matches_encoder():
+    param = [1, 0x00, 0x08, 2, 0x10, 0x02]
+    frame = bytes(PacketEncoder().syncWrite(42, 2, param, len(param)))
+    assert frame == compiled({1: [0x00, 0x08], 2: [0x10, 0x02]})
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import pytest
+
+import scservo_sdk as sdk
+
+
+@pytest.fixture
+def policy(ph):
+    # short timeouts, the missing replies are not waited for at the default 34 ms
+    policy = sdk.RetryPolicy(max_attempts=3, timeout_ms=2)
+    ph.setRetryPolicy(policy)
+    return policy
+
+
+def test_read_retried_on_timeout(port, ph, bus, policy):
+    bus.drop_rate = 1.0
+    _, result, _ = ph.read2ByteTxRx(port, 1, 56)
+    assert result == sdk.COMM_RX_TIMEOUT
+    assert bus.instructions == 3
+    assert policy.getStats()['retries'] == 2
+    assert policy.getStats()['failed'] == 1
+
+
+def test_write_retried_on_corrupt(port, ph, bus, policy):
+    bus.noise_rate = 1.0
+    result, _ = ph.write1ByteTxRx(port, 1, 40, 0)
+    assert result in (sdk.COMM_RX_CORRUPT, sdk.COMM_RX_TIMEOUT)
+    assert bus.instructions == 3
+
+
+def test_retry_recovers(port, ph, bus, policy):
+    bus.drop_rate = 1.0
+    original = bus.reply
+
+    def reply(replies, packet, start):
+        # only the second attempt gets its status packet
+        if bus.instructions == 2:
+            bus.drop_rate = 0.0
+        return original(replies, packet, start)
+
+    bus.reply = reply
+    value, result, _ = ph.read2ByteTxRx(port, 1, 56)
+    assert result == sdk.COMM_SUCCESS
+    assert value == 2048
+    assert policy.getStats()['recovered'] == 1
+
+
+def test_ping_not_retried(port, ph, bus, policy):
+    _, result, _ = ph.ping(port, 7, read_model=False)
+    assert result == sdk.COMM_RX_TIMEOUT
+    assert bus.instructions == 1
+
+
+def test_reg_write_not_retried(port, ph, bus, policy):
+    bus.drop_rate = 1.0
+    result, _ = ph.regWriteTxRx(port, 1, 42, 2, [0x00, 0x04])
+    assert result == sdk.COMM_RX_TIMEOUT
+    assert bus.instructions == 1
+
+
+def test_tx_fail_not_retried(port, ph, bus, policy):
+    port.writePort = lambda packet: 0
+    _, result, _ = ph.read2ByteTxRx(port, 1, 56)
+    assert result == sdk.COMM_TX_FAIL
+    assert policy.getStats()['retries'] == 0
+
+
+def test_broadcast_not_retried(port, ph, bus, policy):
+    result = ph.write1ByteTxOnly(port, sdk.BROADCAST_ID, 40, 1)
+    assert result == sdk.COMM_SUCCESS
+    assert bus.instructions == 1
+
+
+def test_default_policy_single_attempt(port, ph, bus):
+    bus.drop_rate = 1.0
+    port.setPacketTimeoutMillis(2)
+    _, result, _ = ph.read2ByteTxRx(port, 1, 56)
+    assert result == sdk.COMM_RX_TIMEOUT
+    assert bus.instructions == 1
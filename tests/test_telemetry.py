@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import warnings
+
+import numpy as np
+import pytest
+
+import scservo_sdk as sdk
+
+MS = 1000000
+
+
+@pytest.fixture
+def poller(port, ph):
+    return sdk.TelemetryPoller(port, ph, (1, 2, 3), cycle_ms=10.0, budget_ms=8.0)
+
+
+def scheduled(poller, costs):
+    # groups with fixed costs in ms, poll() only records the order
+    polled = []
+
+    def poll(group, now):
+        polled.append(group.name)
+        return group.cost
+
+    poller.poll = poll
+    groups = []
+    for name, cost in costs:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            group = poller.addGroup(name, ('present_position',), 10.0)
+        group.cost = int(cost * MS)
+        groups.append(group)
+    return polled, groups
+
+
+def test_most_overdue_group_first(poller):
+    polled, (fast, slow) = scheduled(poller, (('fast', 1.0), ('slow', 1.0)))
+    fast.deadline = 5 * MS
+    slow.deadline = 2 * MS
+    assert poller.runOnce(10 * MS) == 2 * MS
+    assert polled == ['slow', 'fast']
+
+
+def test_group_not_due_is_not_polled(poller):
+    polled, (group,) = scheduled(poller, (('late', 1.0),))
+    group.deadline = 20 * MS
+    poller.runOnce(10 * MS)
+    assert polled == []
+
+
+def test_group_over_remaining_budget_deferred(poller):
+    polled, (first, second) = scheduled(poller, (('first', 5.0), ('second', 5.0)))
+    first.deadline = 0
+    second.deadline = 1 * MS
+    poller.runOnce(10 * MS)
+    assert polled == ['first']
+    assert second.deferred == 1
+
+    # the deferred group is the most overdue one next cycle
+    poller.runOnce(11 * MS)
+    assert polled == ['first', 'second']
+    assert first.deferred == 1
+
+
+def test_group_over_whole_budget_not_starved(poller):
+    # e.g. 40 servos at 115200 baud, about 32 ms against the 8 ms budget
+    polled, (group,) = scheduled(poller, (('big', 32.0),))
+    now = 0
+    for _ in range(5):
+        poller.runOnce(now)
+        now += 10 * MS
+    assert polled == ['big'] * 5
+    assert group.deferred == 0
+
+
+def test_group_over_whole_budget_warns(port, ph):
+    port.setBaudRate(115200)
+    poller = sdk.TelemetryPoller(port, ph, range(1, 41), cycle_ms=10.0)
+    with pytest.warns(UserWarning):
+        poller.addGroup('motion', ('present_position', 'present_speed'), 10.0)
+
+
+def test_poll_fills_rings(poller, bus):
+    poller.addGroup('motion', ('present_position', 'present_speed'), 10.0)
+    bus.servos.pop(3)
+    poller.runOnce(0)
+    values, now = poller.latest('present_position')
+    assert now > 0
+    assert values[:2].tolist() == [2048, 2048]
+    assert np.isnan(values[2])
+    assert poller.latest('present_position', 1) == (2048, now)
+
+
+def test_ring_history_wraps():
+    ring = sdk.TelemetryRing(4, 1)
+    for idx in range(6):
+        ring.append([idx], idx)
+    values, times = ring.history()
+    assert times.tolist() == [2, 3, 4, 5]
+    assert ring.history(2)[1].tolist() == [4, 5]